@@ -1,491 +1,676 @@
-import datetime
+import sqlite3
 import time
 import json
 
-import sqlite3
-
-from flask import Flask, render_template, request, redirect, url_for
+import click
+from flask import Blueprint, Flask, Response, current_app, request, stream_with_context
 from flask.json import jsonify
 
 from config import Config
 
-from sensors.forms.forms import SensorForm, CustomSearchForm, ReadingForm
-from sensors.validators.validators import reading_is_valid, is_valid_type, CUSTOM_SEARCH_ERRORS
+from sensors.alerts import alerts
+from sensors.binary import binary
+from sensors.cache import cache
+from sensors.database import database
+from sensors.database import pagination
+from sensors.database.database import get_db, init_db, database_path, PRAGMAS
+from sensors.export import export
+from sensors.hotstore import hotstore
+from sensors.importer import importer
+from sensors.ingest import ingest
+from sensors.metrics import metrics
+from sensors.partitions import partitions
+from sensors.services import services
+from sensors.stats import rollups
+from sensors.stats import stats
+from sensors.validators.validators import is_valid_type, CUSTOM_SEARCH_ERRORS, BATCH_ERRORS, PAGINATION_ERRORS, \
+    ROLLUP_ERRORS, INGEST_ERRORS, EXPORT_ERRORS, STATS_ERRORS, READINGS_TYPES, STATISTICS, stats_request_is_valid, \
+    is_valid_grouping, date_range_is_valid
 
-from flask_bootstrap import Bootstrap
 
-from statistics import median_high, mean
-import numpy as np
+api = Blueprint('api', __name__)
+commands = Blueprint('commands', __name__, cli_group=None)
 
 
-app = Flask(__name__)
-app.config.from_object(Config)
-Bootstrap(app)
+def create_app(config=Config):
+    """
+    Builds the app with the given configuration. The database schema is not touched here, it is brought
+    up to date by flask init-db (see the README), so workers start without opening the database.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config)
 
-client = app.test_client
+    database.init_app(app)
+    cache.init_app(app)
+    metrics.init_app(app)
+    alerts.init_app(app)
 
-# Setup the SQLite DB
-conn = sqlite3.connect('database.db')
-conn.execute('CREATE TABLE IF NOT EXISTS readings (device_uuid TEXT, type TEXT, value INTEGER, date_created INTEGER)')
-conn.close()
+    app.register_blueprint(api)
+    app.register_blueprint(commands)
+    if app.config['UI_ENABLED']:
+        # The pages pull in WTForms and Flask-Bootstrap, an API only worker does without them
+        from sensors.ui import ui
+        ui.init_app(app)
 
+    return app
 
-# ----- USER INTERFACE SECTION -----
 
+# ----- ENDPOINTS SECTION -----
 
-@app.route('/', methods=['GET'])
-def index():
+
+def json_chunks(data):
+    return [json.dumps(data, sort_keys=True)], {}
+
+
+def json_array_chunks(items):
     """
-        This function returns the sensors registered in the database (UI)
+    Encodes the items one by one as a JSON array while they are produced
     """
-    conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
+    yield '['
+    separator = ''
+    for item in items:
+        yield separator + json.dumps(item, sort_keys=True)
+        separator = ','
+    yield ']'
 
-    cur.execute('select distinct device_uuid from readings order by date_created')
-    rows = cur.fetchall()
 
-    sensors = jsonify([dict(zip(['device_uuid'], row)) for row in rows])
+def paged_readings(find_readings, *args):
+    """
+    Streams the page of readings selected by the limit, after and format query parameters
+    """
+    limit = request.args.get('limit')
+    after = request.args.get('after')
+    ndjson = request.args.get('format') == 'ndjson' or \
+        request.accept_mimetypes.best == pagination.NDJSON_MIMETYPE
 
-    form = SensorForm()
-    custom_search_form = CustomSearchForm()
+    try:
+        limit = int(limit) if limit is not None else None
+    except ValueError:
+        return PAGINATION_ERRORS[1], 400
+    if limit is not None and not 1 <= limit <= current_app.config['PAGINATION_MAX_LIMIT']:
+        return PAGINATION_ERRORS[1], 400
 
-    return render_template('index.html', sensors=sensors, form=form, custom_search_form=custom_search_form)
+    try:
+        rows, next_cursor = find_readings(*args, after=after, limit=limit)
+    except ValueError:
+        return PAGINATION_ERRORS[0], 400
 
+    return pagination.readings_response(rows, next_cursor, ndjson)
 
-@app.route('/readings/<string:device_uuid>/', methods=['POST', 'GET'])
-def ui_request_device_readings(device_uuid):
+
+@api.route('/devices/<string:device_uuid>/readings/', methods=['POST', 'GET'])
+def request_device_readings(device_uuid):
     """
-    This function allows clients to POST or GET data specific sensor types (UI)
+    This function allows clients to POST or GET data specific sensor types
 
     POST Parameters:
     * type -> The type of sensor (temperature or humidity)
     * value -> The integer value of the sensor reading
     * date_created -> The epoch date of the sensor reading (default now).
-    """
 
-    form = ReadingForm()
+    With INGEST_MODE=async the reading is queued and answered with 202 (503 when the queue is full).
+
+    GET Query Parameters (optional):
+    * limit -> The number of readings per page (the next page cursor is sent in the X-Next-Cursor header)
+    * after -> The cursor the page starts after
+    * format -> ndjson to stream one reading per line instead of a JSON array
+    """
 
     if request.method == 'POST':
-        form_json = {
-            'date_created': request.form.get('date_created'),
-            'type': request.form.get('type'),
-            'value': request.form.get('value'),
-        }
-        response = client().post('/devices/{}/readings/'.format(device_uuid), data=json.dumps(form_json))
-        if response.status_code == 201:
+        # Grab the post parameters
+        post_data = json.loads(request.data)
+        sensor_type = post_data.get('type')
+        value = post_data.get('value')
+        date_created = post_data.get('date_created', int(time.time()))
+
+        if current_app.config['INGEST_MODE'] == 'async':
+            # Queue the reading for the background writer
+            is_valid, result = services.queue_reading(device_uuid, sensor_type, value, date_created)
+            if is_valid:
+                return 'accepted', 202
+            if result == INGEST_ERRORS[0]:
+                return result, 503, {'Retry-After': '1'}
+            return result, 400
+
+        is_valid, result = services.add_reading(device_uuid, sensor_type, value, date_created)
+
+        if is_valid:
             # Return success
-            return redirect(url_for('ui_request_device_readings', device_uuid=device_uuid))
+            return 'success', 201
         else:
-            return redirect(url_for('ui_request_device_readings', device_uuid=device_uuid, error=response.data))
-
+            return result, 400
     else:
-        readings = client().get('/devices/{}/readings/'.format(device_uuid))
-        return render_template('detail.html', sensors=readings, device_uuid=device_uuid, form=form)
+        # Stream the requested page of readings
+        return paged_readings(services.device_readings, device_uuid)
 
 
-@app.route('/new/<string:device_uuid>/', methods=['POST'])
-def ui_register_new_sensor(device_uuid):
+@api.route('/devices/<string:device_uuid>/readings/batch/', methods=['POST'])
+def request_device_readings_batch(device_uuid):
     """
-    This function allows clients to POST a new sensor data. (UI)
+    This function allows clients to POST many readings of a device at once,
+    as a JSON array, as NDJSON (Content-Type: application/x-ndjson) or in the
+    compact binary layout of sensors.binary (Content-Type: application/vnd.sensors.readings),
+    in which case only the rejected readings are listed in the results
 
-    POST Parameters:
+    POST Parameters (per reading):
     * type -> The type of sensor (temperature or humidity)
     * value -> The integer value of the sensor reading
-    * date_created -> The epoch date of the sensor reading (default to now).
+    * date_created -> The epoch date of the sensor reading (default now).
     """
 
-    conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-
-    # Grab the post parameters
-    sensor_type = request.form.get('type')
-    value = request.form.get('value')
-    date_created = request.form.get('date_created')
-
-    is_valid, result = reading_is_valid(sensor_type, value)
+    if request.mimetype == binary.BINARY_MIMETYPE:
+        try:
+            results, accepted = services.add_binary_readings(device_uuid, request.get_data())
+        except ValueError:
+            return BATCH_ERRORS[0], 400
+        if not accepted and not results:
+            return BATCH_ERRORS[0], 400
+        return jsonify({'accepted': accepted, 'rejected': len(results), 'results': results}), \
+            201 if accepted else 400
+
+    # Grab the batch, one reading per array item or per NDJSON line
+    try:
+        if request.mimetype == pagination.NDJSON_MIMETYPE:
+            readings = []
+            for line in request.get_data(as_text=True).splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    readings.append(json.loads(line))
+                except ValueError:
+                    readings.append(None)
+        else:
+            readings = json.loads(request.data)
+    except ValueError:
+        return BATCH_ERRORS[0], 400
 
-    if is_valid:
-        # Insert data into db
-        cur.execute('insert into readings (device_uuid,type,value,date_created) VALUES (?,?,?,?)',
-                    (device_uuid, sensor_type, value, date_created))
+    if not isinstance(readings, list) or not readings:
+        return BATCH_ERRORS[0], 400
 
-        conn.commit()
+    results, accepted = services.add_readings(device_uuid, readings)
 
-        # Return success
-        return redirect(url_for('index'))
-    else:
-        return redirect(url_for('index', error=result))
+    return jsonify({'accepted': accepted, 'rejected': len(results) - accepted, 'results': results}), \
+        201 if accepted else 400
 
 
-@app.route('/custom/search/', methods=['POST'])
-def ui_get_readings_by_type_or_date_range():
+@api.route('/custom/search/<string:option>', methods=['POST'])
+def get_readings_by_type_or_date_range(option):
     """
-    This endpoint allows clients to GET sensors readings by type or date range (UI)
+    This endpoint allows clients to GET sensors readings by type or date range.
 
     Optional Query Parameters
     * type -> The type of sensor value a client is looking for
     * start -> The epoch start time for a sensor being searched
     * end -> The epoch end time for a sensor being searched
+
+    Pagination Query Parameters (optional):
+    * limit -> The number of readings per page (the next page cursor is sent in the X-Next-Cursor header)
+    * after -> The cursor the page starts after
+    * format -> ndjson to stream one reading per line instead of a JSON array
     """
-    conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
 
     # Grab the post parameters
-    selected_type = request.form.get('available_types')
-
-    if int(selected_type) == 0:
-        type = request.form.get('type')
-        selected_search = 'Sensor Type: ' + type.capitalize()
-        cur.execute('select * from readings where type="{}"'.format(type))
-    elif int(selected_type) == 1:
-        start_date = request.form.get('start_date')
-        end_date = request.form.get('end_date')
-        selected_search = 'Date Range: Start: ' + start_date + ' End: ' + end_date
-        start_date_time_obj = int(datetime.datetime.strptime(start_date, '%d/%m/%Y').timestamp())
-        end_date_time_obj = int(datetime.datetime.strptime(end_date, '%d/%m/%Y').replace(
-            hour=23, minute=59, second=59).timestamp())
-        cur.execute('select * from readings where date_created>="{}" and date_created<="{}"'.format(
-            start_date_time_obj, end_date_time_obj))
-    else:
-        return redirect(url_for('index', custom_search_error=CUSTOM_SEARCH_ERRORS[0]))
-
-    rows = cur.fetchall()
+    selected_type = option
 
-    sensors = jsonify([dict(zip(['device_uuid', 'type', 'value', 'date_created'], row)) for row in rows])
+    post_data = json.loads(request.data)
 
-    return render_template('search_results.html', sensors=sensors, selected_search=selected_search)
+    if selected_type == 'type':
+        reading_type = post_data.get('type')
+        is_valid, result = is_valid_type(reading_type)
+        if is_valid:
+            return paged_readings(services.readings_by_type, reading_type)
+        else:
+            return result, 400
+    elif selected_type == 'range':
+        is_valid, result = date_range_is_valid(post_data.get('start_date'), post_data.get('end_date'))
+        if not is_valid:
+            return result, 400
+        start_date, end_date = result
+        return paged_readings(services.readings_by_date_range, start_date, end_date)
+    else:
+        return CUSTOM_SEARCH_ERRORS[0], 400
 
 
-@app.route('/readings/<string:device_uuid>/max', methods=['GET'])
-def ui_get_readings_max(device_uuid):
+def device_statistic_response(statistic, device_uuid, compute_statistic, compute_by_type=None):
     """
-    This function allows clients to GET MAX sensor reading
+    Answers a statistic of the device readings, of the readings of the type query parameter only,
+    or of each type of readings (keyed by type, with compute_by_type when given) when the by query parameter is type
     """
+    reading_type = request.args.get('type')
+    grouping = request.args.get('by')
 
-    form = ReadingForm()
+    if reading_type is not None:
+        is_valid, result = is_valid_type(reading_type)
+        if not is_valid:
+            return result, 400
 
-    reading = client().get('/devices/{}/readings/max/'.format(device_uuid))
-    return render_template('detail.html', sensors=reading, device_uuid=device_uuid, form=form)
+    is_valid, result = is_valid_grouping(grouping)
+    if not is_valid:
+        return result, 400
 
+    def compute():
+        if grouping == 'type' and compute_by_type is not None:
+            return json_chunks(compute_by_type(device_uuid))
+        if grouping == 'type':
+            return json_chunks(services.device_stats_by_type(device_uuid, statistic))
+        return json_chunks(compute_statistic(device_uuid, reading_type))
 
-@app.route('/readings/<string:device_uuid>/median', methods=['GET'])
-def ui_get_readings_median(device_uuid):
-    """
-    This function allows clients to GET MEDIAN sensor reading
+    # Return the JSON (cached until a new reading of the device arrives)
+    return cache.cached_response(statistic, device_uuid, compute)
+
+
+@api.route('/devices/<string:device_uuid>/readings/max/', methods=['GET'])
+def request_device_readings_max(device_uuid):
     """
+    This function allows clients to GET MAX sensor reading (the last written one when several hold the max value)
 
-    form = ReadingForm()
+    Optional Query Parameters
+    * type -> Only the readings of this type
+    * by -> type to get the MAX reading of each type, keyed by type
+    """
 
-    reading = client().get('/devices/{}/readings/median/'.format(device_uuid))
-    return render_template('detail.html', sensors=reading, device_uuid=device_uuid, form=form)
+    return device_statistic_response('max', device_uuid, services.device_max)
 
 
-@app.route('/readings/<string:device_uuid>/mean', methods=['GET'])
-def ui_get_readings_mean(device_uuid):
-    """
-    This function allows clients to GET MEAN sensor reading
+@api.route('/devices/<string:device_uuid>/readings/median/', methods=['GET'])
+def request_device_readings_median(device_uuid):
     """
+    This function allows clients to GET MEDIAN sensor reading
 
-    form = ReadingForm()
+    Optional Query Parameters
+    * type -> Only the readings of this type
+    * by -> type to get the MEDIAN readings of each type, keyed by type
+    """
 
-    reading = client().get('/devices/{}/readings/mean/'.format(device_uuid))
-    return render_template('detail.html', sensors=reading, device_uuid=device_uuid, form=form)
+    return device_statistic_response('median', device_uuid, services.device_median)
 
 
-@app.route('/readings/<string:device_uuid>/quartiles', methods=['GET'])
-def ui_get_readings_quartiles(device_uuid):
-    """
-    This function allows clients to GET 1st and 3rd quartiles of sensor readings
+@api.route('/devices/<string:device_uuid>/readings/mean/', methods = ['GET'])
+def request_device_readings_mean(device_uuid):
     """
+    This function allows clients to GET MEAN sensor reading
 
-    form = ReadingForm()
+    Optional Query Parameters
+    * type -> Only the readings of this type
+    * by -> type to get the MEAN of each type, keyed by type
+    """
 
-    readings = client().get('/devices/{}/readings/quartiles/'.format(device_uuid))
-    return render_template('detail.html', sensors=readings, device_uuid=device_uuid, form=form)
+    return device_statistic_response('mean', device_uuid, services.device_mean)
 
 
-@app.route('/readings/summary', methods=['GET'])
-def ui_get_summary():
-    """
-    This function allows clients GET summary of all sensors readings (with statictics)
+@api.route('/devices/<string:device_uuid>/readings/quartiles/', methods=['GET'])
+def request_device_readings_quartiles(device_uuid):
     """
+    This function allows clients to GET 1st and 3rd quartiles of sensor readings
 
-    form = ReadingForm()
-
-    readings = client().get('/summary/')
-    return render_template('detail.html', sensors=readings, device_uuid='Summary', form=form)
+    Optional Query Parameters
+    * type -> Only the readings of this type
+    * by -> type to get the quartiles of each type, keyed by type
+    * start_date -> Only the readings created since this epoch time
+    * end_date -> Only the readings created until this epoch time
+    * exact -> true to compute the quartiles of a date window from the readings instead of estimating them
+      from the hourly sketches
+    """
 
+    # Grab the query parameters
+    start_date = request.args.get('start_date', type=int)
+    end_date = request.args.get('end_date', type=int)
+    exact = request.args.get('exact', 'false').lower() == 'true'
 
-# ----- ENDPOINTS SECTION -----
+    return device_statistic_response(
+        'quartiles', device_uuid,
+        lambda device_uuid, reading_type: services.device_quartiles(device_uuid, reading_type, start_date, end_date,
+                                                                    exact),
+        lambda device_uuid: services.device_quartiles_by_type(device_uuid, start_date, end_date, exact))
 
 
-@app.route('/devices/<string:device_uuid>/readings/', methods=['POST', 'GET'])
-def request_device_readings(device_uuid):
+@api.route('/devices/stats/', methods=['POST'])
+def request_devices_stats():
     """
-    This function allows clients to POST or GET data specific sensor types
+    This endpoint allows clients to get the MAX, MEDIAN, MEAN and QUARTILES
+    of many devices at once, keyed by device UUID
 
     POST Parameters:
-    * type -> The type of sensor (temperature or humidity)
-    * value -> The integer value of the sensor reading
-    * date_created -> The epoch date of the sensor reading (default now).
+    * devices -> The list of device UUIDs (at most 1000)
+    * stats -> The list of statistics among max, median, mean and quartiles (default all of them)
+    * type -> Only the readings of this type (optional)
+    * start_date -> Only the readings created since this epoch time (optional)
+    * end_date -> Only the readings created until this epoch time (optional)
+    * by -> type to get the statistics of each type of readings, keyed by type (optional)
     """
 
-    # Set the db that we want and open the connection
-    if app.config['TESTING']:
-        conn = sqlite3.connect('test_database.db')
-    else:
-        conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-
-    if request.method == 'POST':
-        # Grab the post parameters
+    # Grab the post parameters
+    try:
         post_data = json.loads(request.data)
-        sensor_type = post_data.get('type')
-        value = post_data.get('value')
-        date_created = post_data.get('date_created', int(time.time()))
-
-        is_valid, result = reading_is_valid(sensor_type, value)
-
-        if is_valid:
-            # Insert data into db
-            cur.execute('insert into readings (device_uuid,type,value,date_created) VALUES (?,?,?,?)',
-                        (device_uuid, sensor_type, value, date_created))
+    except ValueError:
+        return STATS_ERRORS[0], 400
+    if not isinstance(post_data, dict):
+        return STATS_ERRORS[0], 400
+    device_uuids = post_data.get('devices')
+    statistics = post_data.get('stats', STATISTICS)
+    reading_type = post_data.get('type')
+    start_date = post_data.get('start_date')
+    end_date = post_data.get('end_date')
+    grouping = post_data.get('by')
+
+    is_valid, result = stats_request_is_valid(device_uuids, statistics)
+    if not is_valid:
+        return result, 400
+
+    is_valid, result = is_valid_grouping(grouping)
+    if not is_valid:
+        return result, 400
+
+    if reading_type is not None:
+        is_valid, result = is_valid_type(reading_type)
+        if not is_valid:
+            return result, 400
 
-            conn.commit()
+    is_valid, result = date_range_is_valid(start_date, end_date)
+    if not is_valid:
+        return result, 400
+    start_date, end_date = result
 
-            # Return success
-            return 'success', 201
-        else:
-            return result, 400
-    else:
-        # Execute the query
-        cur.execute('select * from readings where device_uuid="{}"'.format(device_uuid))
-        rows = cur.fetchall()
+    device_uuids = list(dict.fromkeys(device_uuids))
+    params = json.dumps([device_uuids, statistics, reading_type, start_date, end_date, grouping])
 
-        # Return the JSON
-        return jsonify([dict(zip(['device_uuid', 'type', 'value', 'date_created'], row)) for row in rows]), 200
+    # Return the JSON (cached until a new reading of any device arrives)
+    return cache.cached_response('stats', cache.ALL_DEVICES, lambda: json_chunks(services.devices_stats(
+        device_uuids, statistics, reading_type, start_date, end_date, by_type=grouping == 'type')), params)
 
 
-@app.route('/custom/search/<string:option>', methods=['POST'])
-def get_readings_by_type_or_date_range(option):
+@api.route('/devices/<string:device_uuid>/readings/rollup/', methods=['GET'])
+def request_device_readings_rollup(device_uuid):
     """
-    This endpoint allows clients to GET sensors readings by type or date range.
+    This function allows clients to GET the readings of a device downsampled
+    into time buckets (count, min, max and mean per bucket)
 
-    Optional Query Parameters
-    * type -> The type of sensor value a client is looking for
-    * start -> The epoch start time for a sensor being searched
-    * end -> The epoch end time for a sensor being searched
+    Query Parameters
+    * bucket -> The bucket width: minute, hour, day or a number of seconds (default hour)
+    * type -> Only the readings of this type (optional)
+    * start_date -> The epoch start time of the buckets (optional)
+    * end_date -> The epoch end time of the buckets (optional)
     """
-    # Set the db that we want and open the connection
-    if app.config['TESTING']:
-        conn = sqlite3.connect('test_database.db')
-    else:
-        conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
 
-    # Grab the post parameters
-    selected_type = option
+    # Grab the query parameters
+    width = rollups.bucket_width(request.args.get('bucket', 'hour'))
+    reading_type = request.args.get('type')
+    start_date = request.args.get('start_date', type=int)
+    end_date = request.args.get('end_date', type=int)
 
-    post_data = json.loads(request.data)
+    if width is None:
+        return ROLLUP_ERRORS[0], 400
 
-    if selected_type == 'type':
-        reading_type = post_data.get('type')
+    if reading_type is not None:
         is_valid, result = is_valid_type(reading_type)
-        if is_valid:
-            cur.execute('select * from readings where type="{}"'.format(reading_type))
-        else:
+        if not is_valid:
             return result, 400
-    elif selected_type == 'range':
-        start_date = post_data.get('start_date')
-        end_date = post_data.get('end_date')
-        cur.execute('select * from readings where date_created>="{}" and date_created<="{}"'.format(
-            start_date, end_date))
-    else:
-        return CUSTOM_SEARCH_ERRORS[0], 400
 
-    rows = cur.fetchall()
+    def compute():
+        # The hot store may not have seen yet the readings of other workers the cache key counts
+        hotstore.mark_stale()
+        return json_chunks(services.device_rollup(device_uuid, width, reading_type, start_date, end_date))
 
-    return jsonify([dict(zip(['device_uuid', 'type', 'value', 'date_created'], row)) for row in rows]), 200
+    # Return the JSON (cached until a new reading of the device arrives)
+    return cache.cached_response('rollup', device_uuid, compute)
 
 
-@app.route('/devices/<string:device_uuid>/readings/max/', methods=['GET'])
-def request_device_readings_max(device_uuid):
-    """
-    This function allows clients to GET MAX sensor reading
+@api.route('/summary/', methods=['GET'])
+def request_readings_summary():
     """
+    This endpoint allows clients to GET a full summary
+    of all sensor data in the database per device.
 
-    # Set the db that we want and open the connection
-    if app.config['TESTING']:
-        conn = sqlite3.connect('test_database.db')
-    else:
-        conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-
-    # Execute the query
-    cur.execute('select device_uuid, type, max(value), date_created from readings where device_uuid="{}"'.format(
-        device_uuid))
-    rows = cur.fetchall()
+    Optional Query Parameters
+    * type -> Summarize only the readings of this type
+    * start_date -> Summarize only the readings created since this epoch time
+    * end_date -> Summarize only the readings created until this epoch time
+    * limit -> The number of devices per page (the next page cursor is sent in the X-Next-Cursor header)
+    * after -> The device UUID the page starts after
+    * by -> type to get one summary per device and type of readings
+    """
+
+    # Grab the query parameters
+    reading_type = request.args.get('type')
+    start_date = request.args.get('start_date', type=int)
+    end_date = request.args.get('end_date', type=int)
+    limit = request.args.get('limit', type=int)
+    after = request.args.get('after')
+    grouping = request.args.get('by')
+
+    if reading_type is not None:
+        is_valid, result = is_valid_type(reading_type)
+        if not is_valid:
+            return result, 400
 
-    # Return the JSON
-    return jsonify([dict(zip(['device_uuid', 'type', 'value', 'date_created'], row)) for row in rows]), 200
+    is_valid, result = is_valid_grouping(grouping)
+    if not is_valid:
+        return result, 400
 
+    if limit is not None and not 1 <= limit <= current_app.config['PAGINATION_MAX_LIMIT']:
+        return PAGINATION_ERRORS[1], 400
 
-@app.route('/devices/<string:device_uuid>/readings/median/', methods=['GET'])
-def request_device_readings_median(device_uuid):
-    """
-    This function allows clients to GET MEDIAN sensor reading
-    """
+    def compute():
+        summaries, next_cursor = services.summary(reading_type, start_date, end_date, limit, after,
+                                                  by_type=grouping == 'type')
+        headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+        return json_array_chunks(summaries), headers
 
-    # Set the db that we want and open the connection
-    if app.config['TESTING']:
-        conn = sqlite3.connect('test_database.db')
-    else:
-        conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
+    # Return the JSON (cached until a new reading of any device arrives)
+    return cache.cached_response('summary', cache.ALL_DEVICES, compute)
 
-    # Execute the query
-    cur.execute('select * from readings where device_uuid="{}" order by value'.format(device_uuid))
-    rows = cur.fetchall()
 
-    values = []
+@api.route('/export/', methods=['GET'])
+def request_readings_export():
+    """
+    This endpoint allows clients to GET (download) the readings streamed
+    oldest first, in CSV, NDJSON or the compressed columnar format of sensors.export
 
-    readings = jsonify([dict(zip(['device_uuid', 'type', 'value', 'date_created'], row)) for row in rows]).json
+    Optional Query Parameters
+    * format -> csv (default), ndjson or columnar
+    * device_uuid -> Export only the readings of this device
+    * type -> Export only the readings of this type
+    * start_date -> Export only the readings created since this epoch time
+    * end_date -> Export only the readings created until this epoch time
+    """
 
-    for json in readings:
-        values.append(json.get('value'))
+    # Grab the query parameters
+    export_format = request.args.get('format', 'csv')
+    device_uuid = request.args.get('device_uuid')
+    reading_type = request.args.get('type')
+    start_date = request.args.get('start_date', type=int)
+    end_date = request.args.get('end_date', type=int)
 
-    readings_median_value = median_high(values)
+    if export_format not in export.EXPORT_FORMATS:
+        return EXPORT_ERRORS[0], 400
 
-    median_reading = list(filter(lambda x: x["value"] == readings_median_value, readings))
+    if reading_type is not None:
+        is_valid, result = is_valid_type(reading_type)
+        if not is_valid:
+            return result, 400
 
-    # Return the JSON
-    return jsonify(median_reading), 200
+    # Stream the export, chunk by chunk
+    mimetype, extension = export.EXPORT_FORMATS[export_format]
+    chunks = services.export_readings(export_format, device_uuid, reading_type, start_date, end_date)
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': 'attachment; filename=readings.{}'.format(extension)})
 
 
-@app.route('/devices/<string:device_uuid>/readings/mean/', methods = ['GET'])
-def request_device_readings_mean(device_uuid):
+@api.route('/ingest/stats/', methods=['GET'])
+def request_ingest_stats():
     """
-    This function allows clients to GET MEAN sensor reading
+    This endpoint allows clients to GET the counters of the async ingest queue
+    (queue depth, queued/committed/rejected readings and commit latency)
     """
 
-    # Set the db that we want and open the connection
-    if app.config['TESTING']:
-        conn = sqlite3.connect('test_database.db')
-    else:
-        conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
+    writer = ingest.get_writer()
+    return jsonify(writer.stats() if writer is not None else {'mode': current_app.config['INGEST_MODE']})
 
-    # Execute the query
-    cur.execute('select * from readings where device_uuid="{}" order by value'.format(device_uuid))
-    rows = cur.fetchall()
 
-    values = []
-
-    readings = jsonify([dict(zip(['device_uuid', 'type', 'value', 'date_created'], row)) for row in rows]).json
+@api.route('/metrics', methods=['GET'])
+def request_metrics():
+    """
+    This endpoint allows monitoring systems (Prometheus) to GET the metrics of this worker:
+    latency per route, time and rows per query and accepted/rejected readings
+    """
 
-    for json in readings:
-        values.append(json.get('value'))
+    return metrics.metrics_response()
 
-    readings_mean_value = mean(values)
 
-    # Return the JSON
-    return jsonify({'value': readings_mean_value}), 200
+# ----- COMMANDS SECTION -----
 
 
-@app.route('/devices/<string:device_uuid>/readings/quartiles/', methods=['GET'])
-def request_device_readings_quartiles(device_uuid):
+@commands.cli.command('init-db')
+def init_db_command():
     """
-    This function allows clients to GET 1st and 3rd quartiles of sensor readings
+    Creates the database schema or brings it up to date, to run once per release before starting the workers
     """
+    init_db(database_path())
+    click.echo('Database schema up to date')
 
-    # Set the db that we want and open the connection
-    if app.config['TESTING']:
-        conn = sqlite3.connect('test_database.db')
-    else:
-        conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-
-    # Execute the query
-    cur.execute('select * from readings where device_uuid="{}" order by value'.format(device_uuid))
-    rows = cur.fetchall()
 
-    values = []
+@commands.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """
+    Recomputes the materialized device statistics and rollups from the raw readings (e.g. after a backfill)
+    """
+    stats.rebuild_device_stats(get_db())
+    rollups.rebuild_rollups(get_db())
+    click.echo('Device statistics and rollups rebuilt')
 
-    readings = jsonify([dict(zip(['device_uuid', 'type', 'value', 'date_created'], row)) for row in rows]).json
 
-    for json in readings:
-        values.append(json.get('value'))
+@commands.cli.command('export-readings')
+@click.option('--format', 'export_format', type=click.Choice(sorted(export.EXPORT_FORMATS)), default='csv')
+@click.option('--output', type=click.Path(dir_okay=False, writable=True, allow_dash=True), default='-',
+              help='File the readings are written to (default standard output)')
+@click.option('--device', 'device_uuid', help='Export only the readings of this device')
+@click.option('--type', 'reading_type', type=click.Choice(READINGS_TYPES), help='Export only the readings of this type')
+@click.option('--start-date', type=int, help='Export only the readings created since this epoch time')
+@click.option('--end-date', type=int, help='Export only the readings created until this epoch time')
+@click.option('--chunk-size', type=int, default=export.CHUNK_SIZE, help='Readings fetched at once')
+def export_readings_command(export_format, output, device_uuid, reading_type, start_date, end_date, chunk_size):
+    """
+    Streams the readings out in CSV, NDJSON or the compressed columnar format, reporting the readings per second
+    """
+    report = {}
 
-    quantile1 = np.quantile(values, 0.25)
-    quantile3 = np.quantile(values, 0.75)
+    with click.open_file(output, 'wb') as stream:
+        for chunk in services.export_readings(export_format, device_uuid, reading_type, start_date, end_date,
+                                              chunk_size, report):
+            stream.write(chunk.encode() if isinstance(chunk, str) else chunk)
 
-    # Return the JSON
-    return jsonify({'quartile_1': quantile1, 'quartile_3': quantile3}), 200
+    click.echo('Exported {} readings in {:.2f}s ({:.0f} readings/s)'.format(
+        report['readings'], report['seconds'], report['readings'] / report['seconds'] if report['seconds'] else 0),
+        err=True)
 
 
-@app.route('/summary/', methods=['GET'])
-def request_readings_summary():
+@commands.cli.command('import-readings')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'import_format', type=click.Choice(importer.IMPORT_FORMATS),
+              help='Format of the files (default from their extension: .ndjson/.jsonl or csv)')
+@click.option('--processes', type=int, default=1, help='Processes parsing the files')
+@click.option('--transaction-size', type=int, default=importer.TRANSACTION_SIZE, help='Readings per transaction')
+@click.option('--defer', is_flag=True,
+              help='Drop the indexes and triggers during the import (much faster, needs the app to be stopped)')
+@click.option('--rejected', type=click.File('w'), help='File the rejected lines are written to')
+def import_readings_command(paths, import_format, processes, transaction_size, defer, rejected):
     """
-    This endpoint allows clients to GET a full summary
-    of all sensor data in the database per device.
-    """
-
-    # Set the db that we want and open the connection
-    if app.config['TESTING']:
-        conn = sqlite3.connect('test_database.db')
-    else:
-        conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-
-    # Execute the query
-    cur.execute('select distinct device_uuid from readings')
-    rows = cur.fetchall()
+    Loads readings from CSV files (device_uuid,type,value,date_created, as exported) or NDJSON files
+    (one reading per line), validated with the same rules as the API.
 
-    sensors = jsonify([dict(zip(['device_uuid'], row)) for row in rows])
+    With --defer the indexes and triggers of the readings table are dropped during the load and created
+    again at the end, then the device statistics and rollups are rebuilt: the app must be stopped meanwhile,
+    the readings it would write would be left out of the statistics.
+    """
+    conn = sqlite3.connect(database_path())
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    # The import can be run again after a crash, there is no need to wait for every write to reach the disk
+    conn.execute('PRAGMA synchronous=OFF')
 
-    readings_json_array = []
+    def progress(report):
+        click.echo('{imported} readings imported, {rejected} lines rejected ({rate:.0f} readings/s)'.format(
+            rate=report['imported'] / report['seconds'], **report), err=True)
 
-    for sensor in sensors.json:
-        device_uuid = sensor.get('device_uuid')
-        cur.execute('select count(value) as count, max(value) as max from readings where device_uuid="{}"'.format(device_uuid))
-        rows = cur.fetchall()
+    try:
+        report = importer.import_files(conn, paths, import_format, processes, transaction_size,
+                                       defer=defer, rejected=rejected, progress=progress)
+    finally:
+        conn.close()
 
-        count_max_readings = jsonify([dict(zip(['count', 'max'], row)) for row in rows]).json[0]
-        number_of_readings = count_max_readings.get('count')
-        max_reading_value = count_max_readings.get('max')
+    load_rate = report['imported'] / report['load_seconds'] if report['load_seconds'] else 0
+    click.echo('Imported {imported} readings in {seconds:.2f}s (loaded in {load_seconds:.2f}s, {rate:.0f} readings/s), '
+               '{rejected} lines rejected'.format(rate=load_rate, **report), err=True)
 
-        cur.execute('select * from readings where device_uuid="{}" order by value'.format(device_uuid))
-        rows = cur.fetchall()
 
-        values = []
+@commands.cli.command('partition-readings')
+@click.option('--retention-months', type=int,
+              help='Retire the partitions older than this many months, 0 keeps them all '
+                   '(default PARTITION_RETENTION_MONTHS)')
+@click.option('--retention-mode', type=click.Choice(partitions.RETENTION_MODES),
+              help='compact keeps the hourly/daily rollups of the retired months, drop deletes them too '
+                   '(default PARTITION_RETENTION_MODE)')
+@click.option('--batch-size', type=int, help='Readings moved per transaction (default PARTITION_MOVE_BATCH)')
+def partition_readings_command(retention_months, retention_mode, batch_size):
+    """
+    Moves the readings of past months from the readings table to monthly partitions, then retires the partitions
+    older than the retention. Readings are moved in small transactions, so it can run (e.g. daily, from cron)
+    while the app keeps serving and writing readings.
+    """
+    # The defaults come from the config of the app, only known once the command runs
+    if retention_months is None:
+        retention_months = current_app.config['PARTITION_RETENTION_MONTHS']
+    if retention_mode is None:
+        retention_mode = current_app.config['PARTITION_RETENTION_MODE']
+    if batch_size is None:
+        batch_size = current_app.config['PARTITION_MOVE_BATCH']
 
-        readings = jsonify([dict(zip(['device_uuid', 'type', 'value', 'date_created'], row)) for row in rows]).json
+    conn = sqlite3.connect(database_path())
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
 
-        for json in readings:
-            values.append(json.get('value'))
+    def progress(report):
+        click.echo('{} readings moved'.format(report['moved']), err=True)
 
-        readings_median_value = median_high(values)
-        readings_mean_value = mean(values)
-        quantile1 = np.quantile(values, 0.25)
-        quantile3 = np.quantile(values, 0.75)
+    try:
+        report = partitions.partition_readings(conn, retention_months=retention_months,
+                                               retention_mode=retention_mode, batch_size=batch_size,
+                                               progress=progress)
+    finally:
+        conn.close()
+
+    click.echo('Moved {} readings, created {} partitions ({}), retired {} ({})'.format(
+        report['moved'], len(report['created']), ', '.join(report['created']) or '-', len(report['retired']),
+        ', '.join(report['retired']) or '-'), err=True)
+
+
+@commands.cli.command('build-sketches')
+@click.option('--batch-size', type=int, help='Hours of a device stored per transaction (default 500)')
+def build_sketches_command(batch_size):
+    """
+    Stores the quantile sketches of the complete hours without one (e.g. run hourly, from cron), so the quartiles
+    of a date window only sketch the hours written since in memory. It can run while the app keeps serving
+    and writing readings.
+    """
+    from sensors.stats import sketches
 
-        readings_json_array.append({'device_uuid': device_uuid, 'number_of_readings': number_of_readings,
-                                    'max_reading_value': max_reading_value, 'median_reading_value': readings_median_value,
-                                    'mean_reading_value': readings_mean_value, 'quartile_1_value': quantile1,
-                                    'quartile_3_value': quantile3})
+    conn = sqlite3.connect(database_path())
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
 
-    return jsonify(readings_json_array), 200
+    try:
+        stored = sketches.store_sketches(conn, services.sketch_compression(),
+                                         batch_size=batch_size or sketches.SKETCH_BATCH)
+    finally:
+        conn.close()
+
+    click.echo('Stored {} sketches'.format(stored), err=True)
+
+
+# Module level app for the entry points (wsgi.py, asgi.py) and flask --app app
+app = create_app()
 
 
 if __name__ == '__main__':
+    init_db(database_path(app))
     app.run()
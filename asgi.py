@@ -0,0 +1,56 @@
+"""
+    ASGI entry point serving the same routes as app.py: uvicorn asgi:application
+
+    Connections are handled by the event loop, so idle or slow clients do not pin a worker,
+    while the Flask views (and their SQLite work) run on a bounded thread pool of
+    ASGI_MAX_WORKERS threads, one pooled database connection each. The bridge is a2wsgi's
+    WSGIMiddleware: request bodies are read as the views consume them (Flask answers 413 to the
+    ones above MAX_CONTENT_LENGTH) and a streamed response waits for the client to keep up.
+"""
+from a2wsgi import WSGIMiddleware
+
+from app import app
+
+__author__ = 'vgarcia'
+
+# Bytes of a streamed response gathered before handing them to the event loop
+CHUNK_BYTES = 64 * 1024
+
+
+class CoalescedResponse(object):
+    """
+        WSGI response body yielding the chunks of another one gathered in CHUNK_BYTES pieces, as
+        every piece costs a round trip to the event loop
+    """
+
+    def __init__(self, iterable):
+        self.iterable = iterable
+
+    def __iter__(self):
+        buffered = []
+        size = 0
+        for chunk in self.iterable:
+            buffered.append(chunk)
+            size += len(chunk)
+            if size >= CHUNK_BYTES:
+                yield b''.join(buffered)
+                buffered = []
+                size = 0
+        if buffered:
+            yield b''.join(buffered)
+
+    def close(self):
+        # Ends the request context (and records the request metrics) of a streamed response
+        if hasattr(self.iterable, 'close'):
+            self.iterable.close()
+
+
+def coalesced(wsgi_app):
+    def coalesced_app(environ, start_response):
+        # The body ends with the request, so a chunked one (without Content-Length) can be read to its end
+        environ.setdefault('wsgi.input_terminated', True)
+        return CoalescedResponse(wsgi_app(environ, start_response))
+    return coalesced_app
+
+
+application = WSGIMiddleware(coalesced(app.wsgi_app), workers=app.config['ASGI_MAX_WORKERS'])
@@ -0,0 +1,100 @@
+"""
+    Cost of the alert rules on the ingest path, with --rules active rules (a threshold rule on the temperature
+    and a z-score rule on the humidity of --rules / 2 devices): the readings evaluated per second by the engine
+    alone, and the p50 latency of batches of readings POSTed with the engine and without it, switching
+    between both on every request to even out noise.
+
+    Usage: python -m benchmarks.alerts_overhead [--rules N] [--readings N] [--batch N] [--repeat N]
+                                                [--max-overhead 0.05]
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+from app import app
+from benchmarks.common import describe, measure, synthetic_database, use_database
+from sensors.alerts import alerts
+
+__author__ = 'vgarcia'
+
+
+def build_rules(devices):
+    rules = []
+    for number in range(devices):
+        device_uuid = 'device-{:06d}'.format(number)
+        rules.append(alerts.ThresholdRule('hot', 'temperature', device_uuid=device_uuid, max_value=90))
+        rules.append(alerts.ZScoreRule('spike', 'humidity', device_uuid=device_uuid))
+    return rules
+
+
+def random_readings(devices, count, generator):
+    now = int(time.time())
+    return [('device-{:06d}'.format(generator.randrange(devices)), generator.choice(['temperature', 'humidity']),
+             generator.randint(0, 100), now) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rules', type=int, default=10000)
+    parser.add_argument('--readings', type=int, default=200000, help='readings evaluated by the engine alone')
+    parser.add_argument('--batch', type=int, default=100, help='readings per POSTed batch')
+    parser.add_argument('--repeat', type=int, default=500, help='batches POSTed with and without the engine')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=13)
+    parser.add_argument('--max-overhead', type=float, default=0.05, help='allowed overhead, 0.05 = 5%%')
+    args = parser.parse_args()
+
+    devices = args.rules // 2
+    generator = random.Random(args.seed)
+
+    # The engine alone, sinking the alerts in memory
+    engine = alerts.AlertEngine(build_rules(devices), alerts.QueueAlertSink())
+    readings = random_readings(devices, args.readings, generator)
+    started = time.perf_counter()
+    raised = len(engine.evaluate_many(readings))
+    seconds = time.perf_counter() - started
+
+    # The batch endpoint with and without the engine, switched on every request so both see the same noise
+    use_database(app, synthetic_database(devices=10, readings_per_device=100, seed=args.seed))
+    app.config['CACHE_ENABLED'] = False
+    client = app.test_client()
+    rules = build_rules(devices)
+    alerts.init_app(app, rules=rules, sink=alerts.QueueAlertSink())
+    engines = {False: None, True: app.extensions['alert_engine']}
+    latencies = {False: [], True: []}
+
+    def post_batch():
+        device_uuid = 'device-{:06d}'.format(generator.randrange(devices))
+        body = json.dumps([{'type': reading_type, 'value': value} for _, reading_type, value, _ in
+                           random_readings(devices, args.batch, generator)])
+        response = client.post('/devices/{}/readings/batch/'.format(device_uuid), data=body)
+        if response.status_code != 201:
+            raise RuntimeError('The batch was answered {}'.format(response.status_code))
+
+    for number in range(args.warmup + args.repeat):
+        # Which one runs first changes every time
+        for enabled in (False, True) if number % 2 else (True, False):
+            app.extensions['alert_engine'] = engines[enabled]
+            latency = measure(post_batch, 1)
+            if number >= args.warmup:
+                latencies[enabled].extend(latency)
+    alerts.init_app(app)
+
+    disabled, enabled = describe(latencies[False])['p50_ms'], describe(latencies[True])['p50_ms']
+    overhead = enabled / disabled - 1
+    print(json.dumps({
+        'rules': len(rules),
+        'engine': {'readings_per_second': args.readings / seconds, 'us_per_reading': seconds / args.readings * 1e6,
+                   'alerts': raised},
+        'batch': {'readings': args.batch, 'disabled_p50_ms': disabled, 'enabled_p50_ms': enabled},
+        'overhead': overhead,
+    }, indent=4, sort_keys=True))
+    if overhead > args.max_overhead:
+        print('Alerts overhead {:.1%} is above {:.1%}'.format(overhead, args.max_overhead), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+    Size and decoding cost of a batch of readings in the binary layout of sensors.binary
+    against the JSON array and NDJSON bodies of the batch endpoint: bytes per reading
+    (raw and zlib compressed), decode + validation throughput, and end-to-end POST latency.
+
+    Usage: python -m benchmarks.binary_ingest [--batch N] [--repeat N]
+"""
+import argparse
+import json
+import random
+import time
+import zlib
+
+from app import app
+from benchmarks.common import describe, measure, synthetic_database, use_database
+from sensors.binary import binary
+from sensors.database.pagination import NDJSON_MIMETYPE
+from sensors.validators.validators import readings_are_valid
+
+__author__ = 'vgarcia'
+
+
+def decode_json(body):
+    readings = json.loads(body)
+    return [(reading['type'], int(reading['value']), reading['date_created'])
+            for reading, (is_valid, _) in zip(readings, readings_are_valid(readings)) if is_valid]
+
+
+def decode_ndjson(body):
+    return decode_json('[' + ','.join(body.splitlines()) + ']')
+
+
+def decode_binary(body):
+    types, values, dates = binary.decode_readings(body)
+    valid = binary.validate_readings(types, values) == ''
+    return list(zip(types[valid].tolist(), values[valid].tolist(), dates[valid].tolist()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch', type=int, default=1000, help='readings per batch')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    generator = random.Random(11)
+    now = int(time.time())
+    readings = [{'type': generator.choice(['temperature', 'humidity']), 'value': generator.randint(0, 100),
+                 'date_created': now - args.batch * 60 + index * 60} for index in range(args.batch)]
+
+    formats = {
+        'json': ('application/json', json.dumps(readings).encode(), decode_json),
+        'ndjson': (NDJSON_MIMETYPE, '\n'.join(json.dumps(reading) for reading in readings).encode(), decode_ndjson),
+        'binary': (binary.BINARY_MIMETYPE, binary.encode_readings(readings), decode_binary),
+    }
+
+    use_database(app, synthetic_database(devices=1, readings_per_device=1))
+    client = app.test_client()
+    results = {}
+
+    for name, (mimetype, body, decode) in formats.items():
+        text = body.decode() if name != 'binary' else body
+        decode_stats = describe(measure(lambda: decode(text), args.repeat))
+
+        def post():
+            response = client.post('/devices/device-000000/readings/batch/', data=body, content_type=mimetype)
+            if response.status_code != 201:
+                raise RuntimeError('{} batch answered {}'.format(name, response.status_code))
+
+        post_stats = describe(measure(post, max(1, args.repeat // 10)))
+        results[name] = {
+            'bytes_per_reading': len(body) / args.batch,
+            'zlib_bytes_per_reading': len(zlib.compress(body)) / args.batch,
+            'decoded_readings_per_second': args.batch * 1000 / decode_stats['p50_ms'],
+            'decode_p50_ms': decode_stats['p50_ms'],
+            'post_p50_ms': post_stats['p50_ms'],
+        }
+
+    print(json.dumps(results, indent=4, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
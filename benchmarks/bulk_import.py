@@ -0,0 +1,74 @@
+"""
+    Readings per second of the bulk import (flask import-readings) of a synthetic CSV or NDJSON
+    file into an empty temporary database, with deferred indexes and 1 or more parsing processes.
+    Both the end to end rate and the rate of the load alone (before the schema restore) are reported.
+
+    Usage: python -m benchmarks.bulk_import [--readings N] [--devices N] [--format csv|ndjson] [--processes 1 4]
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from sensors.database.database import PRAGMAS
+from sensors.database.migrations import migrate
+from sensors.importer import importer
+from sensors.validators.validators import READINGS_TYPES
+
+__author__ = 'vgarcia'
+
+
+def synthetic_file(path, import_format, readings, devices, seed=21):
+    generator = random.Random(seed)
+    now = int(time.time())
+    with open(path, 'w') as stream:
+        if import_format == 'csv':
+            stream.write('device_uuid,type,value,date_created\n')
+        for _ in range(readings):
+            reading = ('device-{:06d}'.format(generator.randrange(devices)), generator.choice(READINGS_TYPES),
+                       generator.randint(0, 100), now - generator.randrange(365 * 86400))
+            if import_format == 'csv':
+                stream.write('{},{},{},{}\n'.format(*reading))
+            else:
+                stream.write(json.dumps(dict(zip(['device_uuid', 'type', 'value', 'date_created'], reading))) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readings', type=int, default=2000000)
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--format', dest='import_format', choices=importer.IMPORT_FORMATS, default='csv')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 4])
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='sensors-bench-')
+    path = os.path.join(directory, 'readings.' + args.import_format)
+    synthetic_file(path, args.import_format, args.readings, args.devices)
+    results = {}
+
+    for processes in args.processes:
+        database = os.path.join(directory, 'import-{}.db'.format(processes))
+        conn = sqlite3.connect(database)
+        migrate(conn)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.execute('PRAGMA synchronous=OFF')
+
+        report = importer.import_files(conn, [path], processes=processes, defer=True)
+        conn.close()
+        results['processes_{}'.format(processes)] = {
+            'readings': report['imported'],
+            'seconds': report['seconds'],
+            'readings_per_second': report['imported'] / report['seconds'],
+            # Parsing and inserting only, without recreating the indexes and rebuilding the statistics
+            'load_readings_per_second': report['imported'] / report['load_seconds'],
+        }
+
+    print(json.dumps(results, indent=4, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from sensors.database import queries
+from sensors.database.migrations import migrate
+from sensors.validators.validators import READINGS_TYPES
+
+__author__ = 'vgarcia'
+
+
+def synthetic_database(devices=100, readings_per_device=1000, span=30 * 86400, seed=13, path=None):
+    """
+        Generates a fleet of devices with readings spread over the last "span" seconds into a (temporary) database
+    """
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix='sensors-bench-'), 'bench.db')
+
+    generator = random.Random(seed)
+    now = int(time.time())
+
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    with conn:
+        for device in range(devices):
+            device_uuid = 'device-{:06d}'.format(device)
+            conn.executemany(queries.INSERT_READING, [
+                (device_uuid, generator.choice(READINGS_TYPES), generator.randint(0, 100),
+                 now - generator.randint(0, span)) for _ in range(readings_per_device)
+            ])
+    conn.close()
+    return path
+
+
+def use_database(app, path):
+    """
+        Points the app to the given database file
+    """
+    app.config['TESTING'] = False
+    app.config['DATABASE'] = path
+
+
+def measure(function, repeat):
+    """
+        Calls the function "repeat" times, returning the latency of every call in seconds
+    """
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def percentile(latencies, q):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def describe(latencies):
+    """
+        Throughput and latency percentiles (milliseconds) of a list of latencies
+    """
+    total = sum(latencies)
+    return {
+        'requests': len(latencies),
+        'requests_per_second': len(latencies) / total if total else None,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p90_ms': percentile(latencies, 0.9) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def regressions(results, baseline, tolerance=0.25, metric='p50_ms'):
+    """
+        The routes whose metric got worse than the baseline by more than tolerance (0.25 = 25% slower),
+        as (route, baseline value, current value) tuples. Routes missing from either side are ignored.
+    """
+    slower = []
+    for route, stats in sorted(results.items()):
+        if route not in baseline:
+            continue
+        if stats[metric] > baseline[route][metric] * (1 + tolerance):
+            slower.append((route, baseline[route][metric], stats[metric]))
+    return slower
@@ -0,0 +1,91 @@
+"""
+    Overhead of the metrics (request timing and instrumented SQLite cursors) on every route, reading and
+    writing: each request is run with METRICS_ENABLED off and on in turn (which one first alternating),
+    so both see the same data and the same noise, keeping the fastest of several rounds per route.
+    Both run on the same database, through two pools (the connection class is fixed when a pool is created).
+    The budget is checked per route. Only the requests are timed unless --queries is given
+    (METRICS_QUERIES_ENABLED).
+
+    Usage: python -m benchmarks.metrics_overhead [--devices N] [--readings N] [--repeat N] [--rounds N]
+                                                 [--queries] [--max-overhead 0.02]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+from app import app
+from benchmarks.common import describe, measure, synthetic_database, use_database
+from benchmarks.routes import route_cases
+
+__author__ = 'vgarcia'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--readings', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=200, help='requests per route, with and without the metrics')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=13)
+    parser.add_argument('--queries', action='store_true', help='time every query as well')
+    parser.add_argument('--max-overhead', type=float, default=0.02, help='allowed overhead per route, 0.02 = 2%%')
+    args = parser.parse_args()
+
+    path = synthetic_database(args.devices, args.readings, seed=args.seed)
+    # Two names of the same file, so each mode gets its own pool of connections
+    databases = {False: path, True: os.path.join(os.path.dirname(path), '.', os.path.basename(path))}
+    app.config['CACHE_ENABLED'] = False
+    client = app.test_client()
+    cases = route_cases(args.devices, 30 * 86400, random.Random(args.seed))
+    p50s = {False: {}, True: {}}
+
+    def switch(enabled):
+        use_database(app, databases[enabled])
+        app.config['METRICS_ENABLED'] = enabled
+        app.config['METRICS_QUERIES_ENABLED'] = args.queries
+
+    for round_number in range(args.rounds):
+        for name, method, url, body in cases:
+            latencies = {False: [], True: []}
+            for number in range(args.warmup + args.repeat):
+                request = (url(), body() if body else None)
+
+                def call():
+                    response = client.open(request[0], method=method, data=request[1])
+                    response.get_data()
+                    # As a server does once the body is sent, which records the request metrics
+                    response.close()
+                    if response.status_code >= 400:
+                        raise RuntimeError('{} answered {}'.format(name, response.status_code))
+
+                # Which one runs first changes every time
+                for enabled in (False, True) if (number + round_number) % 2 else (True, False):
+                    switch(enabled)
+                    latency = measure(call, 1)
+                    if number >= args.warmup:
+                        latencies[enabled].extend(latency)
+            for enabled in (False, True):
+                p50s[enabled].setdefault(name, []).append(describe(latencies[enabled])['p50_ms'])
+
+    results = {}
+    for route in sorted(p50s[False]):
+        # The fastest round is the least disturbed by the rest of the machine
+        disabled = min(p50s[False][route])
+        enabled = min(p50s[True][route])
+        results[route] = {'disabled_p50_ms': disabled, 'enabled_p50_ms': enabled, 'overhead': enabled / disabled - 1}
+
+    over = sorted(route for route, result in results.items() if result['overhead'] > args.max_overhead)
+    print(json.dumps({'routes': results, 'max_overhead': max(result['overhead'] for result in results.values())},
+                     indent=4, sort_keys=True))
+    for route in over:
+        print('Metrics overhead of {} {:.1%} is above {:.1%}'.format(route, results[route]['overhead'],
+                                                                     args.max_overhead), file=sys.stderr)
+    if over:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+    Latency of the quartiles of a date window computed from the readings (exact=true) and estimated from
+    the hourly sketches, sketched in memory (before flask build-sketches ran) and once they are stored,
+    the time to store them, and the estimation error (in rank, against the exact quartiles).
+
+    Usage: python -m benchmarks.quantile_sketches [--devices N] [--readings N] [--span SECONDS] [--repeat N]
+"""
+import argparse
+import json
+import sqlite3
+import time
+
+import numpy as np
+
+from app import app
+from benchmarks.common import describe, measure, synthetic_database, use_database
+from sensors.stats import sketches
+
+__author__ = 'vgarcia'
+
+
+def rank_error(values, estimate, q):
+    """
+        Distance between q and the ranks (fractions of the sorted values) the estimate may have
+    """
+    lower = np.searchsorted(values, estimate, 'left') / len(values)
+    upper = np.searchsorted(values, estimate, 'right') / len(values)
+    return max(lower - q, q - upper, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=5)
+    parser.add_argument('--readings', type=int, default=200000, help='readings per device')
+    parser.add_argument('--span', type=int, default=30 * 86400, help='seconds the readings are spread over')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=13)
+    args = parser.parse_args()
+
+    path = synthetic_database(args.devices, args.readings, args.span, args.seed)
+    use_database(app, path)
+    app.config['CACHE_ENABLED'] = False
+    client = app.test_client()
+    # A window not aligned on hours, with partial hours at both ends
+    start_date, end_date = int(time.time()) - args.span + 1234, int(time.time()) - 567
+    device_uuids = ['device-{:06d}'.format(device) for device in range(args.devices)]
+
+    def quartiles(device_uuid, exact=False):
+        url = '/devices/{}/readings/quartiles/?start_date={}&end_date={}'.format(device_uuid, start_date, end_date)
+        response = client.get(url + ('&exact=true' if exact else ''))
+        if response.status_code != 200:
+            raise RuntimeError('{} was answered {}'.format(url, response.status_code))
+        return response.json
+
+    conn = sqlite3.connect(path)
+    errors = []
+    for device_uuid in device_uuids:
+        values = np.sort([row[0] for row in conn.execute(
+            'select value from readings where device_uuid=? and date_created>=? and date_created<=?',
+            (device_uuid, start_date, end_date))])
+        estimates = quartiles(device_uuid)
+        for q, name in ((0.25, 'quartile_1'), (0.75, 'quartile_3')):
+            errors.append(rank_error(values, estimates[name], q))
+    in_memory = describe(measure(lambda: [quartiles(device_uuid) for device_uuid in device_uuids], args.repeat))
+
+    started = time.perf_counter()
+    sketches.store_sketches(conn, sketches.compression())
+    store_seconds = time.perf_counter() - started
+    stored = conn.execute('select count(*), sum(length(sketch)) from readings_sketches').fetchone()
+    conn.close()
+
+    print(json.dumps({
+        'readings_per_device': args.readings,
+        'sketches': {'count': stored[0], 'bytes': stored[1], 'store_seconds': store_seconds},
+        'exact': describe(measure(lambda: [quartiles(device_uuid, True) for device_uuid in device_uuids],
+                                  args.repeat)),
+        'sketches_in_memory': in_memory,
+        'sketches_stored': describe(measure(lambda: [quartiles(device_uuid) for device_uuid in device_uuids],
+                                            args.repeat)),
+        'max_rank_error': max(errors),
+    }, indent=4, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+    Throughput and latency percentiles of every API route over a synthetic fleet
+    (devices x readings per device spread over a time span) in a temporary database.
+
+    The results can be stored as JSON (--output) and compared with a previous run
+    (--baseline): the command fails when a route is slower than the baseline by more
+    than --tolerance on --metric.
+
+    Usage: python -m benchmarks.routes [--devices N] [--readings N] [--span SECONDS] [--repeat N]
+                                       [--output FILE] [--baseline FILE] [--tolerance 0.25] [--metric p50_ms]
+"""
+import argparse
+import json
+import platform
+import random
+import sqlite3
+import sys
+import time
+
+from app import app
+from benchmarks.common import describe, measure, regressions, synthetic_database, use_database
+
+__author__ = 'vgarcia'
+
+
+def route_cases(devices, span, generator):
+    """
+        (name, method, url, body) builders of the benchmarked requests, the writing ones last
+    """
+    now = int(time.time())
+
+    def device():
+        return 'device-{:06d}'.format(generator.randrange(devices))
+
+    def recent_range():
+        start_date = now - generator.randrange(86400)
+        return json.dumps({'start_date': start_date, 'end_date': start_date + 3600})
+
+    def old_range():
+        start_date = now - 86400 - generator.randrange(max(1, span - 86400))
+        return json.dumps({'start_date': start_date, 'end_date': start_date + 3600})
+
+    return [
+        ('device_readings', 'GET', lambda: '/devices/{}/readings/'.format(device()), None),
+        ('device_readings_page', 'GET', lambda: '/devices/{}/readings/?limit=100'.format(device()), None),
+        ('search_type_page', 'POST', lambda: '/custom/search/type?limit=100',
+         lambda: json.dumps({'type': generator.choice(['temperature', 'humidity'])})),
+        ('search_range_recent', 'POST', lambda: '/custom/search/range', recent_range),
+        ('search_range_old', 'POST', lambda: '/custom/search/range', old_range),
+        ('max', 'GET', lambda: '/devices/{}/readings/max/'.format(device()), None),
+        ('median', 'GET', lambda: '/devices/{}/readings/median/'.format(device()), None),
+        ('mean', 'GET', lambda: '/devices/{}/readings/mean/'.format(device()), None),
+        ('quartiles', 'GET', lambda: '/devices/{}/readings/quartiles/'.format(device()), None),
+        ('max_by_type', 'GET', lambda: '/devices/{}/readings/max/?by=type'.format(device()), None),
+        ('rollup_day', 'GET', lambda: '/devices/{}/readings/rollup/?bucket=day'.format(device()), None),
+        ('rollup_minute_recent', 'GET', lambda: '/devices/{}/readings/rollup/?bucket=minute&start_date={}'.format(
+            device(), now - 3600), None),
+        ('summary', 'GET', lambda: '/summary/', None),
+        ('summary_page', 'GET', lambda: '/summary/?limit=10', None),
+        ('summary_filtered', 'GET', lambda: '/summary/?type=temperature&start_date={}'.format(now - 86400), None),
+        ('devices_stats_100', 'POST', lambda: '/devices/stats/',
+         lambda: json.dumps({'devices': [device() for _ in range(100)]})),
+        ('post_reading', 'POST', lambda: '/devices/{}/readings/'.format(device()),
+         lambda: json.dumps({'type': 'temperature', 'value': generator.randint(0, 100)})),
+        ('post_batch_100', 'POST', lambda: '/devices/{}/readings/batch/'.format(device()),
+         lambda: json.dumps([{'type': 'humidity', 'value': generator.randint(0, 100)} for _ in range(100)])),
+    ]
+
+
+def run(client, cases, repeat, warmup):
+    results = {}
+    for name, method, url, body in cases:
+        def call():
+            response = client.open(url(), method=method, data=body() if body else None)
+            response.get_data()
+            if response.status_code >= 400:
+                raise RuntimeError('{} answered {}'.format(name, response.status_code))
+
+        measure(call, warmup)
+        results[name] = describe(measure(call, repeat))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--readings', type=int, default=1000)
+    parser.add_argument('--span', type=int, default=30 * 86400, help='seconds the readings are spread over')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=13)
+    parser.add_argument('--cache', action='store_true', help='keep the response cache enabled')
+    parser.add_argument('--output', help='file the results are written to (JSON)')
+    parser.add_argument('--baseline', help='results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown, 0.25 = 25%%')
+    parser.add_argument('--metric', default='p50_ms', choices=['p50_ms', 'p90_ms', 'p99_ms'])
+    args = parser.parse_args()
+
+    use_database(app, synthetic_database(args.devices, args.readings, args.span, args.seed))
+    app.config['CACHE_ENABLED'] = args.cache
+
+    results = {
+        'parameters': {'devices': args.devices, 'readings': args.readings, 'span': args.span,
+                       'repeat': args.repeat, 'seed': args.seed, 'cache': args.cache,
+                       'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version},
+        'routes': run(app.test_client(), route_cases(args.devices, args.span, random.Random(args.seed)),
+                      args.repeat, args.warmup),
+    }
+
+    print(json.dumps(results, indent=4, sort_keys=True))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=4, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            slower = regressions(results['routes'], json.load(baseline)['routes'], args.tolerance, args.metric)
+        for route, before, after in slower:
+            print('{} regressed: {} {:.3f} -> {:.3f}'.format(route, args.metric, before, after), file=sys.stderr)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
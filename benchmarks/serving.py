@@ -0,0 +1,142 @@
+"""
+    Load test of the two serving modes over the same synthetic fleet: synchronous gunicorn
+    workers running wsgi.py (the Procfile setup) against uvicorn running asgi.py.
+    Every client polls the statistics endpoints of random devices, as dashboards do.
+
+    Usage: python -m benchmarks.serving [--clients N] [--requests N] [--workers N] [--cache]
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks.common import describe, synthetic_database
+
+__author__ = 'vgarcia'
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+URLS = [
+    '/devices/{}/readings/max/',
+    '/devices/{}/readings/median/',
+    '/devices/{}/readings/mean/',
+    '/devices/{}/readings/quartiles/',
+    '/devices/{}/readings/rollup/?bucket=day',
+]
+
+SERVERS = {
+    'wsgi_gunicorn_sync': lambda port, workers: [
+        sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', '127.0.0.1:{}'.format(port),
+        '--log-level', 'warning', 'wsgi:app'],
+    'asgi_uvicorn': lambda port, workers: [
+        sys.executable, '-m', 'uvicorn', '--workers', str(workers), '--port', str(port),
+        '--log-level', 'warning', 'asgi:application'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def get(port, url):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request('GET', url)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def wait_until_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            get(port, '/summary/?limit=1')
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('Server on port {} did not start'.format(port))
+
+
+def load(port, clients, requests, devices, seed=7):
+    """
+        Runs "clients" concurrent clients doing "requests" requests each, returning the latencies,
+        the number of failed requests and the wall time
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients + 1)
+
+    def client(index):
+        generator = random.Random(seed + index)
+        own_latencies = []
+        own_errors = 0
+        barrier.wait()
+        for _ in range(requests):
+            url = generator.choice(URLS).format('device-{:06d}'.format(generator.randrange(devices)))
+            start = time.perf_counter()
+            try:
+                if get(port, url) != 200:
+                    own_errors += 1
+            except OSError:
+                own_errors += 1
+            own_latencies.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(own_latencies)
+            errors.append(own_errors)
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return latencies, sum(errors), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--readings', type=int, default=2000)
+    parser.add_argument('--clients', type=int, default=128)
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--cache', action='store_true', help='keep the response cache enabled')
+    args = parser.parse_args()
+
+    path = synthetic_database(args.devices, args.readings)
+    env = dict(os.environ, DATABASE=path, CACHE_ENABLED='true' if args.cache else 'false')
+    results = {}
+
+    for name, command in SERVERS.items():
+        port = free_port()
+        server = subprocess.Popen(command(port, args.workers), cwd=ROOT, env=env)
+        try:
+            wait_until_ready(port)
+            latencies, errors, wall_time = load(port, args.clients, args.requests, args.devices)
+        finally:
+            server.terminate()
+            server.wait()
+
+        results[name] = describe(latencies)
+        # Clients run concurrently, so the throughput is measured against the wall time
+        results[name]['requests_per_second'] = len(latencies) / wall_time
+        results[name]['errors'] = errors
+
+    print(json.dumps(results, indent=4, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+    Worker spin-up: the time a fresh process takes to import wsgi.py (which builds the app with create_app),
+    with the UI enabled and disabled (UI_ENABLED), the time to its first answered request, and the heavy
+    modules (numpy, WTForms, Flask-Bootstrap) it had imported by then. Every run is a new interpreter,
+    started the way a gunicorn worker is without preload_app.
+
+    Usage: python -m benchmarks.startup [--repeat N] [--max-import-ms N]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.common import describe, synthetic_database
+
+__author__ = 'vgarcia'
+
+HEAVY_MODULES = ['numpy', 'wtforms', 'flask_wtf', 'flask_bootstrap', 'sensors.stats.sketches']
+
+# Run in the child: prints the seconds to import wsgi.py and to answer a first request, and the modules imported by then
+CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+from wsgi import app
+imported = time.perf_counter()
+modules = [name for name in {heavy} if name in sys.modules]
+app.config['TESTING'] = False
+response = app.test_client().get('/summary/')
+answered = time.perf_counter()
+print(json.dumps({{'import': imported - started, 'first_request': answered - started, 'status': response.status_code,
+                  'modules': modules, 'request_modules': [name for name in {heavy} if name in sys.modules]}}))
+'''
+
+
+def spawn(ui_enabled, database):
+    """
+        Starts an interpreter building the app, returning its report and the seconds until it exited
+    """
+    environ = dict(os.environ, UI_ENABLED='true' if ui_enabled else 'false', DATABASE=database,
+                   METRICS_ENABLED='false')
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', CHILD.format(heavy=HEAVY_MODULES)], env=environ, check=True,
+                            stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    report = json.loads(output.stdout)
+    if report['status'] != 200:
+        raise RuntimeError('The first request was answered {}'.format(report['status']))
+    report['process'] = time.perf_counter() - started
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--max-import-ms', type=float, help='fail when the p50 import time (UI disabled) is above')
+    args = parser.parse_args()
+
+    # The schema is set up once, as by flask init-db, the workers do not touch it
+    database = synthetic_database(devices=10, readings_per_device=100)
+
+    results = {}
+    for ui_enabled in (True, False):
+        reports = [spawn(ui_enabled, database) for _ in range(args.repeat)]
+        results['ui_enabled' if ui_enabled else 'ui_disabled'] = {
+            'import_wsgi': describe([report['import'] for report in reports]),
+            'first_request': describe([report['first_request'] for report in reports]),
+            'process': describe([report['process'] for report in reports]),
+            'modules_after_import': reports[0]['modules'],
+            'modules_after_first_request': reports[0]['request_modules'],
+        }
+
+    print(json.dumps(results, indent=4, sort_keys=True))
+    import_ms = results['ui_disabled']['import_wsgi']['p50_ms']
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        print('Importing wsgi.py took {:.1f}ms, above {:.1f}ms'.format(import_ms, args.max_import_ms), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+    Per-page cost of the UI statistics pages: the service layer called directly (current
+    implementation) against the same data fetched through an in-process HTTP round-trip to
+    the JSON API (what the UI routes used to do with app.test_client).
+
+    Usage: python -m benchmarks.ui_pages [--devices N] [--readings N] [--repeat N]
+"""
+import argparse
+import json
+
+from flask import render_template
+
+from app import app
+from benchmarks.common import describe, measure, synthetic_database, use_database
+from sensors.forms.forms import ReadingForm
+from sensors.services import services
+
+__author__ = 'vgarcia'
+
+PAGES = [
+    ('max', services.device_max, '/devices/{}/readings/max/'),
+    ('median', services.device_median, '/devices/{}/readings/median/'),
+    ('mean', services.device_mean, '/devices/{}/readings/mean/'),
+    ('quartiles', services.device_quartiles, '/devices/{}/readings/quartiles/'),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=20)
+    parser.add_argument('--readings', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=500)
+    args = parser.parse_args()
+
+    use_database(app, synthetic_database(args.devices, args.readings))
+    device_uuid = 'device-000000'
+    client = app.test_client()
+    results = {}
+
+    for name, service, url in PAGES:
+        def direct():
+            with app.test_request_context():
+                render_template('detail.html', sensors=service(device_uuid), device_uuid=device_uuid,
+                                form=ReadingForm())
+
+        def round_trip():
+            with app.test_request_context():
+                response = client.get(url.format(device_uuid))
+                render_template('detail.html', sensors=response.json, device_uuid=device_uuid, form=ReadingForm())
+
+        direct_stats = describe(measure(direct, args.repeat))
+        round_trip_stats = describe(measure(round_trip, args.repeat))
+        results[name] = {
+            'direct': direct_stats,
+            'round_trip': round_trip_stats,
+            'overhead_removed_ms': round_trip_stats['p50_ms'] - direct_stats['p50_ms'],
+        }
+
+    print(json.dumps(results, indent=4, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,3 +3,59 @@ import os
 
 class Config(object):
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'UmbaProject2020'
+
+    DATABASE = os.environ.get('DATABASE') or 'database.db'
+    TEST_DATABASE = os.environ.get('TEST_DATABASE') or 'test_database.db'
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE') or 5)
+    DATABASE_POOL_TIMEOUT = int(os.environ.get('DATABASE_POOL_TIMEOUT') or 10)
+
+    # The HTML pages (and their forms and Bootstrap), an API only worker starts faster without them
+    UI_ENABLED = (os.environ.get('UI_ENABLED') or 'true').lower() == 'true'
+
+    # Threads running the views under asgi.py, one pooled connection each
+    ASGI_MAX_WORKERS = int(os.environ.get('ASGI_MAX_WORKERS') or DATABASE_POOL_SIZE)
+    # Larger request bodies are answered 413 without being read
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH') or 16 * 1024 * 1024)
+
+    # Largest page (limit query parameter) of the readings and summary endpoints, larger ones are answered 400
+    PAGINATION_MAX_LIMIT = int(os.environ.get('PAGINATION_MAX_LIMIT') or 10000)
+
+    # Off by default: timing the requests still costs 2-4% of the sub-millisecond ones (benchmarks.metrics_overhead)
+    METRICS_ENABLED = (os.environ.get('METRICS_ENABLED') or 'false').lower() == 'true'
+    # Time every SQLite query too (a few microseconds each), otherwise only the requests are timed
+    METRICS_QUERIES_ENABLED = (os.environ.get('METRICS_QUERIES_ENABLED') or 'false').lower() == 'true'
+    # Queries slower than this are logged with their plan (0 = never), which times every query as well
+    METRICS_SLOW_QUERY_MS = int(os.environ.get('METRICS_SLOW_QUERY_MS') or 0)
+
+    CACHE_ENABLED = (os.environ.get('CACHE_ENABLED') or 'true').lower() == 'true'
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES') or 1024)
+    CACHE_TTL = int(os.environ.get('CACHE_TTL') or 60)
+    # Size bound of the cached responses of a worker, and of a single response (larger ones are streamed, not cached)
+    CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES') or 64 * 1024 * 1024)
+    CACHE_MAX_ENTRY_BYTES = int(os.environ.get('CACHE_MAX_ENTRY_BYTES') or 1024 * 1024)
+
+    HOTSTORE_ENABLED = (os.environ.get('HOTSTORE_ENABLED') or 'true').lower() == 'true'
+    HOTSTORE_WINDOW = int(os.environ.get('HOTSTORE_WINDOW') or 86400)
+    HOTSTORE_MAX_READINGS = int(os.environ.get('HOTSTORE_MAX_READINGS') or 100000)
+    # Readings kept in all by a worker (18 bytes each), every worker holds its own store
+    HOTSTORE_MAX_TOTAL_READINGS = int(os.environ.get('HOTSTORE_MAX_TOTAL_READINGS') or 1000000)
+    HOTSTORE_SYNC_INTERVAL = float(os.environ.get('HOTSTORE_SYNC_INTERVAL') or 1)
+
+    INGEST_MODE = os.environ.get('INGEST_MODE') or 'sync'
+    INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE') or 10000)
+    INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE') or 500)
+    INGEST_FLUSH_INTERVAL = float(os.environ.get('INGEST_FLUSH_INTERVAL') or 0.05)
+
+    # Rank error of the quartiles estimated from the hourly sketches for a date window (0.01 = 1% of the readings)
+    QUANTILE_SKETCH_ERROR = float(os.environ.get('QUANTILE_SKETCH_ERROR') or 0.01)
+
+    # JSON file of alert rules (see sensors.alerts) evaluated on every accepted reading, none by default.
+    # The alerts raised are appended to ALERT_SINK_PATH, one JSON line each.
+    ALERT_RULES = os.environ.get('ALERT_RULES')
+    ALERT_SINK_PATH = os.environ.get('ALERT_SINK_PATH') or 'alerts.ndjson'
+
+    # Readings of past months are moved to monthly partitions by flask partition-readings, the ones older
+    # than PARTITION_RETENTION_MONTHS months (0 = never) are compacted (only their rollups are kept) or dropped
+    PARTITION_RETENTION_MONTHS = int(os.environ.get('PARTITION_RETENTION_MONTHS') or 0)
+    PARTITION_RETENTION_MODE = os.environ.get('PARTITION_RETENTION_MODE') or 'compact'
+    PARTITION_MOVE_BATCH = int(os.environ.get('PARTITION_MOVE_BATCH') or 5000)
@@ -0,0 +1,241 @@
+import collections
+import json
+import math
+import threading
+import time
+
+from flask import current_app
+
+from sensors.metrics import metrics
+from sensors.validators.validators import READINGS_TYPES
+
+__author__ = 'vgarcia'
+
+# Device UUID of the rules that apply to every device
+ANY_DEVICE = '*'
+
+# Readings a z-score rule keeps per device, and readings it needs before raising any alert
+ZSCORE_WINDOW = 60
+ZSCORE_MIN_SAMPLES = 10
+ZSCORE_THRESHOLD = 3.0
+
+
+class AlertSink(object):
+    """
+        Destination of the alerts. A shared one (a message queue, a webhook...) only has to
+        implement emit(alert) for every worker to report to the same place.
+    """
+
+    def emit(self, alert):
+        raise NotImplementedError
+
+
+class FileAlertSink(AlertSink):
+    """
+        Appends every alert to a file as a JSON line
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def emit(self, alert):
+        line = json.dumps(alert, sort_keys=True) + '\n'
+        with self._lock, open(self.path, 'a') as stream:
+            stream.write(line)
+
+
+class QueueAlertSink(AlertSink):
+    """
+        In-process queue of the last max_alerts alerts, e.g. for tests or a consumer thread
+    """
+
+    def __init__(self, max_alerts=10000):
+        self.alerts = collections.deque(maxlen=max_alerts)
+
+    def emit(self, alert):
+        self.alerts.append(alert)
+
+
+class ThresholdRule(object):
+    """
+        Alerts on the readings below min_value or above max_value
+    """
+
+    kind = 'threshold'
+
+    def __init__(self, name, reading_type, device_uuid=ANY_DEVICE, min_value=None, max_value=None):
+        self.name = name
+        self.reading_type = reading_type
+        self.device_uuid = device_uuid
+        self.min_value = min_value
+        self.max_value = max_value
+
+    def evaluate(self, device_uuid, value):
+        if self.min_value is not None and value < self.min_value:
+            return {'limit': self.min_value}
+        if self.max_value is not None and value > self.max_value:
+            return {'limit': self.max_value}
+        return None
+
+
+class RollingWindow(object):
+    """
+        The last "size" readings of a device with their running sum and sum of squares
+    """
+
+    __slots__ = ('values', 'total', 'total_squares')
+
+    def __init__(self, size):
+        self.values = collections.deque(maxlen=size)
+        self.total = 0
+        self.total_squares = 0
+
+
+class ZScoreRule(object):
+    """
+        Alerts on the readings more than "threshold" (population) standard deviations away from the mean
+        of the last "window" readings of their device, once it has min_samples readings. The mean and
+        standard deviation come from the running sums of the window, updated in O(1) per reading
+        (and exactly, the readings are integers). A window of equal readings raises nothing.
+    """
+
+    kind = 'zscore'
+
+    def __init__(self, name, reading_type, device_uuid=ANY_DEVICE, window=ZSCORE_WINDOW, threshold=ZSCORE_THRESHOLD,
+                 min_samples=ZSCORE_MIN_SAMPLES):
+        self.name = name
+        self.reading_type = reading_type
+        self.device_uuid = device_uuid
+        self.window = window
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self._windows = {}
+
+    def evaluate(self, device_uuid, value):
+        window = self._windows.get(device_uuid)
+        if window is None:
+            window = self._windows[device_uuid] = RollingWindow(self.window)
+        values = window.values
+        count = len(values)
+
+        details = None
+        if count >= self.min_samples:
+            # count² times the variance
+            spread = count * window.total_squares - window.total * window.total
+            if spread:
+                zscore = (value * count - window.total) / math.sqrt(spread)
+                if abs(zscore) > self.threshold:
+                    details = {'zscore': round(zscore, 3), 'mean': window.total / count}
+
+        if count == self.window:
+            oldest = values[0]
+            window.total -= oldest
+            window.total_squares -= oldest * oldest
+        values.append(value)
+        window.total += value
+        window.total_squares += value * value
+        return details
+
+
+RULES = {rule.kind: rule for rule in (ThresholdRule, ZScoreRule)}
+
+
+def rule_from_dict(spec):
+    """
+        The rule described by a {"kind", "name", "type", "device_uuid" (default any), ...options} dict,
+        raises ValueError when it is not a valid rule
+    """
+    if not isinstance(spec, dict) or spec.get('kind') not in RULES or spec.get('type') not in READINGS_TYPES:
+        raise ValueError('Not a valid alert rule: {!r}'.format(spec))
+    options = {key: value for key, value in spec.items() if key not in ('kind', 'name', 'type')}
+    try:
+        return RULES[spec['kind']](spec.get('name') or spec['kind'], spec['type'], **options)
+    except TypeError:
+        raise ValueError('Not a valid alert rule: {!r}'.format(spec))
+
+
+def load_rules(path):
+    with open(path) as stream:
+        specs = json.load(stream)
+    if not isinstance(specs, list):
+        raise ValueError('The alert rules must be a JSON list')
+    return [rule_from_dict(spec) for spec in specs]
+
+
+class AlertEngine(object):
+    """
+        Evaluates the rules of a reading's device and type (and the ones of any device) on every accepted
+        reading, in O(1) per rule, and sends the alerts raised to the sink. The rolling windows live in
+        the memory of the process, so every worker keeps its own.
+    """
+
+    def __init__(self, rules, sink):
+        self.sink = sink
+        self._device_rules = {}
+        self._any_device_rules = {}
+        for rule in rules:
+            if rule.device_uuid == ANY_DEVICE:
+                self._any_device_rules.setdefault(rule.reading_type, []).append(rule)
+            else:
+                self._device_rules.setdefault((rule.device_uuid, rule.reading_type), []).append(rule)
+        self._lock = threading.Lock()
+
+    def evaluate(self, device_uuid, reading_type, value, date_created):
+        """
+            Evaluates a reading, returning the alerts raised
+        """
+        return self.evaluate_many([(device_uuid, reading_type, value, date_created)])
+
+    def evaluate_many(self, rows):
+        """
+            Evaluates (device_uuid, type, value, date_created) rows in order, returning the alerts raised
+        """
+        device_rules = self._device_rules
+        any_device_rules = self._any_device_rules
+        raised = []
+
+        with self._lock:
+            for device_uuid, reading_type, value, date_created in rows:
+                for rules in (device_rules.get((device_uuid, reading_type)), any_device_rules.get(reading_type)):
+                    if rules is None:
+                        continue
+                    value = int(value)
+                    for rule in rules:
+                        details = rule.evaluate(device_uuid, value)
+                        if details is not None:
+                            details.update(rule=rule.name, kind=rule.kind, device_uuid=device_uuid, type=reading_type,
+                                           value=value, date_created=date_created)
+                            raised.append(details)
+
+        raised_at = time.time()
+        for alert in raised:
+            alert['raised_at'] = raised_at
+            self.sink.emit(alert)
+            metrics.ALERTS_RAISED.inc(alert['kind'])
+        return raised
+
+
+def init_app(app, rules=None, sink=None):
+    """
+        Sets up the alert engine of the app with the given rules, or the ones of the ALERT_RULES file.
+        Without rules there is no engine and readings are not evaluated at all.
+    """
+    if rules is None and app.config['ALERT_RULES']:
+        rules = load_rules(app.config['ALERT_RULES'])
+    if sink is None:
+        sink = FileAlertSink(app.config['ALERT_SINK_PATH'])
+    app.extensions['alert_engine'] = AlertEngine(rules, sink) if rules else None
+
+
+def get_engine():
+    return current_app.extensions.get('alert_engine')
+
+
+def evaluate_readings(rows):
+    """
+        Evaluates the accepted (device_uuid, type, value, date_created) rows with the engine of the current app
+    """
+    engine = get_engine()
+    if engine is not None:
+        engine.evaluate_many(rows)
@@ -0,0 +1,73 @@
+import struct
+
+from sensors.validators.validators import READINGS_TYPES, READINGS_TYPES_ERRORS, MIN_READING_VALUE, \
+    MAX_READING_VALUE
+
+__author__ = 'vgarcia'
+
+# Compact batch of readings for constrained gateways, all integers little endian:
+#
+#   header  magic "SR" | version u8 | reserved u8 | readings count u32 | base date_created i64   (16 bytes)
+#   reading date_created - base u32 | type u8 (index in READINGS_TYPES) | value u8                (6 bytes)
+BINARY_MIMETYPE = 'application/vnd.sensors.readings'
+
+MAGIC = b'SR'
+VERSION = 1
+
+HEADER = struct.Struct('<2sBBIq')
+# numpy structured dtype of a reading, numpy is only imported along with the first batch
+RECORD = [('delta', '<u4'), ('type', 'u1'), ('value', 'u1')]
+RECORD_SIZE = 6
+
+MAX_DELTA = 2 ** 32 - 1
+
+
+def encode_readings(readings):
+    """
+        Encodes [{'type':..., 'value':..., 'date_created':...}, ...] readings (the batch endpoint JSON items)
+    """
+    import numpy as np
+
+    dates = [reading['date_created'] for reading in readings]
+    base = min(dates) if dates else 0
+    if dates and max(dates) - base > MAX_DELTA:
+        raise ValueError('Readings span more than {} seconds'.format(MAX_DELTA))
+
+    records = np.empty(len(readings), dtype=RECORD)
+    records['delta'] = [date_created - base for date_created in dates]
+    records['type'] = [READINGS_TYPES.index(reading['type']) for reading in readings]
+    records['value'] = [reading['value'] for reading in readings]
+    return HEADER.pack(MAGIC, VERSION, 0, len(readings), base) + records.tobytes()
+
+
+def decode_readings(data):
+    """
+        Decodes a binary batch without copying its records, returning the (type codes, values, dates) arrays.
+        Raises ValueError when the data is not a valid batch.
+    """
+    import numpy as np
+
+    data = memoryview(data)
+    if len(data) < HEADER.size:
+        raise ValueError('Batch shorter than its header')
+
+    magic, version, _, count, base = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a version {} readings batch'.format(VERSION))
+    if len(data) != HEADER.size + count * RECORD_SIZE:
+        raise ValueError('Batch of {} readings has {} bytes'.format(count, len(data)))
+
+    records = np.frombuffer(data, dtype=RECORD, count=count, offset=HEADER.size)
+    return records['type'], records['value'], base + records['delta'].astype(np.int64)
+
+
+def validate_readings(types, values):
+    """
+        The errors of the decoded readings as an array, an empty string for the valid ones
+    """
+    import numpy as np
+
+    errors = np.full(len(types), '', dtype=object)
+    errors[(values < MIN_READING_VALUE) | (values > MAX_READING_VALUE)] = READINGS_TYPES_ERRORS[1]
+    errors[types >= len(READINGS_TYPES)] = READINGS_TYPES_ERRORS[0]
+    return errors
@@ -0,0 +1,218 @@
+import collections
+import hashlib
+import itertools
+import threading
+import time
+import uuid
+
+from flask import Response, current_app, request, stream_with_context
+
+from sensors.database import queries
+from sensors.database.database import get_db
+
+__author__ = 'vgarcia'
+
+# Generation of the cached responses not tied to a single device (e.g. the summary)
+ALL_DEVICES = '*'
+
+
+class CacheBackend(object):
+    """
+        Storage of the cached responses. A shared backend (memcached, redis...) only has to
+        implement these methods for every worker to see the same entries and invalidations.
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+def entry_size(value):
+    """
+        Approximate size of a cached value, the length of the strings it holds
+    """
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(entry_size(item) for item in value)
+    if isinstance(value, dict):
+        return sum(entry_size(key) + entry_size(item) for key, item in value.items())
+    return 0
+
+
+class LocalCacheBackend(CacheBackend):
+    """
+        In-process LRU cache bounded by number of entries, by size (max_bytes, None for no bound) and by time to live
+    """
+
+    def __init__(self, max_entries=1024, ttl=60, clock=time.monotonic, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value, size = entry
+            if expires_at is not None and expires_at <= self.clock():
+                del self._entries[key]
+                self.size -= size
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = entry_size(key) + entry_size(value)
+        with self._lock:
+            if self.max_bytes is not None and size > self.max_bytes:
+                # Would evict everything else, better not cached at all
+                self._pop(key)
+                return
+            self._pop(key)
+            expires_at = self.clock() + self.ttl if self.ttl else None
+            self._entries[key] = (expires_at, value, size)
+            self.size += size
+            while len(self._entries) > self.max_entries or (self.max_bytes is not None and self.size > self.max_bytes):
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ResponseCache(object):
+    """
+        Cache of JSON responses keyed by endpoint and device. Every device has a generation token
+        that is part of its keys, so invalidating a device is a single write and stale entries
+        are simply never read again (they age out of the backend). The generations only follow the
+        invalidations made through the same backend, the keys also hold the version of the device
+        readings in the database (see readings_version) to follow the writes of every worker.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def generation(self, device_uuid):
+        key = ('generation', device_uuid)
+        generation = self.backend.get(key)
+        if generation is None:
+            # A fresh token, so an evicted generation can never resurrect older entries
+            generation = uuid.uuid4().hex
+            self.backend.set(key, generation)
+        return generation
+
+    def key(self, endpoint, device_uuid, params='', version=None):
+        return endpoint, device_uuid, self.generation(device_uuid), version, params
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+
+    def invalidate_device(self, device_uuid):
+        self.backend.set(('generation', device_uuid), uuid.uuid4().hex)
+        self.backend.set(('generation', ALL_DEVICES), uuid.uuid4().hex)
+
+    def clear(self):
+        self.backend.clear()
+
+
+def init_app(app, backend=None):
+    if backend is None:
+        backend = LocalCacheBackend(max_entries=app.config['CACHE_MAX_ENTRIES'], ttl=app.config['CACHE_TTL'],
+                                    max_bytes=app.config['CACHE_MAX_BYTES'])
+    app.extensions['response_cache'] = ResponseCache(backend)
+
+
+def get_cache():
+    if not current_app.config['CACHE_ENABLED']:
+        return None
+    return current_app.extensions.get('response_cache')
+
+
+def readings_version(device_uuid):
+    """
+        The version of the device readings (ALL_DEVICES for all of them) in the database, bumped by the triggers
+        of the readings table on every write, whichever process made it
+    """
+    row = get_db().execute(queries.SELECT_READINGS_VERSION, (device_uuid,)).fetchone()
+    return row[0] if row is not None else 0
+
+
+def invalidate_device(device_uuid):
+    """
+        Drops every cached response of the device (and the ones covering all devices)
+    """
+    cache = get_cache()
+    if cache is not None:
+        cache.invalidate_device(device_uuid)
+
+
+def cached_response(endpoint, device_uuid, compute, params=None):
+    """
+        Returns the cached JSON response of the endpoint for the device and the current query string
+        (or the given params, e.g. an encoded request body), calling compute() -> (chunks, headers) on a miss.
+        Answers 304 when If-None-Match matches its ETag. When the cache is disabled, or once the response
+        grows above CACHE_MAX_ENTRY_BYTES, the chunks are streamed as they are produced and not cached.
+    """
+    cache = get_cache()
+
+    if cache is None:
+        chunks, headers = compute()
+        return Response(stream_with_context(chunks), status=200, headers=headers, mimetype='application/json')
+
+    # Read before computing the response, so a write committed meanwhile only makes the entry unreachable
+    key = cache.key(endpoint, device_uuid, request.query_string.decode() if params is None else params,
+                    readings_version(device_uuid))
+    entry = cache.get(key)
+
+    if entry is None:
+        chunks, headers = compute()
+        chunks = iter(chunks)
+        max_bytes = current_app.config['CACHE_MAX_ENTRY_BYTES']
+        buffered = []
+        size = 0
+        for chunk in chunks:
+            buffered.append(chunk)
+            size += len(chunk)
+            if size > max_bytes:
+                # Too large to be kept: the chunks read so far, then the rest as it is produced
+                return Response(stream_with_context(itertools.chain(buffered, chunks)), status=200, headers=headers,
+                                mimetype='application/json')
+        body = ''.join(buffered)
+        entry = (body, hashlib.sha1(body.encode()).hexdigest(), headers)
+        cache.set(key, entry)
+
+    body, etag, headers = entry
+    response = Response(body, status=200, headers=headers, mimetype='application/json')
+    response.set_etag(etag)
+    return response.make_conditional(request)
@@ -0,0 +1,162 @@
+import os
+import queue
+import sqlite3
+import threading
+
+from flask import current_app, g
+
+from sensors.database.migrations import migrate
+from sensors.metrics import metrics
+
+__author__ = 'vgarcia'
+
+# Applied once to every new connection, right before its first checkout
+PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-16000',
+    'PRAGMA busy_timeout=5000',
+]
+
+_pools = {}
+_pools_lock = threading.Lock()
+# Pools of the parent process, kept (never used nor closed) by a forked child
+_inherited_pools = []
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class ConnectionPool(object):
+    """
+        Bounded pool of SQLite connections for a single database file.
+        Connections are created lazily (up to size) and reused across requests.
+    """
+
+    def __init__(self, path, size=5, timeout=10, factory=sqlite3.Connection):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.factory = factory
+        self._connections = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False, factory=self.factory)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def checkout(self):
+        try:
+            return self._connections.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+
+        if can_create:
+            try:
+                return self._connect()
+            except sqlite3.Error:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._connections.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeoutError('No connection available for {} after {}s'.format(self.path, self.timeout))
+
+    def checkin(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._connections.put_nowait(conn)
+
+    def close(self):
+        with self._lock:
+            while True:
+                try:
+                    self._connections.get_nowait().close()
+                except queue.Empty:
+                    break
+                self._created -= 1
+
+
+def get_pool(path, size=5, timeout=10, factory=sqlite3.Connection):
+    """
+        Returns the shared pool of the given database file, creating it on first use
+    """
+    with _pools_lock:
+        if path not in _pools:
+            _pools[path] = ConnectionPool(path, size=size, timeout=timeout, factory=factory)
+        return _pools[path]
+
+
+def _forget_pools():
+    """
+        Called in the child after a fork (e.g. gunicorn workers of a preloaded app): SQLite connections must not
+        cross a fork, so the child opens its own. The inherited ones are not closed either, which could
+        disturb the parent's.
+    """
+    global _pools_lock
+    _inherited_pools.extend(_pools.values())
+    _pools.clear()
+    _pools_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_pools)
+
+
+def database_path(app=None):
+    app = app or current_app
+    if app.config['TESTING']:
+        return app.config['TEST_DATABASE']
+    return app.config['DATABASE']
+
+
+def get_db():
+    """
+        Returns the connection bound to the current app context, checking one out of the pool if needed
+    """
+    if 'db' not in g:
+        factory = sqlite3.Connection
+        if metrics.queries_enabled(current_app.config):
+            factory = metrics.connection_factory(current_app.config['METRICS_SLOW_QUERY_MS'])
+        g.db_pool = get_pool(database_path(), size=current_app.config['DATABASE_POOL_SIZE'],
+                             timeout=current_app.config['DATABASE_POOL_TIMEOUT'], factory=factory)
+        g.db = g.db_pool.checkout()
+    return g.db
+
+
+def close_db(exception=None):
+    """
+        Returns the connection of the current app context to its pool
+    """
+    conn = g.pop('db', None)
+    pool = g.pop('db_pool', None)
+    if conn is not None:
+        pool.checkin(conn)
+
+
+def init_db(path):
+    """
+        Brings the schema of the given database file up to date
+    """
+    conn = sqlite3.connect(path)
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
+
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
@@ -0,0 +1,182 @@
+__author__ = 'vgarcia'
+
+# Statements of the triggers counting an inserted reading in the device statistics and the rollups. Rows are
+# updated first and only inserted when there was none (changes() is the count of the previous statement of the
+# trigger): an upsert would need SQLite 3.24.
+STATS_INSERT_TRIGGER_BODY = (
+    'UPDATE device_stats SET readings_count=readings_count+1, readings_sum=readings_sum+NEW.value, '
+    'min_value=min(min_value, NEW.value), max_value=max(max_value, NEW.value) '
+    'WHERE device_uuid=NEW.device_uuid AND type=NEW.type; '
+    'INSERT INTO device_stats SELECT NEW.device_uuid, NEW.type, 1, NEW.value, NEW.value, NEW.value '
+    'WHERE changes()=0; '
+    'UPDATE device_stats_histogram SET readings_count=readings_count+1 '
+    'WHERE device_uuid=NEW.device_uuid AND type=NEW.type AND value=NEW.value; '
+    'INSERT INTO device_stats_histogram SELECT NEW.device_uuid, NEW.type, NEW.value, 1 WHERE changes()=0; '
+    'END'
+)
+
+ROLLUP_INSERT_TRIGGER_BODY = ' '.join(
+    'UPDATE readings_rollup SET readings_count=readings_count+1, readings_sum=readings_sum+NEW.value, '
+    'min_value=min(min_value, NEW.value), max_value=max(max_value, NEW.value) '
+    'WHERE width={width} AND device_uuid=NEW.device_uuid AND type=NEW.type '
+    'AND bucket=(NEW.date_created / {width}) * {width}; '
+    'INSERT INTO readings_rollup SELECT {width}, NEW.device_uuid, NEW.type, (NEW.date_created / {width}) * {width}, '
+    '1, NEW.value, NEW.value, NEW.value WHERE changes()=0;'.format(width=width)
+    for width in (3600, 86400)) + ' END'
+
+# Statements of the triggers undoing a deleted reading in the device statistics and the rollups
+STATS_DELETE_TRIGGER_BODY = (
+    'UPDATE device_stats_histogram SET readings_count=readings_count-1 '
+    'WHERE device_uuid=OLD.device_uuid AND type=OLD.type AND value=OLD.value; '
+    'DELETE FROM device_stats_histogram '
+    'WHERE device_uuid=OLD.device_uuid AND type=OLD.type AND value=OLD.value AND readings_count<=0; '
+    'UPDATE device_stats SET readings_count=readings_count-1, readings_sum=readings_sum-OLD.value, '
+    'min_value=(SELECT min(value) FROM device_stats_histogram WHERE device_uuid=OLD.device_uuid AND type=OLD.type), '
+    'max_value=(SELECT max(value) FROM device_stats_histogram WHERE device_uuid=OLD.device_uuid AND type=OLD.type) '
+    'WHERE device_uuid=OLD.device_uuid AND type=OLD.type; '
+    'DELETE FROM device_stats WHERE device_uuid=OLD.device_uuid AND type=OLD.type AND readings_count<=0; '
+    'END'
+)
+
+ROLLUP_DELETE_TRIGGER_BODY = ' '.join(
+    'UPDATE readings_rollup SET readings_count=readings_count-1, readings_sum=readings_sum-OLD.value, '
+    'min_value=(SELECT min(value) FROM readings WHERE device_uuid=OLD.device_uuid AND type=OLD.type '
+    'AND date_created>=bucket AND date_created<bucket+{width}), '
+    'max_value=(SELECT max(value) FROM readings WHERE device_uuid=OLD.device_uuid AND type=OLD.type '
+    'AND date_created>=bucket AND date_created<bucket+{width}) '
+    'WHERE width={width} AND device_uuid=OLD.device_uuid AND type=OLD.type '
+    'AND bucket=(OLD.date_created / {width}) * {width}; '
+    'DELETE FROM readings_rollup WHERE width={width} AND device_uuid=OLD.device_uuid AND type=OLD.type '
+    'AND bucket=(OLD.date_created / {width}) * {width} AND readings_count<=0;'.format(width=width)
+    for width in (3600, 86400)) + ' END'
+
+# Statements of the triggers bumping the version of the readings of a device, and of all of them ('*'), on every
+# insert ({row} NEW) and delete ({row} OLD)
+VERSIONS_TRIGGER_BODY = (
+    "UPDATE readings_versions SET version=version+1 WHERE device_uuid='*'; "
+    'UPDATE readings_versions SET version=version+1 WHERE device_uuid={row}.device_uuid; '
+    'INSERT INTO readings_versions SELECT {row}.device_uuid, 1 WHERE changes()=0; '
+    'END'
+)
+
+# Every migration is a list of statements applied in one transaction. The schema version
+# is kept in PRAGMA user_version, so only the pending migrations run on every startup.
+MIGRATIONS = [
+    # 1. Initial readings table
+    [
+        'CREATE TABLE IF NOT EXISTS readings (device_uuid TEXT, type TEXT, value INTEGER, date_created INTEGER)',
+    ],
+    # 2. Rowid-backed primary key and indexes for the endpoints queries
+    [
+        'CREATE TABLE readings_new (id INTEGER PRIMARY KEY, device_uuid TEXT, type TEXT, value INTEGER, '
+        'date_created INTEGER)',
+        'INSERT INTO readings_new (device_uuid, type, value, date_created) '
+        'SELECT device_uuid, type, value, date_created FROM readings ORDER BY rowid',
+        'DROP TABLE readings',
+        'ALTER TABLE readings_new RENAME TO readings',
+        'CREATE INDEX readings_device_type_date_idx ON readings (device_uuid, type, date_created)',
+        'CREATE INDEX readings_type_date_idx ON readings (type, date_created)',
+        'CREATE INDEX readings_device_value_idx ON readings (device_uuid, value)',
+        'CREATE INDEX readings_date_idx ON readings (date_created)',
+    ],
+    # 3. Per device and type aggregates (with a value histogram), maintained by triggers on every insert/delete
+    [
+        'CREATE TABLE device_stats (device_uuid TEXT, type TEXT, readings_count INTEGER, readings_sum INTEGER, '
+        'min_value INTEGER, max_value INTEGER, PRIMARY KEY (device_uuid, type))',
+        'CREATE TABLE device_stats_histogram (device_uuid TEXT, type TEXT, value INTEGER, readings_count INTEGER, '
+        'PRIMARY KEY (device_uuid, type, value)) WITHOUT ROWID',
+        'CREATE TRIGGER readings_stats_insert AFTER INSERT ON readings BEGIN ' + STATS_INSERT_TRIGGER_BODY,
+        'CREATE TRIGGER readings_stats_delete AFTER DELETE ON readings BEGIN ' + STATS_DELETE_TRIGGER_BODY,
+        'INSERT INTO device_stats SELECT device_uuid, type, count(value), sum(value), min(value), max(value) '
+        'FROM readings GROUP BY device_uuid, type',
+        'INSERT INTO device_stats_histogram SELECT device_uuid, type, value, count(value) '
+        'FROM readings GROUP BY device_uuid, type, value',
+    ],
+    # 4. Device readings pages ordered by (date_created, id)
+    [
+        'CREATE INDEX readings_device_date_idx ON readings (device_uuid, date_created)',
+    ],
+    # 5. Hourly and daily rollups per device and type, maintained by triggers on every insert/delete
+    [
+        'CREATE TABLE readings_rollup (width INTEGER, device_uuid TEXT, type TEXT, bucket INTEGER, '
+        'readings_count INTEGER, readings_sum INTEGER, min_value INTEGER, max_value INTEGER, '
+        'PRIMARY KEY (width, device_uuid, type, bucket)) WITHOUT ROWID',
+        'CREATE TRIGGER readings_rollup_insert AFTER INSERT ON readings BEGIN ' + ROLLUP_INSERT_TRIGGER_BODY,
+        'CREATE TRIGGER readings_rollup_delete AFTER DELETE ON readings BEGIN ' + ROLLUP_DELETE_TRIGGER_BODY,
+    ] + [
+        'INSERT INTO readings_rollup SELECT {width}, device_uuid, type, (date_created / {width}) * {width}, '
+        'count(value), sum(value), min(value), max(value) FROM readings '
+        'GROUP BY device_uuid, type, date_created / {width}'.format(width=width) for width in (3600, 86400)
+    ],
+    # 6. Catalog of the monthly partitions. Readings moved from the readings table to a partition skip the
+    # delete triggers (they are still counted), which is flagged by a row in readings_moves during the move
+    [
+        'CREATE TABLE readings_partitions (name TEXT PRIMARY KEY, start_date INTEGER, end_date INTEGER, state TEXT)',
+        'CREATE TABLE readings_moves (started INTEGER)',
+        'DROP TRIGGER readings_stats_delete',
+        'CREATE TRIGGER readings_stats_delete AFTER DELETE ON readings '
+        'WHEN NOT EXISTS (SELECT 1 FROM readings_moves) BEGIN ' + STATS_DELETE_TRIGGER_BODY,
+        'DROP TRIGGER readings_rollup_delete',
+        'CREATE TRIGGER readings_rollup_delete AFTER DELETE ON readings '
+        'WHEN NOT EXISTS (SELECT 1 FROM readings_moves) BEGIN ' + ROLLUP_DELETE_TRIGGER_BODY,
+    ],
+    # 7. Hourly quantile sketches per device and type, stored by flask build-sketches and dropped by the triggers
+    # when a reading of their hour is inserted or deleted (moved readings are still the same)
+    [
+        'CREATE TABLE readings_sketches (device_uuid TEXT, type TEXT, bucket INTEGER, compression INTEGER, '
+        'sketch BLOB, PRIMARY KEY (device_uuid, type, bucket))',
+        'CREATE TRIGGER readings_sketches_insert AFTER INSERT ON readings BEGIN '
+        'DELETE FROM readings_sketches WHERE device_uuid=NEW.device_uuid AND type=NEW.type '
+        'AND bucket=(NEW.date_created / 3600) * 3600; END',
+        'CREATE TRIGGER readings_sketches_delete AFTER DELETE ON readings '
+        'WHEN NOT EXISTS (SELECT 1 FROM readings_moves) BEGIN '
+        'DELETE FROM readings_sketches WHERE device_uuid=OLD.device_uuid AND type=OLD.type '
+        'AND bucket=(OLD.date_created / 3600) * 3600; END',
+    ],
+    # 8. Insert triggers of the statistics and rollups without upserts (the ones of databases created before were)
+    [
+        'DROP TRIGGER readings_stats_insert',
+        'CREATE TRIGGER readings_stats_insert AFTER INSERT ON readings BEGIN ' + STATS_INSERT_TRIGGER_BODY,
+        'DROP TRIGGER readings_rollup_insert',
+        'CREATE TRIGGER readings_rollup_insert AFTER INSERT ON readings BEGIN ' + ROLLUP_INSERT_TRIGGER_BODY,
+    ],
+    # 9. Version of the readings of every device, shared by the workers so their cached responses follow the
+    # writes of the others (moved readings are still the same)
+    [
+        'CREATE TABLE readings_versions (device_uuid TEXT PRIMARY KEY, version INTEGER) WITHOUT ROWID',
+        "INSERT INTO readings_versions SELECT '*', 0",
+        "INSERT INTO readings_versions SELECT DISTINCT device_uuid, 0 FROM device_stats WHERE device_uuid!='*'",
+        'CREATE TRIGGER readings_versions_insert AFTER INSERT ON readings BEGIN '
+        + VERSIONS_TRIGGER_BODY.format(row='NEW'),
+        'CREATE TRIGGER readings_versions_delete AFTER DELETE ON readings '
+        'WHEN NOT EXISTS (SELECT 1 FROM readings_moves) BEGIN ' + VERSIONS_TRIGGER_BODY.format(row='OLD'),
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """
+        Applies the pending migrations of the given connection's database, returning the final schema version
+    """
+    while True:
+        # Take the write lock first, so concurrent workers never apply the same migration twice
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = schema_version(conn)
+            if version >= SCHEMA_VERSION:
+                conn.rollback()
+                return version
+
+            for statement in MIGRATIONS[version]:
+                conn.execute(statement)
+            conn.execute('PRAGMA user_version = {:d}'.format(version + 1))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
@@ -0,0 +1,75 @@
+import json
+
+from flask import Response, stream_with_context
+
+from sensors.database import queries
+
+__author__ = 'vgarcia'
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def parse_cursor(cursor):
+    """
+        Parses a '<date_created>,<id>' cursor, raising ValueError when it is not valid
+    """
+    date_created, row_id = cursor.split(',')
+    return int(date_created), int(row_id)
+
+
+def format_cursor(row):
+    return '{},{}'.format(row['date_created'], row['id'])
+
+
+def keyset_page(cur, query, params, after=None, limit=None):
+    """
+        Runs a readings query ordered by (date_created, id) starting after the given cursor.
+
+        Returns the rows and the cursor of the next page. Without a limit the rows are
+        the open cursor itself, so they are streamed instead of fetched all at once.
+    """
+    params = list(params)
+    if after is None:
+        condition = '1'
+    else:
+        condition = '(date_created, id) > (?, ?)'
+        params.extend(parse_cursor(after))
+
+    if limit is None:
+        return cur.execute(query.format(condition), params), None
+
+    cur.execute(query.format(condition) + ' limit ?', params + [limit + 1])
+    rows = cur.fetchall()
+    if len(rows) > limit:
+        return rows[:limit], format_cursor(rows[limit - 1])
+    return rows, None
+
+
+def reading_to_dict(row):
+    return dict(zip(queries.READING_COLUMNS, row))
+
+
+def stream_json(rows, ndjson=False):
+    """
+        Encodes readings one by one as a JSON array (or NDJSON lines) while they are read
+    """
+    if ndjson:
+        for row in rows:
+            yield json.dumps(reading_to_dict(row), sort_keys=True) + '\n'
+        return
+
+    yield '['
+    separator = ''
+    for row in rows:
+        yield separator + json.dumps(reading_to_dict(row), sort_keys=True)
+        separator = ','
+    yield ']'
+
+
+def readings_response(rows, next_cursor=None, ndjson=False):
+    """
+        Streams a page of readings as JSON (or NDJSON), sending the next page cursor in the X-Next-Cursor header
+    """
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+    return Response(stream_with_context(stream_json(rows, ndjson)), status=200, headers=headers,
+                    mimetype=NDJSON_MIMETYPE if ndjson else 'application/json')
@@ -0,0 +1,240 @@
+__author__ = 'vgarcia'
+
+READING_COLUMNS = ['device_uuid', 'type', 'value', 'date_created']
+
+INSERT_READING = 'insert into readings (device_uuid,type,value,date_created) VALUES (?,?,?,?)'
+
+# "{readings}" is replaced by the readings table, or by the union of the tables (the monthly partitions and the
+# readings table) holding readings within the range of the query, see sensors.partitions. Aggregates run on every
+# table instead, their results combined by the matching MERGE_ query.
+SELECT_DEVICES = 'select distinct device_uuid from {readings} order by date_created'
+
+# Readings pages ordered by (date_created, id), the keyset condition ("{}") is filled by the pagination
+SELECT_DEVICE_READINGS = ('select device_uuid, type, value, date_created, id from {readings} where device_uuid=? '
+                          'and {} order by date_created, id')
+
+SELECT_READINGS_BY_TYPE = ('select device_uuid, type, value, date_created, id from {readings} where type=? '
+                           'and {} order by date_created, id')
+
+SELECT_READINGS_BY_DATE_RANGE = ('select device_uuid, type, value, date_created, id from {readings} '
+                                 'where date_created>=? and date_created<=? and {} order by date_created, id')
+
+# Whole readings export, the filters ("{}") are filled by the export
+SELECT_EXPORT_READINGS = ('select device_uuid, type, value, date_created from {readings} where {} '
+                          'order by date_created, id')
+
+# The last written of the readings holding the greatest value, read backwards from the (device_uuid, value) index
+# of every table (the filters, "{}", are kept off the indexes with a unary plus), then the greatest of them
+SELECT_DEVICE_MAX = ('select device_uuid, type, value, date_created, id from {readings} where device_uuid=? and {} '
+                     'order by value desc, id desc limit 1')
+
+MERGE_DEVICE_MAX = 'select device_uuid, type, value, date_created, id from ({}) order by value desc, id desc limit 1'
+
+SELECT_DEVICE_READINGS_WITH_VALUE = ('select device_uuid, type, value, date_created from {readings} '
+                                     'where device_uuid=? and value=? and {} order by id')
+
+# Materialized per device/type aggregates, kept up to date by the readings triggers
+SELECT_DEVICE_STATS = ('select sum(readings_count), sum(readings_sum), min(min_value), max(max_value) '
+                       'from device_stats where device_uuid=?')
+
+SELECT_DEVICE_HISTOGRAM = ('select value, sum(readings_count) from device_stats_histogram where device_uuid=? '
+                           'group by value order by value')
+
+SELECT_HISTOGRAMS = ('select device_uuid, value, sum(readings_count) from device_stats_histogram where {} '
+                     'group by device_uuid, value order by device_uuid, value')
+
+# The same per (device_uuid, type)
+SELECT_DEVICE_TYPE_STATS = ('select sum(readings_count), sum(readings_sum), min(min_value), max(max_value) '
+                            'from device_stats where device_uuid=? and type=?')
+
+SELECT_DEVICE_TYPE_HISTOGRAM = ('select value, readings_count from device_stats_histogram where device_uuid=? '
+                                'and type=? order by value')
+
+SELECT_TYPE_HISTOGRAMS = ('select device_uuid, type, value, readings_count from device_stats_histogram where {} '
+                          'order by device_uuid, type, value')
+
+# The per type aggregates are derived from the histogram (at most 101 rows per device/type), so a rebuild
+# scans the readings once. The quantile sketches are dropped, they are built again on demand.
+REBUILD_DEVICE_STATS = [
+    'delete from device_stats',
+    'delete from device_stats_histogram',
+    'insert into device_stats_histogram select device_uuid, type, value, count(value) '
+    'from {readings} group by device_uuid, type, value',
+    'insert into device_stats select device_uuid, type, sum(readings_count), sum(value * readings_count), '
+    'min(value), max(value) from device_stats_histogram group by device_uuid, type',
+    'delete from readings_sketches',
+    # The statistics of any device may have changed
+    'update readings_versions set version=version+1',
+    'insert into readings_versions select distinct device_uuid, 1 from device_stats '
+    'where device_uuid not in (select device_uuid from readings_versions)',
+]
+
+# Filters ("where ...") are appended by the summary according to the request parameters
+SELECT_SUMMARY_DEVICES_PAGE = 'select distinct device_uuid from {readings} where {} order by device_uuid limit ?'
+
+MERGE_SUMMARY_DEVICES_PAGE = 'select distinct device_uuid from ({}) order by device_uuid limit ?'
+
+SELECT_SUMMARY_HISTOGRAMS = ('select device_uuid, value, count(value) as readings_count from {readings} where {} '
+                             'group by device_uuid, value order by device_uuid, value')
+
+MERGE_SUMMARY_HISTOGRAMS = ('select device_uuid, value, sum(readings_count) from ({}) '
+                            'group by device_uuid, value order by device_uuid, value')
+
+SELECT_SUMMARY_TYPE_HISTOGRAMS = ('select device_uuid, type, value, count(value) as readings_count from {readings} '
+                                  'where {} group by device_uuid, type, value order by device_uuid, type, value')
+
+MERGE_SUMMARY_TYPE_HISTOGRAMS = ('select device_uuid, type, value, sum(readings_count) from ({}) '
+                                 'group by device_uuid, type, value order by device_uuid, type, value')
+
+# Devices of a batched statistics request, given as a single JSON array parameter
+SELECTED_DEVICES = 'device_uuid in (select value from json_each(?))'
+
+# Readings holding the given values of the given devices, a JSON array of [device_uuid, value] pairs looked up one
+# by one in the (device_uuid, value) index. The filters ("{}") are on "reading" columns.
+SELECT_READINGS_WITH_VALUES = ('select reading.device_uuid, reading.type, reading.value, reading.date_created, '
+                               'reading.id from json_each(?) as wanted cross join {readings} as reading '
+                               "on reading.device_uuid=json_extract(wanted.value, '$[0]') "
+                               "and reading.value=json_extract(wanted.value, '$[1]') "
+                               'where {} order by reading.device_uuid, reading.id')
+
+MERGE_READINGS_WITH_VALUES = ('select device_uuid, type, value, date_created, id from ({}) '
+                              'order by device_uuid, id')
+
+# Daily rollups are derived from the hourly ones, so a rebuild scans the readings once. Only the buckets from
+# the given date on are rebuilt: the rollups of compacted partitions outlive their readings.
+REBUILD_ROLLUPS = [
+    'delete from readings_rollup where bucket>=?',
+    'insert into readings_rollup select 3600, device_uuid, type, (date_created / 3600) * 3600, count(value), '
+    'sum(value), min(value), max(value) from {readings} where date_created>=? '
+    'group by device_uuid, type, date_created / 3600',
+    'insert into readings_rollup select 86400, device_uuid, type, (bucket / 86400) * 86400, sum(readings_count), '
+    'sum(readings_sum), min(min_value), max(max_value) from readings_rollup where width=3600 and bucket>=? '
+    'group by device_uuid, type, bucket / 86400',
+]
+
+# Buckets of "width" seconds, the filters ("{}") are appended by the rollup according to the request parameters
+SELECT_RAW_BUCKETS = ('select (date_created / ?) * ? as bucket, count(value) as readings_count, '
+                      'sum(value) as readings_sum, min(value) as min_value, max(value) as max_value '
+                      'from {readings} where device_uuid=? and {} group by bucket order by bucket')
+
+MERGE_RAW_BUCKETS = ('select bucket, sum(readings_count), sum(readings_sum), min(min_value), max(max_value) '
+                     'from ({}) group by bucket order by bucket')
+
+SELECT_ROLLUP_BUCKETS = ('select (bucket / ?) * ? as rollup_bucket, sum(readings_count), sum(readings_sum), '
+                         'min(min_value), max(max_value) from readings_rollup where width=? and device_uuid=? and {} '
+                         'group by rollup_bucket order by rollup_bucket')
+
+# Hourly quantile sketches of the whole hours ("{}", on rollup columns) of a window: every hour with readings has
+# an hourly rollup, its sketch is null when missing (invalidated by a reading of that hour) or of another compression
+SELECT_WINDOW_SKETCHES = ('select rollup.type, rollup.bucket, sketch.sketch from readings_rollup as rollup '
+                          'left join readings_sketches as sketch on sketch.device_uuid=rollup.device_uuid '
+                          'and sketch.type=rollup.type and sketch.bucket=rollup.bucket and sketch.compression=? '
+                          'where rollup.width=? and rollup.device_uuid=? and {} order by rollup.type, rollup.bucket')
+
+# Readings of the hours (a JSON array of their starts) of a device to sketch, the filters ("{}") on "reading" columns
+SELECT_SKETCH_READINGS = ('select reading.type, wanted.value as bucket, reading.value from json_each(?) as wanted '
+                          'cross join {readings} as reading on reading.device_uuid=? '
+                          'and reading.date_created>=wanted.value and reading.date_created<wanted.value+3600 '
+                          'where {} order by reading.type, bucket')
+
+MERGE_SKETCH_READINGS = 'select type, bucket, value from ({}) order by type, bucket'
+
+UPSERT_SKETCH = 'insert or replace into readings_sketches values (?, ?, ?, ?, ?)'
+
+# Hours (with readings) of every device and type without a sketch of the given compression, before the given date
+SELECT_UNSKETCHED_HOURS = ('select rollup.device_uuid, rollup.type, rollup.bucket from readings_rollup as rollup '
+                           'left join readings_sketches as sketch on sketch.device_uuid=rollup.device_uuid '
+                           'and sketch.type=rollup.type and sketch.bucket=rollup.bucket and sketch.compression=? '
+                           'where rollup.width=? and rollup.bucket<? and sketch.bucket is null '
+                           'order by rollup.device_uuid, rollup.type, rollup.bucket')
+
+# Readings of the partial hours of a window, the filters ("{}") are the summary ones
+SELECT_DEVICE_TYPE_VALUES = 'select type, value from {readings} where device_uuid=? and {} order by type'
+
+MERGE_DEVICE_TYPE_VALUES = 'select type, value from ({}) order by type'
+
+# Version of the readings of a device ('*' for all of them), bumped by the triggers on every write
+SELECT_READINGS_VERSION = 'select version from readings_versions where device_uuid=?'
+
+# Readings followed by the hot store, by id (ids only grow)
+SELECT_LAST_READING_ID = 'select max(id) from readings'
+
+# The hot store only holds integer dates, readings stored before the dates were validated may hold others
+SELECT_RECENT_READINGS = ('select id, device_uuid, type, value, date_created from {readings} '
+                          "where date_created>=? and id<=? and typeof(date_created)='integer'")
+
+SELECT_READINGS_SINCE = ('select id, device_uuid, type, value, date_created from readings '
+                         "where id>? and id<=? and typeof(date_created)='integer'")
+
+# Monthly partitions, see sensors.partitions
+SELECT_PARTITION = 'select id, device_uuid, type, value, date_created from {}'
+
+SELECT_PARTITIONS_IN_RANGE = ('select name from readings_partitions where state=? and start_date<=? and end_date>? '
+                              'order by start_date')
+
+SELECT_ANY_READING_IN_RANGE = 'select 1 from readings where date_created>=? and date_created<=? limit 1'
+
+SELECT_PARTITIONS = 'select name, start_date, end_date, state from readings_partitions order by start_date'
+
+SELECT_RETIRED_UNTIL = 'select max(end_date) from readings_partitions where state!=?'
+
+INSERT_PARTITION = 'insert or replace into readings_partitions values (?, ?, ?, ?)'
+
+UPDATE_PARTITION_STATE = 'update readings_partitions set state=? where name=?'
+
+CREATE_PARTITION = [
+    'create table if not exists {name} (id INTEGER PRIMARY KEY, device_uuid TEXT, type TEXT, value INTEGER, '
+    'date_created INTEGER)',
+    'create index if not exists {name}_device_type_date_idx on {name} (device_uuid, type, date_created)',
+    'create index if not exists {name}_type_date_idx on {name} (type, date_created)',
+    'create index if not exists {name}_device_value_idx on {name} (device_uuid, value)',
+    'create index if not exists {name}_date_idx on {name} (date_created)',
+    'create index if not exists {name}_device_date_idx on {name} (device_uuid, date_created)',
+]
+
+# The oldest reading of the readings table created before the given date. The reading with the greatest id
+# always stays, so ids keep growing once older ones are moved.
+SELECT_OLDEST_TO_MOVE = ('select min(date_created) from readings where date_created<? '
+                         'and id<(select max(id) from readings)')
+
+# A batch of readings created within [start_date, end_date), moved from the readings table to a partition
+MOVE_BATCH = ('select id from readings where date_created>=? and date_created<? and id<(select max(id) from readings) '
+              'order by date_created limit ?')
+
+START_MOVE = 'insert into readings_moves values (1)'
+
+COPY_MOVED_READINGS = ('insert into {} select id, device_uuid, type, value, date_created from readings '
+                       'where id in (' + MOVE_BATCH + ')')
+
+DELETE_MOVED_READINGS = 'delete from readings where id in (' + MOVE_BATCH + ')'
+
+END_MOVE = 'delete from readings_moves'
+
+# The readings of a partition leave the device statistics when it is retired
+CREATE_RETIRED_HISTOGRAM = ('create temp table retired_histogram as select device_uuid, type, value, '
+                            'count(value) as readings_count from {} group by device_uuid, type, value')
+
+INDEX_RETIRED_HISTOGRAM = 'create index temp.retired_histogram_idx on retired_histogram (device_uuid, type, value)'
+
+# Correlated subqueries rather than "update ... from" (SQLite 3.33)
+RETIRE_PARTITION = [
+    'update device_stats_histogram set readings_count=readings_count-(select r.readings_count '
+    'from temp.retired_histogram r where r.device_uuid=device_stats_histogram.device_uuid '
+    'and r.type=device_stats_histogram.type and r.value=device_stats_histogram.value) '
+    'where (device_uuid, type, value) in (select device_uuid, type, value from temp.retired_histogram)',
+    'delete from device_stats_histogram where readings_count<=0',
+    'delete from device_stats where (device_uuid, type) in (select device_uuid, type from temp.retired_histogram)',
+    'insert into device_stats select device_uuid, type, sum(readings_count), sum(value * readings_count), '
+    'min(value), max(value) from device_stats_histogram '
+    'where (device_uuid, type) in (select device_uuid, type from temp.retired_histogram) group by device_uuid, type',
+    'update readings_versions set version=version+1 '
+    "where device_uuid='*' or device_uuid in (select device_uuid from temp.retired_histogram)",
+]
+
+DROP_RETIRED_HISTOGRAM = 'drop table if exists temp.retired_histogram'
+
+DELETE_ROLLUPS_IN_RANGE = 'delete from readings_rollup where bucket>=? and bucket<?'
+
+DELETE_SKETCHES_IN_RANGE = 'delete from readings_sketches where bucket>=? and bucket<?'
+
+DROP_PARTITION = 'drop table if exists {}'
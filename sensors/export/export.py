@@ -0,0 +1,155 @@
+import csv
+import io
+import json
+import logging
+import struct
+import time
+import zlib
+
+from sensors.database import queries
+from sensors.partitions import partitions
+
+__author__ = 'vgarcia'
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'columnar': ('application/vnd.sensors.columnar', 'srcol'),
+}
+
+# Rows fetched from SQLite (and encoded) at once, the memory used by an export does not grow past it
+CHUNK_SIZE = 5000
+
+# Columnar files: a header, then row groups of up to CHUNK_SIZE readings, then an empty row group.
+#
+#   header     magic "SRCOL" | version u8
+#   row group  rows u32 | 6 x (zlib compressed length u32 | zlib compressed column)
+#
+# The columns of a row group are the JSON list of its device UUIDs and the u32 index of each
+# reading's device in it, the same for the types, the i64 values and the i64 dates as deltas
+# (the first date, then the difference with the previous one), all little endian.
+COLUMNAR_MAGIC = b'SRCOL'
+COLUMNAR_VERSION = 1
+ROW_GROUP = struct.Struct('<I')
+COLUMN = struct.Struct('<I')
+
+
+def export_filters(device_uuid=None, reading_type=None, start_date=None, end_date=None):
+    conditions = ['1']
+    params = []
+    for column, condition, value in [('device_uuid', '=', device_uuid), ('type', '=', reading_type),
+                                     ('date_created', '>=', start_date), ('date_created', '<=', end_date)]:
+        if value is not None:
+            conditions.append(column + condition + '?')
+            params.append(value)
+    return ' and '.join(conditions), params
+
+
+def fetch_chunks(cur, device_uuid=None, reading_type=None, start_date=None, end_date=None, chunk_size=CHUNK_SIZE,
+                 report=None):
+    """
+        Streams the matching readings (device_uuid, type, value, date_created) oldest first, chunk_size rows
+        at a time. Once done, the readings exported and the seconds it took are logged and stored in report.
+    """
+    conditions, params = export_filters(device_uuid, reading_type, start_date, end_date)
+    started = time.perf_counter()
+    exported = 0
+
+    cur.execute(partitions.route(cur, queries.SELECT_EXPORT_READINGS, start_date, end_date).format(conditions), params)
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        exported += len(rows)
+        yield rows
+
+    elapsed = time.perf_counter() - started
+    if report is not None:
+        report.update(readings=exported, seconds=elapsed)
+    logger.info('Exported %s readings in %.2fs (%.0f readings/s)', exported, elapsed,
+                exported / elapsed if elapsed else 0)
+
+
+def csv_chunks(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(queries.READING_COLUMNS)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def ndjson_chunks(chunks):
+    for rows in chunks:
+        yield ''.join(json.dumps(dict(zip(queries.READING_COLUMNS, row)), sort_keys=True) + '\n' for row in rows)
+
+
+def _dictionary_column(strings):
+    import numpy as np
+
+    dictionary, codes = np.unique(np.array(strings, dtype=object).astype(str), return_inverse=True)
+    return [json.dumps(dictionary.tolist()).encode(), codes.astype('<u4').tobytes()]
+
+
+def columnar_chunks(chunks):
+    import numpy as np
+
+    yield COLUMNAR_MAGIC + bytes([COLUMNAR_VERSION])
+    for rows in chunks:
+        device_uuids, types, values, dates = zip(*rows)
+        dates = np.array(dates, dtype='<i8')
+        columns = _dictionary_column(device_uuids) + _dictionary_column(types) + [
+            np.array(values, dtype='<i8').tobytes(),
+            np.diff(dates, prepend=0).astype('<i8').tobytes(),
+        ]
+        group = [ROW_GROUP.pack(len(rows))]
+        for column in columns:
+            compressed = zlib.compress(column)
+            group.append(COLUMN.pack(len(compressed)))
+            group.append(compressed)
+        yield b''.join(group)
+    yield ROW_GROUP.pack(0)
+
+
+ENCODERS = {'csv': csv_chunks, 'ndjson': ndjson_chunks, 'columnar': columnar_chunks}
+
+
+def _read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError('Truncated columnar export')
+    return data
+
+
+def read_columnar(stream):
+    """
+        Reads a columnar export from a binary stream, yielding a dict of NumPy arrays per row group
+        (device_uuid, type, value, date_created). Raises ValueError when the stream is not valid.
+    """
+    import numpy as np
+
+    if _read_exactly(stream, len(COLUMNAR_MAGIC) + 1) != COLUMNAR_MAGIC + bytes([COLUMNAR_VERSION]):
+        raise ValueError('Not a version {} columnar export'.format(COLUMNAR_VERSION))
+
+    while True:
+        rows, = ROW_GROUP.unpack(_read_exactly(stream, ROW_GROUP.size))
+        if not rows:
+            return
+        columns = []
+        for _ in range(6):
+            size, = COLUMN.unpack(_read_exactly(stream, COLUMN.size))
+            columns.append(zlib.decompress(_read_exactly(stream, size)))
+
+        devices, device_codes, types, type_codes, values, dates = columns
+        yield {
+            'device_uuid': np.array(json.loads(devices.decode()), dtype=object)[np.frombuffer(device_codes, '<u4')],
+            'type': np.array(json.loads(types.decode()), dtype=object)[np.frombuffer(type_codes, '<u4')],
+            'value': np.frombuffer(values, '<i8'),
+            'date_created': np.cumsum(np.frombuffer(dates, '<i8')),
+        }
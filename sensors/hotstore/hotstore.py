@@ -0,0 +1,347 @@
+import os
+import threading
+import time
+
+from flask import current_app
+
+from sensors.database import queries
+from sensors.database.pagination import parse_cursor
+from sensors.partitions import partitions
+from sensors.stats.stats import exact_mean
+from sensors.validators.validators import READINGS_TYPES
+
+__author__ = 'vgarcia'
+
+# Readings types are stored as their index in READINGS_TYPES
+TYPE_CODES = {reading_type: code for code, reading_type in enumerate(READINGS_TYPES)}
+
+
+# Rows fetched at once when loading the store
+LOAD_CHUNK = 10000
+
+
+def load_columns(cur, query, parameters, horizon):
+    """
+        The readings (id, device_uuid, type, value, date_created) of the query created since horizon, as
+        (ids, dates, values, type codes) columns by device UUID
+    """
+    import numpy as np
+
+    # Plain tuples, much cheaper to build than rows
+    rows = cur.connection.cursor()
+    rows.row_factory = None
+    rows.execute(query, parameters)
+    # Every chunk is turned into arrays right away, millions of row tuples kept alive would keep the
+    # garbage collector busy. Devices are numbered in the order they are met.
+    numbers = {}
+    chunks = []
+    while True:
+        chunk = rows.fetchmany(LOAD_CHUNK)
+        if not chunk:
+            break
+        ids, devices, types, values, dates = zip(*chunk)
+        types = np.array(types, dtype=object)
+        codes = np.full(len(types), len(READINGS_TYPES), dtype=np.uint8)
+        for reading_type, code in TYPE_CODES.items():
+            codes[types == reading_type] = code
+        chunks.append((np.array([numbers.setdefault(device_uuid, len(numbers)) for device_uuid in devices]),
+                       np.array(ids, dtype=np.int64), np.array(dates, dtype=np.int64),
+                       np.array(values, dtype=np.int64).astype(np.uint8), codes))
+    if not chunks:
+        return {}
+
+    device_numbers, ids, dates, values, codes = (np.concatenate(column) for column in zip(*chunks))
+    kept = np.flatnonzero((codes < len(READINGS_TYPES)) & (dates >= horizon))
+    # The readings of every device gathered in a contiguous run
+    order = kept[np.argsort(device_numbers[kept], kind='stable')]
+    runs = np.split(order, np.cumsum(np.bincount(device_numbers[kept], minlength=len(numbers)))[:-1])
+    return {device_uuid: (ids[run], dates[run], values[run], codes[run])
+            for device_uuid, run in zip(numbers, runs) if len(run)}
+
+
+class DeviceWindow(object):
+    """
+        Recent readings of a device as columns ordered by (date_created, id). New readings are
+        buffered and merged into the columns (then evicted by age and size) on the next read.
+    """
+
+    def __init__(self):
+        import numpy as np
+
+        self.ids = np.empty(0, dtype=np.int64)
+        self.dates = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0, dtype=np.uint8)
+        self.types = np.empty(0, dtype=np.uint8)
+        self._pending = []
+
+    def __len__(self):
+        return len(self.ids) + sum(len(ids) for ids, _, _, _ in self._pending)
+
+    def extend(self, columns):
+        """
+            Buffers the given (ids, dates, values, type codes) arrays
+        """
+        self._pending.append(columns)
+
+    def merge(self, horizon, max_readings):
+        """
+            Merges the buffered readings and evicts the ones older than horizon (then the oldest ones
+            above max_readings). Returns the date the window is complete from.
+        """
+        import numpy as np
+
+        if self._pending:
+            pending, self._pending = self._pending, []
+            ids = np.concatenate([self.ids] + [column[0] for column in pending])
+            dates = np.concatenate([self.dates] + [column[1] for column in pending])
+            order = np.lexsort((ids, dates))
+            self.ids = ids[order]
+            self.dates = dates[order]
+            self.values = np.concatenate([self.values] + [column[2] for column in pending])[order]
+            self.types = np.concatenate([self.types] + [column[3] for column in pending])[order]
+
+        first = int(np.searchsorted(self.dates, horizon, side='left'))
+        if len(self.dates) - first > max_readings:
+            first = len(self.dates) - max_readings
+            # Readings of the evicted date may remain, the window is only complete after it
+            horizon = int(self.dates[first - 1]) + 1
+        if first:
+            self.ids = self.ids[first:]
+            self.dates = self.dates[first:]
+            self.values = self.values[first:]
+            self.types = self.types[first:]
+        return horizon
+
+    def select(self, start_date=None, end_date=None, reading_type=None):
+        """
+            Indexes of the readings within [start_date, end_date] (of the given type)
+        """
+        import numpy as np
+
+        first = 0 if start_date is None else np.searchsorted(self.dates, start_date, side='left')
+        last = len(self.dates) if end_date is None else np.searchsorted(self.dates, end_date, side='right')
+        indexes = np.arange(first, last)
+        if reading_type is not None:
+            indexes = indexes[self.types[first:last] == TYPE_CODES[reading_type]]
+        return indexes
+
+
+class HotStore(object):
+    """
+        Readings created in the last "window" seconds, per device, kept in NumPy columns (18 bytes per reading),
+        at most max_readings per device and max_total_readings in all, the oldest ones evicted first.
+
+        The store follows the readings table by id (ids only grow), so readings written by other
+        processes are picked up too: sync() fetches the rows above the last id seen, at most once
+        every sync_interval seconds unless mark_stale() was called after a local write. The rows are
+        fetched and turned into columns before the store is locked, the readers only wait for the merge.
+    """
+
+    def __init__(self, window=86400, max_readings=100000, max_total_readings=1000000, sync_interval=1.0,
+                 clock=time.time):
+        self.window = window
+        self.max_readings = max_readings
+        self.max_total_readings = max_total_readings
+        self.sync_interval = sync_interval
+        self.clock = clock
+        self.pid = os.getpid()
+        self.devices = {}
+        self.horizon = None
+        self.last_id = None
+        self._synced_at = None
+        # Held by the readers and while the columns change, the loading is serialized by the other one
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self.devices = {}
+            self.horizon = None
+            self.last_id = None
+            self._synced_at = None
+
+    def mark_stale(self):
+        self._synced_at = None
+
+    def _evict(self, devices, horizon):
+        """
+            Merges the buffered readings of the devices, evicting the old ones and the oldest ones above the size
+            bounds. Returns the date the store is complete from.
+        """
+        import numpy as np
+
+        horizon = max(horizon, int(self.clock()) - self.window)
+        complete_from = horizon
+        for device in devices.values():
+            complete_from = max(complete_from, device.merge(horizon, self.max_readings))
+
+        total = sum(len(device.ids) for device in devices.values())
+        if total > self.max_total_readings:
+            # Only the newest readings fit, the ones up to the date of the newest reading that does not are evicted
+            last_evicted = total - self.max_total_readings - 1
+            dates = np.concatenate([device.dates for device in devices.values()])
+            complete_from = max(complete_from, int(np.partition(dates, last_evicted)[last_evicted]) + 1)
+            for device in devices.values():
+                device.merge(complete_from, self.max_readings)
+
+        for device_uuid in [device_uuid for device_uuid, device in devices.items() if not len(device)]:
+            del devices[device_uuid]
+        return complete_from
+
+    def warm(self, cur):
+        """
+            Loads the recent readings from the database, replacing the current content
+        """
+        with self._sync_lock:
+            self._warm(cur)
+
+    def _warm(self, cur):
+        horizon = int(self.clock()) - self.window
+        last_id = cur.execute(queries.SELECT_LAST_READING_ID).fetchone()[0] or 0
+        query = partitions.route(cur, queries.SELECT_RECENT_READINGS, horizon)
+        devices = {}
+        for device_uuid, columns in load_columns(cur, query, (horizon, last_id), horizon).items():
+            devices[device_uuid] = DeviceWindow()
+            devices[device_uuid].extend(columns)
+        horizon = self._evict(devices, horizon)
+
+        with self._lock:
+            self.devices = devices
+            self.horizon = horizon
+            self.last_id = last_id
+            self._synced_at = self.clock()
+
+    def sync(self, cur):
+        """
+            Catches up with the readings written since the last sync
+        """
+        with self._sync_lock:
+            if self.last_id is None:
+                self._warm(cur)
+                return
+            if self._synced_at is not None and self.clock() - self._synced_at < self.sync_interval:
+                return
+
+            last_id = cur.execute(queries.SELECT_LAST_READING_ID).fetchone()[0] or 0
+            if last_id < self.last_id:
+                # The readings were deleted under us (e.g. the table was rebuilt), start over
+                self._warm(cur)
+                return
+            new_columns = {}
+            if last_id > self.last_id:
+                new_columns = load_columns(cur, queries.SELECT_READINGS_SINCE, (self.last_id, last_id), self.horizon)
+
+            with self._lock:
+                for device_uuid, columns in new_columns.items():
+                    if device_uuid not in self.devices:
+                        self.devices[device_uuid] = DeviceWindow()
+                    self.devices[device_uuid].extend(columns)
+                self.last_id = last_id
+                self.horizon = self._evict(self.devices, self.horizon)
+                self._synced_at = self.clock()
+
+    def covers(self, start_date):
+        """
+            Whether every reading created since start_date is in the store
+        """
+        return start_date is not None and self.horizon is not None and start_date >= self.horizon
+
+    def readings_by_date_range(self, start_date, end_date, after=None, limit=None):
+        """
+            Same rows (device_uuid, type, value, date_created, id) and next page cursor as
+            pagination.keyset_page over SELECT_READINGS_BY_DATE_RANGE
+        """
+        import numpy as np
+
+        after = parse_cursor(after) if after is not None else None
+
+        with self._lock:
+            columns = []
+            for device_uuid, device in self.devices.items():
+                indexes = device.select(start_date, end_date)
+                if len(indexes):
+                    columns.append((device_uuid, device.ids[indexes], device.dates[indexes],
+                                    device.values[indexes], device.types[indexes]))
+
+        if not columns:
+            return [], None
+
+        devices = np.concatenate([np.full(len(ids), index) for index, (_, ids, _, _, _) in enumerate(columns)])
+        ids, dates, values, types = (np.concatenate([column[position] for column in columns]) for position in range(1, 5))
+        order = np.lexsort((ids, dates))
+        if after is not None:
+            after_date, after_id = after
+            order = order[(dates[order] > after_date) | ((dates[order] == after_date) & (ids[order] > after_id))]
+
+        next_cursor = None
+        if limit is not None and len(order) > limit:
+            order = order[:limit]
+            next_cursor = '{},{}'.format(dates[order[-1]], ids[order[-1]])
+
+        rows = [(columns[device][0], READINGS_TYPES[reading_type], value, date_created, row_id)
+                for device, reading_type, value, date_created, row_id in zip(
+                    devices[order].tolist(), types[order].tolist(), values[order].tolist(),
+                    dates[order].tolist(), ids[order].tolist())]
+        return rows, next_cursor
+
+    def rollup(self, device_uuid, width, reading_type=None, start_date=None, end_date=None):
+        """
+            Same buckets as rollups.rollup, computed from the device columns
+        """
+        import numpy as np
+
+        with self._lock:
+            device = self.devices.get(device_uuid)
+            if device is None:
+                return []
+            indexes = device.select(start_date, end_date, reading_type)
+            dates = device.dates[indexes]
+            values = device.values[indexes].astype(np.int64)
+
+        if not len(dates):
+            return []
+
+        # Dates are sorted, so are the buckets: each one is a contiguous run
+        buckets = dates // width * width
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        counts = np.diff(np.r_[starts, len(buckets)])
+        totals = np.add.reduceat(values, starts)
+        minimums = np.minimum.reduceat(values, starts)
+        maximums = np.maximum.reduceat(values, starts)
+
+        return [{'bucket': bucket, 'count': count, 'min': minimum, 'max': maximum, 'mean': exact_mean(total, count)}
+                for bucket, count, total, minimum, maximum in zip(
+                    buckets[starts].tolist(), counts.tolist(), totals.tolist(), minimums.tolist(), maximums.tolist())]
+
+
+_stores_lock = threading.Lock()
+
+
+def get_store(cur):
+    """
+        The hot store of the current app synced with the database, None when HOTSTORE_ENABLED is false.
+        Loaded on first use in every process, so forked workers do not share it.
+    """
+    app = current_app._get_current_object()
+    if not app.config['HOTSTORE_ENABLED']:
+        return None
+
+    with _stores_lock:
+        store = app.extensions.get('hot_store')
+        if store is None or store.pid != os.getpid():
+            store = HotStore(window=app.config['HOTSTORE_WINDOW'], max_readings=app.config['HOTSTORE_MAX_READINGS'],
+                             max_total_readings=app.config['HOTSTORE_MAX_TOTAL_READINGS'],
+                             sync_interval=app.config['HOTSTORE_SYNC_INTERVAL'])
+            app.extensions['hot_store'] = store
+
+    store.sync(cur)
+    return store
+
+
+def mark_stale():
+    """
+        Makes the next read of the current app sync its hot store (called after every local write)
+    """
+    store = current_app.extensions.get('hot_store')
+    if store is not None:
+        store.mark_stale()
@@ -0,0 +1,219 @@
+import csv
+import io
+import json
+import multiprocessing
+import os
+import time
+
+from sensors.database import queries
+from sensors.stats.rollups import rebuild_rollups
+from sensors.stats.stats import rebuild_device_stats
+from sensors.validators.validators import reading_is_valid, READINGS_TYPES_ERRORS
+
+__author__ = 'vgarcia'
+
+IMPORT_FORMATS = ['csv', 'ndjson']
+
+# Lines (records for CSV) parsed at once (by a worker process when there are several)
+CHUNK_LINES = 50000
+
+# Readings inserted per transaction
+TRANSACTION_SIZE = 500000
+
+# Indexes and triggers of the readings table are dropped during a deferred import, then created again
+SELECT_DEFERRED_SCHEMA = ("select type, name, sql from sqlite_master where tbl_name='readings' "
+                          "and type in ('index', 'trigger') and sql is not null")
+
+
+def file_format(path):
+    """
+        The import format of a file from its extension (csv by default)
+    """
+    return 'ndjson' if os.path.splitext(path)[1].lower() in ('.ndjson', '.jsonl') else 'csv'
+
+
+def _reading_row(device_uuid, reading_type, value, date_created):
+    """
+        The (row, error) of a parsed reading, validated with the same rules as the API
+    """
+    try:
+        value = int(value)
+        date_created = int(date_created)
+    except (TypeError, ValueError):
+        return None, READINGS_TYPES_ERRORS[2]
+    if not device_uuid or not isinstance(device_uuid, str):
+        return None, READINGS_TYPES_ERRORS[2]
+
+    is_valid, error = reading_is_valid(reading_type, value)
+    if not is_valid:
+        return None, error
+    return (device_uuid, reading_type, value, date_created), None
+
+
+def csv_line(fields):
+    """
+        The CSV text of a record, on a single line (the line breaks of quoted fields are escaped)
+    """
+    text = io.StringIO()
+    csv.writer(text, lineterminator='').writerow(fields)
+    return text.getvalue().replace('\r', '\\r').replace('\n', '\\n')
+
+
+def parse_csv(records):
+    rows = []
+    rejected = []
+    for number, fields in records:
+        if len(fields) != 4:
+            rejected.append((number, READINGS_TYPES_ERRORS[2], csv_line(fields)))
+            continue
+        if number == 1 and fields == queries.READING_COLUMNS:
+            continue
+        row, error = _reading_row(*fields)
+        if error:
+            rejected.append((number, error, csv_line(fields)))
+        else:
+            rows.append(row)
+    return rows, rejected
+
+
+def parse_ndjson(lines, first_line):
+    rows = []
+    rejected = []
+    for number, line in enumerate(lines, first_line):
+        if not line.strip():
+            continue
+        try:
+            reading = json.loads(line)
+            row, error = _reading_row(reading.get('device_uuid'), reading.get('type'), reading.get('value'),
+                                      reading.get('date_created'))
+        except (ValueError, AttributeError):
+            row, error = None, READINGS_TYPES_ERRORS[2]
+        if error:
+            rejected.append((number, error, line))
+        else:
+            rows.append(row)
+    return rows, rejected
+
+
+PARSERS = {'csv': parse_csv, 'ndjson': parse_ndjson}
+
+
+def _parse_chunk(task):
+    import_format, chunk = task[0], task[1:]
+    return PARSERS[import_format](*chunk)
+
+
+def read_chunks(path, import_format, chunk_lines=CHUNK_LINES):
+    """
+        Streams the file as parsing tasks: (format, lines, number of the first line) for NDJSON, and
+        (format, records) for CSV, where every record is (number of its first line, fields) as a quoted
+        field may span several lines
+    """
+    with open(path, newline='') as stream:
+        if import_format == 'csv':
+            yield from _read_csv_chunks(stream, chunk_lines)
+            return
+
+        lines = []
+        first_line = 1
+        for line in stream:
+            lines.append(line.rstrip('\r\n'))
+            if len(lines) == chunk_lines:
+                yield import_format, lines, first_line
+                first_line += len(lines)
+                lines = []
+        if lines:
+            yield import_format, lines, first_line
+
+
+def _read_csv_chunks(stream, chunk_lines):
+    reader = csv.reader(stream)
+    records = []
+    number = 1
+    for fields in reader:
+        records.append((number, fields))
+        number = reader.line_num + 1
+        if len(records) == chunk_lines:
+            yield 'csv', records
+            records = []
+    if records:
+        yield 'csv', records
+
+
+def defer_schema(conn):
+    """
+        Drops the indexes and triggers of the readings table, returning the statements creating them again
+    """
+    schema = conn.execute(SELECT_DEFERRED_SCHEMA).fetchall()
+    with conn:
+        for object_type, name, _ in schema:
+            conn.execute('DROP {} IF EXISTS "{}"'.format(object_type.upper(), name))
+    return [sql for _, _, sql in schema]
+
+
+def restore_schema(conn, statements):
+    """
+        Creates the deferred indexes and triggers again and rebuilds the statistics they maintain
+    """
+    with conn:
+        for statement in statements:
+            conn.execute(statement)
+    rebuild_device_stats(conn)
+    rebuild_rollups(conn)
+
+
+def import_files(conn, paths, import_format=None, processes=1, transaction_size=TRANSACTION_SIZE,
+                 chunk_lines=CHUNK_LINES, defer=False, rejected=None, progress=None):
+    """
+        Loads the readings of the files in transactions of transaction_size readings.
+
+        With defer, the indexes and triggers of the readings table are dropped during the load and
+        created again at the end (then the device statistics and rollups are rebuilt), which is much
+        faster for large backfills but needs exclusive access to the database: the readings written
+        meanwhile by a running app would be left out of its statistics, and its queries would be slow.
+        Files are parsed by "processes" worker processes. Rejected lines are written to the rejected
+        stream as "<file>:<line number>\\t<error>\\t<line>". progress(report) is called after every commit.
+
+        Returns the report: readings imported, lines rejected, seconds taken loading the readings and
+        seconds taken in total (the load plus the schema restore).
+    """
+    report = {'imported': 0, 'rejected': 0, 'load_seconds': 0.0, 'seconds': 0.0}
+    started = time.perf_counter()
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    statements = defer_schema(conn) if defer else []
+
+    try:
+        pending = 0
+        conn.execute('BEGIN')
+        for path in paths:
+            tasks = read_chunks(path, import_format or file_format(path), chunk_lines)
+            results = pool.imap(_parse_chunk, tasks) if pool is not None else map(_parse_chunk, tasks)
+
+            for rows, rejected_lines in results:
+                conn.executemany(queries.INSERT_READING, rows)
+                pending += len(rows)
+                report['imported'] += len(rows)
+                report['rejected'] += len(rejected_lines)
+                if rejected is not None:
+                    for number, error, line in rejected_lines:
+                        rejected.write('{}:{}\t{}\t{}\n'.format(path, number, error, line))
+
+                if pending >= transaction_size:
+                    conn.commit()
+                    pending = 0
+                    report['load_seconds'] = report['seconds'] = time.perf_counter() - started
+                    if progress is not None:
+                        progress(report)
+                    conn.execute('BEGIN')
+        conn.commit()
+        report['load_seconds'] = time.perf_counter() - started
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        if pool is not None:
+            pool.terminate()
+        if statements:
+            restore_schema(conn, statements)
+
+    report['seconds'] = time.perf_counter() - started
+    return report
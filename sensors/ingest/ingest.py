@@ -0,0 +1,254 @@
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from flask import current_app
+
+from sensors.cache import cache
+from sensors.database import queries
+from sensors.database.database import ConnectionPool, database_path
+from sensors.hotstore import hotstore
+
+__author__ = 'vgarcia'
+
+logger = logging.getLogger(__name__)
+
+# Put in the queue to make the writer commit what is pending and exit
+_STOP = object()
+
+_writers_lock = threading.Lock()
+
+
+class IngestWriter(object):
+    """
+        Bounded queue of readings drained by a single writer thread in group commits.
+        A group is committed when it reaches batch_size readings or when flush_interval
+        seconds have passed since its first reading, whichever comes first.
+        A group the database cannot take (locked, I/O error) is tried again "retries" times, waiting
+        retry_delay seconds and twice as long every time. A group with readings it cannot store is
+        written one reading at a time, so only those are lost. Either way the lost readings, already
+        answered 202, are logged and counted as failed.
+    """
+
+    def __init__(self, path, queue_size=10000, batch_size=500, flush_interval=0.05, on_commit=None, retries=3,
+                 retry_delay=0.1):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_commit = on_commit
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._counters_lock = threading.Lock()
+        self._counters = {
+            'queued': 0,
+            'rejected': 0,
+            'committed': 0,
+            'failed': 0,
+            'failed_commits': 0,
+            'retries': 0,
+            'commits': 0,
+            'last_commit_ms': 0.0,
+            'max_commit_ms': 0.0,
+            'total_commit_ms': 0.0,
+        }
+
+    def _ensure_started(self):
+        # Threads do not survive a fork, so a pre-forked worker starts its own writer (and queue)
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, row):
+        """
+            Enqueues a (device_uuid, type, value, date_created) row, returning False when the queue is full
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._count(rejected=1)
+            return False
+        self._count(queued=1)
+        return True
+
+    def flush(self):
+        """
+            Blocks until every reading queued so far has been committed (or has failed)
+        """
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def stop(self):
+        """
+            Commits the pending readings and stops the writer thread
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and self._pid == os.getpid() and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join()
+
+    def stats(self):
+        with self._counters_lock:
+            stats = dict(self._counters)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['queue_size'] = self._queue.maxsize
+        stats['mean_commit_ms'] = stats['total_commit_ms'] / stats['commits'] if stats['commits'] else 0.0
+        return stats
+
+    def _count(self, **increments):
+        with self._counters_lock:
+            for name, increment in increments.items():
+                self._counters[name] += increment
+
+    def _next_group(self):
+        """
+            Waits for a first reading and gathers the group committed with it, the second
+            element tells whether the writer was asked to stop
+        """
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+
+        group = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(group) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                row = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is _STOP:
+                return group, True
+            group.append(row)
+        return group, False
+
+    def _run(self):
+        pool = ConnectionPool(self.path, size=1)
+        conn = None
+        try:
+            stopping = False
+            while not stopping:
+                group, stopping = self._next_group()
+                if group:
+                    conn = self._commit(pool, conn, group)
+                if stopping:
+                    self._queue.task_done()
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _commit(self, pool, conn, group):
+        """
+            Commits the group, (re)connecting if needed, and returns the connection to use for the next one
+        """
+        started = time.perf_counter()
+        committed = group
+        try:
+            try:
+                for attempt in range(self.retries + 1):
+                    try:
+                        if conn is None:
+                            conn = pool.checkout()
+                        with conn:
+                            conn.executemany(queries.INSERT_READING, group)
+                        break
+                    except sqlite3.OperationalError:
+                        if attempt == self.retries:
+                            raise
+                        logger.warning('Could not commit %s queued readings, trying again', len(group),
+                                       exc_info=True)
+                        self._count(retries=1)
+                        time.sleep(self.retry_delay * 2 ** attempt)
+            except sqlite3.OperationalError:
+                logger.exception('Could not commit %s queued readings', len(group))
+                self._lost(group)
+                committed = []
+            except Exception:
+                logger.exception('Could not commit %s queued readings, writing them one by one', len(group))
+                conn, committed = self._write_each(pool, conn, group)
+
+            if committed is group:
+                elapsed = (time.perf_counter() - started) * 1000
+                with self._counters_lock:
+                    self._counters['committed'] += len(group)
+                    self._counters['commits'] += 1
+                    self._counters['last_commit_ms'] = elapsed
+                    self._counters['total_commit_ms'] += elapsed
+                    self._counters['max_commit_ms'] = max(self._counters['max_commit_ms'], elapsed)
+            else:
+                self._count(committed=len(committed), failed_commits=1)
+            if committed and self.on_commit is not None:
+                try:
+                    self.on_commit({row[0] for row in committed})
+                except Exception:
+                    logger.exception('Ingest commit hook failed')
+        finally:
+            for _ in group:
+                self._queue.task_done()
+        return conn
+
+    def _write_each(self, pool, conn, group):
+        """
+            Commits the readings of the group one by one, returning the connection and the committed readings
+        """
+        committed = []
+        for row in group:
+            try:
+                if conn is None:
+                    conn = pool.checkout()
+                with conn:
+                    conn.execute(queries.INSERT_READING, row)
+            except Exception:
+                logger.exception('Could not commit a queued reading')
+                self._lost([row])
+            else:
+                committed.append(row)
+        return conn, committed
+
+    def _lost(self, rows):
+        # Logged with their values, so they can be written again once the database takes them
+        for row in rows:
+            logger.error('Lost queued reading %r', row)
+        self._count(failed=len(rows))
+
+
+def get_writer():
+    """
+        The writer of the current app, created on first use. None when INGEST_MODE is not async
+    """
+    app = current_app._get_current_object()
+    if app.config['INGEST_MODE'] != 'async':
+        return None
+
+    with _writers_lock:
+        writer = app.extensions.get('ingest_writer')
+        if writer is None or writer.path != database_path(app):
+            def invalidate_devices(device_uuids):
+                with app.app_context():
+                    hotstore.mark_stale()
+                    for device_uuid in device_uuids:
+                        cache.invalidate_device(device_uuid)
+
+            writer = IngestWriter(database_path(app), queue_size=app.config['INGEST_QUEUE_SIZE'],
+                                  batch_size=app.config['INGEST_BATCH_SIZE'],
+                                  flush_interval=app.config['INGEST_FLUSH_INTERVAL'], on_commit=invalidate_devices)
+            app.extensions['ingest_writer'] = writer
+            # Commit what is still queued when the process exits
+            atexit.register(writer.stop)
+        return writer
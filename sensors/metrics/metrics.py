@@ -0,0 +1,416 @@
+import bisect
+import functools
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+from flask import Response, current_app, request
+
+from sensors.database import queries
+
+__author__ = 'vgarcia'
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds (seconds) of the latency histograms buckets
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = ['{}="{}"'.format(name, _escape(value)) for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter(object):
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def inc_many(self, increments):
+        """
+            Adds every (label values, amount) of increments at once
+        """
+        with self._lock:
+            values = self._values
+            for label_values, amount in increments:
+                values[label_values] = values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} counter'.format(self.name)]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append('{}{} {}'.format(self.name, _labels(self.labels, label_values), value))
+        return lines
+
+
+class Histogram(object):
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            self._observe(value, label_values)
+
+    def observe_many(self, observations):
+        """
+            Observes every (value, label values) of observations at once
+        """
+        with self._lock:
+            for value, label_values in observations:
+                self._observe(value, label_values)
+
+    def _observe(self, value, label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def count(self, *label_values):
+        series = self._series.get(label_values)
+        return series[2] if series else 0
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ['+Inf'], counts):
+                    cumulative += bucket_count
+                    lines.append('{}_bucket{} {}'.format(
+                        self.name, _labels(self.labels, label_values, [('le', bound)]), cumulative))
+                lines.append('{}_sum{} {}'.format(self.name, _labels(self.labels, label_values), total))
+                lines.append('{}_count{} {}'.format(self.name, _labels(self.labels, label_values), count))
+        return lines
+
+
+# Metrics of this process (every worker exposes its own)
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Time to produce the full response, per route',
+                            ('route', 'method', 'status'))
+REQUEST_QUERY_SECONDS = Histogram('http_request_sqlite_seconds', 'Time spent in SQLite while producing the response, '
+                                  'per route', ('route', 'method'))
+QUERY_SECONDS = Histogram('sqlite_query_duration_seconds', 'Time to execute a query and fetch its rows, per query',
+                          ('query',))
+QUERY_ROWS = Counter('sqlite_query_rows_total', 'Rows fetched (or written by executemany), per query', ('query',))
+READINGS_ACCEPTED = Counter('readings_accepted_total', 'Readings accepted, per ingest path', ('path',))
+READINGS_REJECTED = Counter('readings_rejected_total', 'Readings rejected, per error', ('error',))
+ALERTS_RAISED = Counter('alerts_raised_total', 'Alerts raised by the alert rules, per rule kind', ('kind',))
+
+METRICS = [REQUEST_SECONDS, REQUEST_QUERY_SECONDS, QUERY_SECONDS, QUERY_ROWS, READINGS_ACCEPTED, READINGS_REJECTED,
+           ALERTS_RAISED]
+
+
+def _query_names():
+    """
+        The queries module constants by SQL text, and a single pattern naming the templated ones ("{}",
+        "{readings}"): an alternative per template matching the start of any filling of it, the ones with
+        the most text first as they are the most specific
+    """
+    names = {}
+    patterns = []
+    for name, value in vars(queries).items():
+        if name.isupper() and isinstance(value, str):
+            parts = re.split(r'{\w*}', value)
+            if len(parts) > 1:
+                patterns.append((sum(len(part) for part in parts), name,
+                                 '.*'.join(re.escape(part) for part in parts)))
+            else:
+                names[value] = name
+    patterns.sort(key=lambda item: -item[0])
+    return names, re.compile('|'.join('(?P<{}>{})'.format(name, pattern) for _, name, pattern in patterns), re.DOTALL)
+
+
+_QUERY_NAMES, _QUERY_PATTERN = _query_names()
+
+
+def query_name(sql):
+    """
+        The name of the query in the queries module, or its first word for the ad hoc ones
+    """
+    name = _QUERY_NAMES.get(sql)
+    if name is None:
+        match = _QUERY_PATTERN.match(sql)
+        if match is not None:
+            name = match.lastgroup
+        else:
+            name = sql.split(None, 1)[0].lower() if sql.strip() else 'empty'
+        # Queries are a small fixed set, remember the lookup
+        _QUERY_NAMES[sql] = name
+    return name
+
+
+# Start time and SQLite time of the request handled by the current thread, and the queries it ran that were not
+# recorded yet: the ones of a request are recorded at once when it ends
+_request = threading.local()
+
+# Rows fetched at once when an instrumented cursor is iterated
+ITERATION_BATCH = 256
+
+# Queries left unrecorded by a thread outside of requests (cursors never fully fetched) before they are recorded anyway
+MAX_PENDING_QUERIES = 1024
+
+_execute = sqlite3.Cursor.execute
+_executemany = sqlite3.Cursor.executemany
+_fetchone = sqlite3.Cursor.fetchone
+_fetchmany = sqlite3.Cursor.fetchmany
+_fetchall = sqlite3.Cursor.fetchall
+_perf_counter = time.perf_counter
+
+
+def record_queries(queries_run):
+    """
+        Records the queries ([sql, parameters, seconds, rows, connection]) not recorded yet, marking them so
+    """
+    observations = []
+    increments = []
+    total = 0.0
+    for query in queries_run:
+        sql, parameters, elapsed, rows, conn = query
+        if sql is None:
+            continue
+        query[0] = None
+        name = query_name(sql)
+        observations.append((elapsed, (name,)))
+        increments.append(((name,), rows))
+        total += elapsed
+        slow_query_ms = conn.slow_query_ms
+        if slow_query_ms and elapsed * 1000 >= slow_query_ms:
+            log_slow_query(conn, name, sql, parameters, elapsed, rows)
+    if observations:
+        QUERY_SECONDS.observe_many(observations)
+        QUERY_ROWS.inc_many(increments)
+        query_seconds = getattr(_request, 'query_seconds', None)
+        if query_seconds is not None:
+            _request.query_seconds = query_seconds + total
+
+
+def record_pending():
+    """
+        Records the queries run by the current thread that were not recorded yet
+    """
+    pending = getattr(_request, 'pending', None)
+    if pending:
+        _request.pending = []
+        record_queries(pending)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+        Cursor timing every query from its execution until its rows are all fetched (or the cursor is closed or
+        re-executed, or the request ends), counting the rows and logging the plan of the slow ones. Fetching is
+        timed per batch (fetchmany, fetchall, iteration), fetchone only counts: its first row was read by execute.
+        The queries of a request are recorded together once it ends, the other ones as soon as they are done.
+    """
+
+    _query = None
+
+    def execute(self, sql, parameters=()):
+        if self._query is not None:
+            self._finish()
+        start = _perf_counter()
+        _execute(self, sql, parameters)
+        elapsed = _perf_counter() - start
+        # Shared with the thread pending queries, so a cursor dropped with rows left is recorded anyway
+        self._query = query = [sql, parameters, elapsed, 0, self.connection]
+        try:
+            pending = _request.pending
+        except AttributeError:
+            pending = _request.pending = []
+        pending.append(query)
+        if len(pending) > MAX_PENDING_QUERIES and getattr(_request, 'started', None) is None:
+            record_pending()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        if self._query is not None:
+            self._finish()
+        start = _perf_counter()
+        _executemany(self, sql, seq_of_parameters)
+        record_queries([[sql, None, _perf_counter() - start, max(self.rowcount, 0), self.connection]])
+        return self
+
+    def _finish(self):
+        query, self._query = self._query, None
+        if getattr(_request, 'started', None) is None:
+            record_queries([query])
+
+    def fetchone(self):
+        row = _fetchone(self)
+        if self._query is not None:
+            if row is None:
+                self._finish()
+            else:
+                self._query[3] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        start = _perf_counter()
+        rows = _fetchmany(self, self.arraysize if size is None else size)
+        query = self._query
+        if query is not None:
+            query[2] += _perf_counter() - start
+            query[3] += len(rows)
+            if not rows:
+                self._finish()
+        return rows
+
+    def fetchall(self):
+        start = _perf_counter()
+        rows = _fetchall(self)
+        query = self._query
+        if query is not None:
+            query[2] += _perf_counter() - start
+            query[3] += len(rows)
+            self._finish()
+        return rows
+
+    def __iter__(self):
+        return self._iterate()
+
+    def _iterate(self):
+        # Rows are fetched (and timed) in batches, a Python call per row would cost more than the row itself
+        while True:
+            rows = self.fetchmany(ITERATION_BATCH)
+            if not rows:
+                return
+            yield from rows
+
+    def close(self):
+        if self._query is not None:
+            self._finish()
+        super().close()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+        Connection whose cursors (including the ones of execute/executemany) are InstrumentedCursor
+    """
+
+    slow_query_ms = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def log_slow_query(conn, name, sql, parameters, elapsed, rows):
+    plan = []
+    if parameters is not None and sql.lstrip().lower().startswith('select'):
+        try:
+            # A plain cursor, so explaining is not measured itself
+            plan = [row[-1] for row in sqlite3.Cursor(conn).execute('EXPLAIN QUERY PLAN ' + sql, parameters)]
+        except sqlite3.Error:
+            pass
+    logger.warning('Slow query %s (%.1f ms, %s rows): %s | plan: %s', name, elapsed * 1000, rows, sql,
+                   '; '.join(plan) or '-')
+
+
+@functools.lru_cache()
+def connection_factory(slow_query_ms=0):
+    """
+        The InstrumentedConnection class to connect with, logging the queries slower than slow_query_ms (0 = never)
+    """
+    return type('InstrumentedConnection', (InstrumentedConnection,), {'slow_query_ms': slow_query_ms or None})
+
+
+def queries_enabled(config):
+    """
+        Whether the queries are timed, only the requests are by default
+    """
+    return config['METRICS_ENABLED'] and (config['METRICS_QUERIES_ENABLED'] or bool(config['METRICS_SLOW_QUERY_MS']))
+
+
+def _start_request(time_queries=True):
+    if time_queries:
+        # What the thread ran since the last request (commands, ingest) is not part of this one
+        record_pending()
+    _request.started = time.perf_counter()
+    _request.query_seconds = 0.0 if time_queries else None
+
+
+def _end_request(response):
+    started = getattr(_request, 'started', None)
+    if started is None:
+        return response
+    _request.started = None
+    current_request = request._get_current_object()
+    route = current_request.url_rule.rule if current_request.url_rule is not None else 'unmatched'
+    method = current_request.method
+    status = str(response.status_code)
+
+    def observe():
+        # Called once the (possibly streamed) body was fully sent
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route, method, status)
+        record_pending()
+        query_seconds = getattr(_request, 'query_seconds', None)
+        if query_seconds is not None:
+            REQUEST_QUERY_SECONDS.observe(query_seconds, route, method)
+            _request.query_seconds = None
+
+    response.call_on_close(observe)
+    return response
+
+
+def init_app(app):
+    """
+        Times every request of the app while METRICS_ENABLED is set, and its queries with METRICS_QUERIES_ENABLED
+    """
+    config = app.config
+
+    @app.before_request
+    def start_request():
+        if config['METRICS_ENABLED']:
+            _start_request(queries_enabled(config))
+
+    app.after_request(_end_request)
+
+
+def render():
+    """
+        Every metric of this process in the Prometheus text format
+    """
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+
+    writer = current_app.extensions.get('ingest_writer')
+    if writer is not None:
+        for name, value in sorted(writer.stats().items()):
+            lines.append('# TYPE ingest_{} gauge'.format(name))
+            lines.append('ingest_{} {}'.format(name, value))
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_response():
+    return Response(render(), mimetype=PROMETHEUS_MIMETYPE)
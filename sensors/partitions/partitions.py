@@ -0,0 +1,207 @@
+import calendar
+import contextlib
+import time
+
+from sensors.database import queries
+
+__author__ = 'vgarcia'
+
+# New readings are always written to the readings table, the readings of past months are moved from it
+# to one table per month (readings_YYYYMM, a partition) by partition_readings
+HEAD = 'readings'
+
+ACTIVE = 'active'
+
+# States of a retired partition: its readings are gone, the rollups are kept (compacted) or deleted (dropped)
+RETENTION_STATES = {'compact': 'compacted', 'drop': 'dropped'}
+
+RETENTION_MODES = list(RETENTION_STATES)
+
+# Readings moved per transaction, and seconds waited between two of them so writers are not held back
+MOVE_BATCH = 5000
+MOVE_PAUSE = 0.05
+
+# Seconds waited after a partition is added to (or retired from) the catalog before readings are moved
+# to it (before it is dropped), so the queries routed with the previous catalog are done with their tables
+ROUTING_GRACE = 1.0
+
+# Bounds of an open range
+MIN_DATE = -2 ** 63
+MAX_DATE = 2 ** 63 - 1
+
+
+def month_start(timestamp, months=0):
+    """
+        Timestamp of the start (UTC) of the month of the given timestamp, shifted by "months" months
+    """
+    date = time.gmtime(timestamp)
+    index = date.tm_year * 12 + date.tm_mon - 1 + months
+    return calendar.timegm((index // 12, index % 12 + 1, 1, 0, 0, 0))
+
+
+def partition_name(start_date):
+    return '{}_{}'.format(HEAD, time.strftime('%Y%m', time.gmtime(start_date)))
+
+
+def readings_tables(cur, start_date=None, end_date=None):
+    """
+        The tables holding the readings created within [start_date, end_date]: the active partitions
+        overlapping the range (oldest first) and the readings table, which may hold readings of any date
+        but is left out when it has none within the range (as for most ranges in past months)
+    """
+    start_date = MIN_DATE if start_date is None else start_date
+    end_date = MAX_DATE if end_date is None else end_date
+    tables = [row[0] for row in cur.execute(queries.SELECT_PARTITIONS_IN_RANGE, (ACTIVE, end_date, start_date))
+              .fetchall()]
+    if not tables or cur.execute(queries.SELECT_ANY_READING_IN_RANGE, (start_date, end_date)).fetchone():
+        tables.append(HEAD)
+    return tables
+
+
+def readings_source(tables):
+    """
+        The table to read, or a union of the given tables that SQLite flattens into the outer query
+        (so every table is searched with its own indexes and ordered results are merged)
+    """
+    if len(tables) == 1:
+        return tables[0]
+    return '({})'.format(' union all '.join(queries.SELECT_PARTITION.format(table) for table in tables))
+
+
+def route(cur, query, start_date=None, end_date=None):
+    """
+        The query (see "{readings}" in sensors.database.queries) reading only the tables that may hold readings
+        created within [start_date, end_date]
+    """
+    return query.replace('{readings}', readings_source(readings_tables(cur, start_date, end_date)))
+
+
+def route_each(cur, query, merge_query, start_date=None, end_date=None, conditions='1'):
+    """
+        The query (with the given "{}" conditions) run on every table that may hold readings created within
+        [start_date, end_date], with its results combined by merge_query when there are several tables.
+        Returns it along with the number of tables, the query parameters are repeated for each of them.
+    """
+    tables = readings_tables(cur, start_date, end_date)
+    if len(tables) == 1:
+        return query.replace('{readings}', tables[0]).format(conditions), 1
+    return merge_query.format(' union all '.join('select * from ({})'.format(
+        query.replace('{readings}', table).format(conditions)) for table in tables)), len(tables)
+
+
+def retired_until(cur):
+    """
+        The end of the last retired partition: the raw readings before it are gone
+    """
+    return cur.execute(queries.SELECT_RETIRED_UNTIL, (ACTIVE,)).fetchone()[0]
+
+
+@contextlib.contextmanager
+def write_transaction(conn):
+    # Takes the write lock right away, as the statements of a move read what they write
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def create_partition(conn, name, start_date, end_date):
+    with write_transaction(conn):
+        for statement in queries.CREATE_PARTITION:
+            conn.execute(statement.format(name=name))
+        conn.execute(queries.INSERT_PARTITION, (name, start_date, end_date, ACTIVE))
+
+
+def move_readings(conn, name, start_date, end_date, batch_size=MOVE_BATCH, pause=MOVE_PAUSE):
+    """
+        Moves the readings created within [start_date, end_date) from the readings table to the given partition,
+        batch_size readings per transaction. Their statistics and rollups are left as they are.
+        Returns the number of readings moved.
+    """
+    moved = 0
+    params = (start_date, end_date, batch_size)
+    while True:
+        with write_transaction(conn):
+            conn.execute(queries.START_MOVE)
+            count = conn.execute(queries.COPY_MOVED_READINGS.format(name), params).rowcount
+            conn.execute(queries.DELETE_MOVED_READINGS, params)
+            conn.execute(queries.END_MOVE)
+        moved += count
+        if count < batch_size:
+            return moved
+        time.sleep(pause)
+
+
+def retire_partition(conn, name, start_date, end_date, state, grace=ROUTING_GRACE):
+    """
+        Drops a partition and takes its readings out of the device statistics and quantile sketches. The hourly
+        and daily rollups of its month are kept when it is compacted and deleted when it is dropped.
+    """
+    conn.execute(queries.DROP_RETIRED_HISTOGRAM)
+    # Grouped before taking the write lock, only partition_readings writes to the partitions
+    conn.execute(queries.CREATE_RETIRED_HISTOGRAM.format(name))
+    conn.execute(queries.INDEX_RETIRED_HISTOGRAM)
+    try:
+        with write_transaction(conn):
+            for statement in queries.RETIRE_PARTITION:
+                conn.execute(statement)
+            if state == RETENTION_STATES['drop']:
+                conn.execute(queries.DELETE_ROLLUPS_IN_RANGE, (start_date, end_date))
+            conn.execute(queries.DELETE_SKETCHES_IN_RANGE, (start_date, end_date))
+            conn.execute(queries.UPDATE_PARTITION_STATE, (state, name))
+    finally:
+        conn.execute(queries.DROP_RETIRED_HISTOGRAM)
+
+    time.sleep(grace)
+    with write_transaction(conn):
+        conn.execute(queries.DROP_PARTITION.format(name))
+
+
+def partition_readings(conn, now=None, retention_months=0, retention_mode='compact', batch_size=MOVE_BATCH,
+                       pause=MOVE_PAUSE, grace=ROUTING_GRACE, progress=None):
+    """
+        Moves the readings created before the current month to their monthly partitions, then retires
+        the partitions older than retention_months months (0 keeps them all) with the given retention mode
+        (compact or drop). Every batch of moved readings is committed on its own, so the app keeps
+        writing meanwhile; progress(report) is called after every month moved. Run one at a time.
+
+        Returns the report: readings moved, partitions created and partitions retired.
+    """
+    now = time.time() if now is None else now
+    report = {'moved': 0, 'created': [], 'retired': []}
+    partitions = {name: (start_date, end_date, state)
+                  for name, start_date, end_date, state in conn.execute(queries.SELECT_PARTITIONS).fetchall()}
+
+    # Tables of retired partitions left behind by an interrupted run
+    for name, (_, _, state) in partitions.items():
+        if state != ACTIVE:
+            with write_transaction(conn):
+                conn.execute(queries.DROP_PARTITION.format(name))
+
+    while True:
+        oldest = conn.execute(queries.SELECT_OLDEST_TO_MOVE, (month_start(now),)).fetchone()[0]
+        if oldest is None:
+            break
+        start_date, end_date = month_start(oldest), month_start(oldest, 1)
+        name = partition_name(start_date)
+        if name not in partitions or partitions[name][2] != ACTIVE:
+            # Readings of a retired month written since are moved to a new partition, then retired again
+            create_partition(conn, name, start_date, end_date)
+            partitions[name] = (start_date, end_date, ACTIVE)
+            report['created'].append(name)
+            time.sleep(grace)
+        report['moved'] += move_readings(conn, name, start_date, end_date, batch_size, pause)
+        if progress is not None:
+            progress(report)
+
+    if retention_months:
+        cutoff = month_start(now, -retention_months)
+        for name, (start_date, end_date, state) in sorted(partitions.items(), key=lambda item: item[1][0]):
+            if state == ACTIVE and end_date <= cutoff:
+                retire_partition(conn, name, start_date, end_date, RETENTION_STATES[retention_mode], grace)
+                report['retired'].append(name)
+
+    return report
@@ -0,0 +1,341 @@
+import itertools
+import time
+
+from flask import current_app
+
+from sensors.alerts import alerts
+from sensors.binary import binary
+from sensors.cache import cache
+from sensors.database import pagination
+from sensors.database import queries
+from sensors.database.database import get_db
+from sensors.export import export
+from sensors.hotstore import hotstore
+from sensors.ingest import ingest
+from sensors.metrics import metrics
+from sensors.partitions import partitions
+from sensors.stats import rollups
+from sensors.stats import stats
+from sensors.validators.validators import reading_is_valid, readings_are_valid, date_created_is_valid, INGEST_ERRORS, \
+    READINGS_TYPES
+
+__author__ = 'vgarcia'
+
+# Business logic shared by the API and UI routes. Every function runs inside an app
+# context and uses the connection bound to it.
+
+
+def list_devices():
+    cur = get_db().cursor()
+    cur.execute(partitions.route(cur, queries.SELECT_DEVICES))
+    return [{'device_uuid': row[0]} for row in cur.fetchall()]
+
+
+def add_reading(device_uuid, sensor_type, value, date_created):
+    """
+        Validates and stores a single reading, returning the (is_valid, result) of the validation
+    """
+    is_valid, result = reading_is_valid(sensor_type, value)
+    if is_valid:
+        is_valid, result = date_created_is_valid(date_created)
+
+    if is_valid:
+        with get_db() as conn:
+            conn.execute(queries.INSERT_READING, (device_uuid, sensor_type, value, date_created))
+        hotstore.mark_stale()
+        cache.invalidate_device(device_uuid)
+        metrics.READINGS_ACCEPTED.inc('sync')
+        alerts.evaluate_readings([(device_uuid, sensor_type, value, date_created)])
+    else:
+        metrics.READINGS_REJECTED.inc(result)
+
+    return is_valid, result
+
+
+def queue_reading(device_uuid, sensor_type, value, date_created):
+    """
+        Validates a single reading and hands it to the ingest writer, returning the (is_valid, result)
+        of the validation or (False, INGEST_QUEUE_FULL) when the queue has no room left
+    """
+    is_valid, result = reading_is_valid(sensor_type, value)
+    if is_valid:
+        is_valid, result = date_created_is_valid(date_created)
+
+    if is_valid:
+        if not ingest.get_writer().submit((device_uuid, sensor_type, value, date_created)):
+            is_valid, result = False, INGEST_ERRORS[0]
+        else:
+            metrics.READINGS_ACCEPTED.inc('async')
+            alerts.evaluate_readings([(device_uuid, sensor_type, value, date_created)])
+
+    if not is_valid:
+        metrics.READINGS_REJECTED.inc(result)
+
+    return is_valid, result
+
+
+def add_readings(device_uuid, readings):
+    """
+        Validates a batch of readings and stores the valid ones in a single transaction,
+        returning the accept/reject result of every reading and the number of readings stored
+    """
+    now = int(time.time())
+    rows = []
+    results = []
+
+    for index, (reading, (is_valid, result)) in enumerate(zip(readings, readings_are_valid(readings))):
+        if is_valid:
+            rows.append((device_uuid, reading.get('type'), int(reading.get('value')),
+                         reading.get('date_created', now)))
+            results.append({'index': index, 'status': 'accepted'})
+        else:
+            results.append({'index': index, 'status': 'rejected', 'error': result})
+            metrics.READINGS_REJECTED.inc(result)
+
+    if rows:
+        with get_db() as conn:
+            conn.executemany(queries.INSERT_READING, rows)
+        hotstore.mark_stale()
+        cache.invalidate_device(device_uuid)
+        metrics.READINGS_ACCEPTED.inc('batch', amount=len(rows))
+        alerts.evaluate_readings(rows)
+
+    return results, len(rows)
+
+
+def add_binary_readings(device_uuid, data):
+    """
+        Decodes and validates a binary batch of readings (see sensors.binary) and stores the valid ones
+        in a single transaction, returning the results of the rejected readings only and the number of
+        readings stored. Raises ValueError when the data is not a valid batch.
+    """
+    import numpy as np
+
+    types, values, dates = binary.decode_readings(data)
+    errors = binary.validate_readings(types, values)
+    valid = errors == ''
+
+    results = [{'index': index, 'status': 'rejected', 'error': errors[index]}
+               for index in np.flatnonzero(~valid).tolist()]
+    for result in results:
+        metrics.READINGS_REJECTED.inc(result['error'])
+
+    accepted = int(np.count_nonzero(valid))
+    if accepted:
+        rows = list(zip(itertools.repeat(device_uuid), [READINGS_TYPES[code] for code in types[valid].tolist()],
+                        values[valid].tolist(), dates[valid].tolist()))
+        with get_db() as conn:
+            conn.executemany(queries.INSERT_READING, rows)
+        hotstore.mark_stale()
+        cache.invalidate_device(device_uuid)
+        metrics.READINGS_ACCEPTED.inc('binary', amount=accepted)
+        alerts.evaluate_readings(rows)
+
+    return results, accepted
+
+
+def device_readings(device_uuid, after=None, limit=None):
+    """
+        A page of the device readings and the cursor of the next one (raises ValueError on a malformed cursor)
+    """
+    cur = get_db().cursor()
+    return pagination.keyset_page(cur, partitions.route(cur, queries.SELECT_DEVICE_READINGS), (device_uuid,), after,
+                                  limit)
+
+
+def readings_by_type(reading_type, after=None, limit=None):
+    cur = get_db().cursor()
+    return pagination.keyset_page(cur, partitions.route(cur, queries.SELECT_READINGS_BY_TYPE), (reading_type,), after,
+                                  limit)
+
+
+def readings_by_date_range(start_date, end_date, after=None, limit=None):
+    """
+        A page of the readings created within the range (open ended on a missing bound), sliced from the hot store
+        when it holds the whole range
+    """
+    # The hot store and the SQL query must see the same bounds
+    start_date = partitions.MIN_DATE if start_date is None else start_date
+    end_date = partitions.MAX_DATE if end_date is None else end_date
+    cur = get_db().cursor()
+    store = hotstore.get_store(cur)
+    if store is not None and store.covers(start_date):
+        return store.readings_by_date_range(start_date, end_date, after, limit)
+    query = partitions.route(cur, queries.SELECT_READINGS_BY_DATE_RANGE, start_date, end_date)
+    return pagination.keyset_page(cur, query, (start_date, end_date), after, limit)
+
+
+def device_max(device_uuid, reading_type=None):
+    """
+        The last written of the device readings (of the given type only) holding their greatest value
+    """
+    cur = get_db().cursor()
+    conditions, params = stats.summary_filters(reading_type, prefix='+')
+    query, tables = partitions.route_each(cur, queries.SELECT_DEVICE_MAX, queries.MERGE_DEVICE_MAX,
+                                          conditions=' and '.join(conditions))
+    cur.execute(query, ([device_uuid] + params) * tables)
+    return [pagination.reading_to_dict(row) for row in cur.fetchall()]
+
+
+def device_median(device_uuid, reading_type=None):
+    """
+        The readings holding the median value of the device (of the given type only), found in its histogram
+    """
+    cur = get_db().cursor()
+    histogram = stats.device_histogram(cur, device_uuid, reading_type)
+    median_value = stats.histogram_value_at(histogram, stats.histogram_count(histogram) // 2)
+
+    conditions, params = stats.summary_filters(reading_type, prefix='+')
+    cur.execute(partitions.route(cur, queries.SELECT_DEVICE_READINGS_WITH_VALUE).format(' and '.join(conditions)),
+                [device_uuid, median_value] + params)
+    return [pagination.reading_to_dict(row) for row in cur.fetchall()]
+
+
+def device_mean(device_uuid, reading_type=None):
+    count, total, _, _ = stats.device_stats(get_db().cursor(), device_uuid, reading_type)
+    return {'value': stats.exact_mean(total, count)}
+
+
+def device_quartiles(device_uuid, reading_type=None, start_date=None, end_date=None, exact=False):
+    """
+        The 1st and 3rd quartiles of the device readings (of the given type only). Within a window they are
+        estimated from the hourly sketches, unless exact is set, otherwise read from the device histogram.
+    """
+    if start_date is None and end_date is None:
+        histogram = stats.device_histogram(get_db().cursor(), device_uuid, reading_type)
+        count = stats.histogram_count(histogram)
+        return {'quartile_1': stats.histogram_quantile(histogram, count, 0.25),
+                'quartile_3': stats.histogram_quantile(histogram, count, 0.75)}
+    if exact:
+        return devices_stats([device_uuid], ['quartiles'], reading_type, start_date, end_date)[device_uuid]['quartiles']
+
+    from sensors.stats import sketches
+
+    quartile_1, quartile_3 = sketches.device_quantiles(get_db(), device_uuid, [0.25, 0.75], sketch_compression(),
+                                                       reading_type, start_date, end_date)
+    return {'quartile_1': quartile_1, 'quartile_3': quartile_3}
+
+
+def device_quartiles_by_type(device_uuid, start_date=None, end_date=None, exact=False):
+    """
+        The quartiles of each type of the device readings, keyed by type, estimated the same way
+    """
+    if exact or (start_date is None and end_date is None):
+        return device_stats_by_type(device_uuid, 'quartiles', start_date, end_date)
+    from sensors.stats import sketches
+
+    quantiles = sketches.device_quantiles(get_db(), device_uuid, [0.25, 0.75], sketch_compression(),
+                                          start_date=start_date, end_date=end_date, by_type=True)
+    return {reading_type: {'quartile_1': quartile_1, 'quartile_3': quartile_3}
+            for reading_type, (quartile_1, quartile_3) in quantiles.items()}
+
+
+def sketch_compression():
+    from sensors.stats import sketches
+
+    return sketches.compression(current_app.config['QUANTILE_SKETCH_ERROR'])
+
+
+def device_stats_by_type(device_uuid, statistic, start_date=None, end_date=None):
+    """
+        The statistic of each type of the device readings (created within the given dates), keyed by type
+    """
+    types = devices_stats([device_uuid], [statistic], start_date=start_date, end_date=end_date,
+                          by_type=True)[device_uuid]
+    return {reading_type: results[statistic] for reading_type, results in types.items()}
+
+
+def summary_stats(summary, rows, statistics):
+    """
+        The requested statistics of a summary, shaped as the responses of the single device endpoints,
+        the max and median readings picked from the given rows (ordered by id)
+    """
+    results = {}
+    if 'max' in statistics:
+        # The last written of the readings holding the max value
+        results['max'] = [pagination.reading_to_dict(row) for row in rows
+                          if row[2] == summary['max_reading_value']][-1:]
+    if 'median' in statistics:
+        results['median'] = [pagination.reading_to_dict(row) for row in rows
+                             if row[2] == summary['median_reading_value']]
+    if 'mean' in statistics:
+        results['mean'] = {'value': summary['mean_reading_value']}
+    if 'quartiles' in statistics:
+        results['quartiles'] = {'quartile_1': summary['quartile_1_value'],
+                                'quartile_3': summary['quartile_3_value']}
+    return results
+
+
+def devices_stats(device_uuids, statistics, reading_type=None, start_date=None, end_date=None, by_type=False):
+    """
+        The requested statistics of many devices (or of every type of their readings, keyed by type),
+        each one shaped as the response of its single device endpoint (max and median list no reading
+        for a device without readings). All of them come from one grouped histograms query, plus one query
+        for the readings holding the max and median values.
+    """
+    cur = get_db().cursor()
+    summaries = list(stats.grouped_summaries(cur, reading_type, start_date, end_date, device_uuids=device_uuids,
+                                             by_type=by_type))
+
+    readings = {}
+    wanted = set()
+    for summary in summaries:
+        for statistic in ('max', 'median'):
+            if statistic in statistics:
+                wanted.add((summary['device_uuid'], summary['{}_reading_value'.format(statistic)]))
+    if wanted:
+        rows = stats.readings_with_values(cur, sorted(wanted), reading_type, start_date, end_date)
+        for device_uuid, device_rows in itertools.groupby(rows, key=lambda row: row[0]):
+            readings[device_uuid] = list(device_rows)
+
+    if by_type:
+        results = {device_uuid: {} for device_uuid in device_uuids}
+        for summary in summaries:
+            rows = [row for row in readings.get(summary['device_uuid'], []) if row[1] == summary['type']]
+            results[summary['device_uuid']][summary['type']] = summary_stats(summary, rows, statistics)
+        return results
+
+    summaries = {summary['device_uuid']: summary for summary in summaries}
+    return {device_uuid: summary_stats(summaries.get(device_uuid, stats.summarize_histogram([])),
+                                       readings.get(device_uuid, []), statistics)
+            for device_uuid in device_uuids}
+
+
+def device_rollup(device_uuid, width, reading_type=None, start_date=None, end_date=None):
+    cur = get_db().cursor()
+    store = hotstore.get_store(cur)
+    if store is not None and store.covers(start_date):
+        return store.rollup(device_uuid, width, reading_type, start_date, end_date)
+    return rollups.rollup(cur, device_uuid, width, reading_type, start_date, end_date)
+
+
+def summary(reading_type=None, start_date=None, end_date=None, limit=None, after=None, by_type=False):
+    """
+        The per device (or per device and type) summaries, streamed ordered by device UUID (and type),
+        and the cursor of the next page of devices
+    """
+    cur = get_db().cursor()
+    next_cursor = None
+    last_device = None
+
+    if limit is not None:
+        devices = stats.summary_devices_page(cur, limit, after, reading_type, start_date, end_date)
+        if not devices:
+            return iter([]), None
+        last_device = devices[-1]
+        if len(devices) == limit:
+            next_cursor = last_device
+
+    return stats.grouped_summaries(cur, reading_type, start_date, end_date, after, last_device,
+                                   by_type=by_type), next_cursor
+
+
+def export_readings(export_format, device_uuid=None, reading_type=None, start_date=None, end_date=None,
+                    chunk_size=export.CHUNK_SIZE, report=None):
+    """
+        The chunks (str, bytes for the columnar format) of the export of the matching readings,
+        encoded while they are fetched so the memory used does not depend on the number of readings
+    """
+    chunks = export.fetch_chunks(get_db().cursor(), device_uuid, reading_type, start_date, end_date, chunk_size,
+                                 report)
+    return export.ENCODERS[export_format](chunks)
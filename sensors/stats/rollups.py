@@ -0,0 +1,86 @@
+from sensors.database import queries
+from sensors.partitions import partitions
+from sensors.stats.stats import exact_mean
+
+__author__ = 'vgarcia'
+
+BUCKET_WIDTHS = {'minute': 60, 'hour': 3600, 'day': 86400}
+# Widest bucket accepted (a leap year), larger widths would overflow the 64-bit bucket arithmetic
+MAX_BUCKET_WIDTH = 366 * 86400
+
+# Widths pre-aggregated in the readings_rollup table, coarsest first
+ROLLUP_WIDTHS = [86400, 3600]
+
+
+def bucket_width(bucket):
+    """
+        Width in seconds of a bucket given by name (minute, hour, day) or as seconds (up to MAX_BUCKET_WIDTH),
+        None when not valid
+    """
+    if bucket in BUCKET_WIDTHS:
+        return BUCKET_WIDTHS[bucket]
+    try:
+        width = int(bucket)
+    except (TypeError, ValueError):
+        return None
+    return width if 0 < width <= MAX_BUCKET_WIDTH else None
+
+
+def rollup_width(width, start_date=None, end_date=None):
+    """
+        The pre-aggregated width able to answer exactly buckets of the given width over the given range, if any
+    """
+    for rollup in ROLLUP_WIDTHS:
+        if width % rollup:
+            continue
+        if start_date is not None and start_date % rollup:
+            continue
+        if end_date is not None and (end_date + 1) % rollup:
+            continue
+        return rollup
+    return None
+
+
+def rollup(cur, device_uuid, width, reading_type=None, start_date=None, end_date=None):
+    """
+        Count, min, max and mean of the device readings per bucket of "width" seconds,
+        read from the hourly/daily rollups when they cover the request and from the raw readings otherwise
+    """
+    conditions = ['1']
+    params = []
+    pre_aggregated = rollup_width(width, start_date, end_date)
+    time_column = 'bucket' if pre_aggregated else 'date_created'
+
+    if reading_type is not None:
+        conditions.append('type=?')
+        params.append(reading_type)
+    if start_date is not None:
+        conditions.append('{}>=?'.format(time_column))
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append('{}<=?'.format(time_column))
+        params.append(end_date)
+
+    if pre_aggregated:
+        cur.execute(queries.SELECT_ROLLUP_BUCKETS.format(' and '.join(conditions)),
+                    [width, width, pre_aggregated, device_uuid] + params)
+    else:
+        query, tables = partitions.route_each(cur, queries.SELECT_RAW_BUCKETS, queries.MERGE_RAW_BUCKETS, start_date,
+                                              end_date, ' and '.join(conditions))
+        cur.execute(query, ([width, width, device_uuid] + params) * tables)
+
+    return [{'bucket': bucket, 'count': count, 'min': minimum, 'max': maximum, 'mean': exact_mean(total, count)}
+            for bucket, count, total, minimum, maximum in cur.fetchall()]
+
+
+def rebuild_rollups(conn):
+    """
+        Recomputes the hourly and daily rollups from the raw readings (e.g. after a backfill), keeping
+        the ones of the retired partitions
+    """
+    start_date = partitions.retired_until(conn)
+    if start_date is None:
+        start_date = partitions.MIN_DATE
+    with conn:
+        for statement in queries.REBUILD_ROLLUPS:
+            conn.execute(partitions.route(conn, statement, start_date), (start_date,))
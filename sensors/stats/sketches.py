@@ -0,0 +1,229 @@
+import itertools
+import json
+import math
+import time
+
+import numpy as np
+
+from sensors.database import queries
+from sensors.partitions import partitions
+from sensors.stats.stats import summary_filters
+
+__author__ = 'vgarcia'
+
+# Readings of a device and type are sketched per hour, the sketches of a window are merged
+SKETCH_WIDTH = 3600
+
+# Default rank error of the quantiles estimated from the sketches (0.01 = within 1% of the readings)
+SKETCH_ERROR = 0.01
+
+# Hours of a device sketched and stored per write transaction by store_sketches
+SKETCH_BATCH = 500
+
+
+def compression(error=SKETCH_ERROR):
+    """
+        The t-digest compression keeping the centroids around the median within "error" of the readings
+        (they are narrower towards the tails), so that is the rank error of the estimated quantiles
+    """
+    return int(math.ceil(math.pi / (2 * error)))
+
+
+class TDigest(object):
+    """
+        Merging t-digest: the sorted readings grouped into centroids (mean and weight) that are small at
+        the tails and wider around the median, at most "compression" of them whatever the number of readings.
+        Digests are merged by compressing their centroids together, so a window is answered by merging
+        the digests of its hours. Quantiles are interpolated between the centroids the same way as
+        numpy.quantile does between the readings, which makes them exact while every centroid holds equal readings.
+    """
+
+    def __init__(self, means, weights, minimum, maximum):
+        self.means = means
+        self.weights = weights
+        self.minimum = minimum
+        self.maximum = maximum
+
+    @property
+    def count(self):
+        return int(self.weights.sum())
+
+    @classmethod
+    def from_values(cls, values, compression):
+        # Equal readings are merged right away, losing nothing
+        values, counts = np.unique(np.asarray(values, dtype=np.float64), return_counts=True)
+        if not len(values):
+            return cls.empty()
+        return cls.compress(values, counts.astype(np.float64), values[0], values[-1], compression)
+
+    @classmethod
+    def merge(cls, digests, compression):
+        digests = [digest for digest in digests if len(digest.means)]
+        if not digests:
+            return cls.empty()
+        means = np.concatenate([digest.means for digest in digests])
+        weights = np.concatenate([digest.weights for digest in digests])
+        order = np.argsort(means, kind='stable')
+        return cls.compress(means[order], weights[order], min(digest.minimum for digest in digests),
+                            max(digest.maximum for digest in digests), compression)
+
+    @classmethod
+    def compress(cls, means, weights, minimum, maximum, compression):
+        """
+            Merges the sorted centroids sharing the same unit of the k1 scale function,
+            k(q) = compression * (asin(2q - 1) / pi + 1/2), q being the rank of their middle
+        """
+        total = weights.sum()
+        ranks = (np.cumsum(weights) - weights / 2) / total
+        units = np.floor(compression * (np.arcsin(2 * ranks - 1) / np.pi + 0.5))
+        starts = np.flatnonzero(np.concatenate(([True], units[1:] != units[:-1])))
+        merged_weights = np.add.reduceat(weights, starts)
+        merged_means = np.add.reduceat(means * weights, starts) / merged_weights
+        # Rounding must not push a mean out of the readings bounds
+        return cls(np.clip(merged_means, minimum, maximum), merged_weights, float(minimum), float(maximum))
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros(0), np.zeros(0), None, None)
+
+    def quantile(self, q):
+        """
+            The estimated q-th quantile (linear interpolation, as numpy.quantile) of the readings, None without any
+        """
+        if not len(self.means):
+            return None
+        # Every centroid spans the positions (0 based, within the sorted readings) of its readings, the quantiles
+        # between two centroids are interpolated between the last reading of the first and the first of the other,
+        # so equal readings merged in a centroid keep their exact quantiles
+        ends = np.cumsum(self.weights) - 1
+        positions = np.column_stack((ends - self.weights + 1, ends)).ravel()
+        values = np.repeat(self.means, 2)
+        values[0], values[-1] = self.minimum, self.maximum
+        return float(np.interp(q * ends[-1], positions, values))
+
+    def to_bytes(self):
+        if not len(self.means):
+            return b''
+        return np.concatenate(([self.minimum, self.maximum], self.means, self.weights)).astype('<f8').tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        if not data:
+            return cls.empty()
+        array = np.frombuffer(data, dtype='<f8')
+        size = (len(array) - 2) // 2
+        return cls(array[2:2 + size], array[2 + size:], float(array[0]), float(array[1]))
+
+
+def window_hours(start_date=None, end_date=None):
+    """
+        The range [first, last) of the whole hours within [start_date, end_date]
+    """
+    first = partitions.MIN_DATE if start_date is None else -(-start_date // SKETCH_WIDTH) * SKETCH_WIDTH
+    last = partitions.MAX_DATE if end_date is None else (end_date + 1) // SKETCH_WIDTH * SKETCH_WIDTH
+    return first, last
+
+
+def window_edges(start_date=None, end_date=None):
+    """
+        The ranges of the partial hours at both ends of [start_date, end_date], read from the raw readings
+    """
+    first, last = window_hours(start_date, end_date)
+    if first >= last:
+        # No whole hour within the window
+        return [(start_date, end_date)]
+    edges = []
+    if start_date is not None and start_date < first:
+        edges.append((start_date, first - 1))
+    if end_date is not None and last <= end_date:
+        edges.append((last, end_date))
+    return edges
+
+
+def sketch_hours(conn, device_uuid, hours, compression):
+    """
+        Sketches the readings of the given [(type, bucket), ...] hours of the device from the raw readings,
+        keyed by (type, bucket). Nothing is stored, this only reads.
+    """
+    buckets = sorted({bucket for _, bucket in hours})
+    types = sorted({reading_type for reading_type, _ in hours})
+    start_date, end_date = buckets[0], buckets[-1] + SKETCH_WIDTH - 1
+
+    cur = conn.cursor()
+    query, tables = partitions.route_each(cur, queries.SELECT_SKETCH_READINGS, queries.MERGE_SKETCH_READINGS,
+                                          start_date, end_date, '+reading.type in (select value from json_each(?))')
+    cur.execute(query, [json.dumps(buckets), device_uuid, json.dumps(types)] * tables)
+    values = {key: [row[2] for row in rows] for key, rows in itertools.groupby(cur, key=lambda row: tuple(row[:2]))}
+    # The hours of compacted partitions have rollups but no readings left, their sketch is empty
+    return {key: TDigest.from_values(values.get(key, []), compression) for key in hours}
+
+
+def store_sketches(conn, compression, now=None, batch_size=SKETCH_BATCH, progress=None):
+    """
+        Sketches and stores the complete hours (before the current one) of every device without a sketch
+        of the given compression, batch_size hours of a device per write transaction so the app keeps writing
+        meanwhile. The readings are read within the transaction, so a stored sketch is never missing one;
+        progress(stored) is called after every transaction. Returns the number of sketches stored.
+    """
+    now = time.time() if now is None else now
+    before = int(now) // SKETCH_WIDTH * SKETCH_WIDTH
+    hours = conn.execute(queries.SELECT_UNSKETCHED_HOURS, (compression, SKETCH_WIDTH, before)).fetchall()
+
+    stored = 0
+    for device_uuid, rows in itertools.groupby(hours, key=lambda row: row[0]):
+        rows = [(row[1], row[2]) for row in rows]
+        for start in range(0, len(rows), batch_size):
+            with partitions.write_transaction(conn):
+                for (reading_type, bucket), sketch in sketch_hours(conn, device_uuid, rows[start:start + batch_size],
+                                                                   compression).items():
+                    conn.execute(queries.UPSERT_SKETCH,
+                                 (device_uuid, reading_type, bucket, compression, sketch.to_bytes()))
+            stored += len(rows[start:start + batch_size])
+            if progress is not None:
+                progress(stored)
+    return stored
+
+
+def device_quantiles(conn, device_uuid, quantiles, compression, reading_type=None, start_date=None, end_date=None,
+                     by_type=False):
+    """
+        The estimated quantiles of the device readings (of the given type only) created within [start_date, end_date],
+        or of each type of readings keyed by type, merging the sketches of the whole hours of the window with
+        the readings of its partial hours. The hours without a stored sketch (the current hour, the ones written
+        since store_sketches last ran) are sketched in memory, reads never write.
+    """
+    first, last = window_hours(start_date, end_date)
+    cur = conn.cursor()
+    digests = {}
+    missing = []
+    conditions = ['rollup.bucket>=?', 'rollup.bucket<?']
+    params = [first, last]
+    if reading_type is not None:
+        conditions.append('rollup.type=?')
+        params.append(reading_type)
+    cur.execute(queries.SELECT_WINDOW_SKETCHES.format(' and '.join(conditions)),
+                [compression, SKETCH_WIDTH, device_uuid] + params)
+    for row_type, bucket, data in cur.fetchall():
+        if data is None:
+            missing.append((row_type, bucket))
+        else:
+            digests.setdefault(row_type, []).append(TDigest.from_bytes(data))
+    if missing:
+        for (row_type, _), sketch in sketch_hours(conn, device_uuid, missing, compression).items():
+            digests.setdefault(row_type, []).append(sketch)
+
+    for edge_start, edge_end in window_edges(start_date, end_date):
+        edge_conditions, edge_params = summary_filters(reading_type, edge_start, edge_end)
+        query, tables = partitions.route_each(cur, queries.SELECT_DEVICE_TYPE_VALUES,
+                                              queries.MERGE_DEVICE_TYPE_VALUES, edge_start, edge_end,
+                                              ' and '.join(edge_conditions))
+        cur.execute(query, ([device_uuid] + edge_params) * tables)
+        for row_type, rows in itertools.groupby(cur.fetchall(), key=lambda row: row[0]):
+            digests.setdefault(row_type, []).append(TDigest.from_values([row[1] for row in rows], compression))
+
+    if by_type:
+        merged = {row_type: TDigest.merge(type_digests, compression) for row_type, type_digests in digests.items()}
+        return {row_type: [digest.quantile(q) for q in quantiles]
+                for row_type, digest in sorted(merged.items()) if digest.count}
+    digest = TDigest.merge(list(itertools.chain.from_iterable(digests.values())), compression)
+    return [digest.quantile(q) for q in quantiles]
@@ -0,0 +1,187 @@
+import itertools
+import json
+import math
+
+from sensors.database import queries
+from sensors.partitions import partitions
+
+__author__ = 'vgarcia'
+
+
+def exact_mean(total, count):
+    """
+        Same result as statistics.mean for integer readings: an int when the division is exact, a float otherwise
+    """
+    if not count:
+        return None
+    if total % count:
+        return total / count
+    return total // count
+
+
+def interpolate(lower, upper, fraction):
+    """
+        Linear interpolation between two sorted values, computed the same way as numpy.quantile
+    """
+    difference = upper - lower
+    if fraction >= 0.5:
+        return float(upper - difference * (1 - fraction))
+    return float(lower + difference * fraction)
+
+
+def histogram_count(histogram):
+    return sum(count for _, count in histogram)
+
+
+def histogram_value_at(histogram, index):
+    """
+        The value at the given position of the sorted readings described by a [(value, count), ...] histogram
+    """
+    seen = 0
+    for value, count in histogram:
+        seen += count
+        if index < seen:
+            return value
+    return None
+
+
+def histogram_quantile(histogram, count, q):
+    """
+        The q-th quantile (same as numpy.quantile with linear interpolation) of a histogram
+    """
+    if not count:
+        return None
+    position = q * (count - 1)
+    lower_index = math.floor(position)
+    lower = histogram_value_at(histogram, lower_index)
+    upper = histogram_value_at(histogram, min(lower_index + 1, count - 1))
+    return interpolate(lower, upper, position - lower_index)
+
+
+def summarize_histogram(histogram):
+    """
+        Count, max, median, mean and 1st/3rd quartiles of a [(value, count), ...] histogram sorted by value
+    """
+    count = histogram_count(histogram)
+    total = sum(value * bucket_count for value, bucket_count in histogram)
+    return {
+        'number_of_readings': count,
+        'max_reading_value': histogram[-1][0] if histogram else None,
+        'median_reading_value': histogram_value_at(histogram, count // 2),
+        'mean_reading_value': exact_mean(total, count),
+        'quartile_1_value': histogram_quantile(histogram, count, 0.25),
+        'quartile_3_value': histogram_quantile(histogram, count, 0.75),
+    }
+
+
+def device_stats(cur, device_uuid, reading_type=None):
+    """
+        Count, sum, min and max of the device readings (of the given type only), from the materialized device_stats
+        table
+    """
+    if reading_type is None:
+        cur.execute(queries.SELECT_DEVICE_STATS, (device_uuid,))
+    else:
+        cur.execute(queries.SELECT_DEVICE_TYPE_STATS, (device_uuid, reading_type))
+    count, total, minimum, maximum = cur.fetchone()
+    return count or 0, total or 0, minimum, maximum
+
+
+def device_histogram(cur, device_uuid, reading_type=None):
+    if reading_type is None:
+        cur.execute(queries.SELECT_DEVICE_HISTOGRAM, (device_uuid,))
+    else:
+        cur.execute(queries.SELECT_DEVICE_TYPE_HISTOGRAM, (device_uuid, reading_type))
+    return [tuple(row) for row in cur.fetchall()]
+
+
+def rebuild_device_stats(conn):
+    """
+        Recomputes the materialized device statistics from the raw readings (e.g. after a backfill)
+    """
+    with conn:
+        for statement in queries.REBUILD_DEVICE_STATS:
+            conn.execute(partitions.route(conn, statement))
+
+
+def summary_filters(reading_type=None, start_date=None, end_date=None, prefix=''):
+    """
+        SQL conditions and parameters shared by the summary queries, on the columns named prefix + column
+    """
+    conditions = ['1']
+    params = []
+    if reading_type is not None:
+        conditions.append(prefix + 'type=?')
+        params.append(reading_type)
+    if start_date is not None:
+        conditions.append(prefix + 'date_created>=?')
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append(prefix + 'date_created<=?')
+        params.append(end_date)
+    return conditions, params
+
+
+def summary_devices_page(cur, limit, after=None, reading_type=None, start_date=None, end_date=None):
+    """
+        The next page of device UUIDs (ordered) having readings that match the filters
+    """
+    conditions, params = summary_filters(reading_type, start_date, end_date)
+    if after is not None:
+        conditions.append('device_uuid>?')
+        params.append(after)
+    query, tables = partitions.route_each(cur, queries.SELECT_SUMMARY_DEVICES_PAGE, queries.MERGE_SUMMARY_DEVICES_PAGE,
+                                          start_date, end_date, ' and '.join(conditions))
+    cur.execute(query, (params + [limit]) * tables + ([limit] if tables > 1 else []))
+    return [row[0] for row in cur.fetchall()]
+
+
+def grouped_summaries(cur, reading_type=None, start_date=None, end_date=None, after=None, last_device=None,
+                      device_uuids=None, by_type=False):
+    """
+        Streams the summary of every device (or of the given devices only), or of every device and type,
+        in a single pass over the (device_uuid[, type], value) histograms, yielding each one as soon as its group
+        is complete. Without date filters the materialized histograms are read instead of grouping the raw readings.
+    """
+    filtered = start_date is not None or end_date is not None
+    conditions, params = summary_filters(reading_type, start_date, end_date)
+    if after is not None:
+        conditions.append('device_uuid>?')
+        params.append(after)
+    if last_device is not None:
+        conditions.append('device_uuid<=?')
+        params.append(last_device)
+    if device_uuids is not None:
+        conditions.append(queries.SELECTED_DEVICES)
+        params.append(json.dumps(device_uuids))
+
+    if filtered:
+        query, tables = partitions.route_each(
+            cur, queries.SELECT_SUMMARY_TYPE_HISTOGRAMS if by_type else queries.SELECT_SUMMARY_HISTOGRAMS,
+            queries.MERGE_SUMMARY_TYPE_HISTOGRAMS if by_type else queries.MERGE_SUMMARY_HISTOGRAMS,
+            start_date, end_date, ' and '.join(conditions))
+        cur.execute(query, params * tables)
+    else:
+        query = queries.SELECT_TYPE_HISTOGRAMS if by_type else queries.SELECT_HISTOGRAMS
+        cur.execute(query.format(' and '.join(conditions)), params)
+
+    for group, rows in itertools.groupby(cur, key=lambda row: row[:-2]):
+        summary = summarize_histogram([(row[-2], row[-1]) for row in rows])
+        summary['device_uuid'] = group[0]
+        if by_type:
+            summary['type'] = group[1]
+        yield summary
+
+
+def readings_with_values(cur, device_values, reading_type=None, start_date=None, end_date=None):
+    """
+        The readings (ordered by device UUID and id) holding any of the given [(device_uuid, value), ...]
+        within the filters, found in a single query
+    """
+    # The unary plus keeps the filters off the indexes, so the (device_uuid, value) one is used
+    conditions, params = summary_filters(reading_type, start_date, end_date, prefix='+reading.')
+    query, tables = partitions.route_each(cur, queries.SELECT_READINGS_WITH_VALUES,
+                                          queries.MERGE_READINGS_WITH_VALUES, start_date, end_date,
+                                          ' and '.join(conditions))
+    cur.execute(query, ([json.dumps(device_values)] + params) * tables)
+    return cur.fetchall()
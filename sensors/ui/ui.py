@@ -0,0 +1,180 @@
+import datetime
+import time
+
+from flask import Blueprint, render_template, request, redirect, url_for
+from flask_bootstrap import Bootstrap
+
+from sensors.database import pagination
+from sensors.forms.forms import SensorForm, CustomSearchForm, ReadingForm
+from sensors.services import services
+from sensors.validators.validators import CUSTOM_SEARCH_ERRORS
+
+__author__ = 'vgarcia'
+
+# The HTML pages, only registered (along with their forms and Bootstrap) when UI_ENABLED is set
+blueprint = Blueprint('ui', __name__)
+
+
+def init_app(app):
+    Bootstrap(app)
+    app.register_blueprint(blueprint)
+
+
+@blueprint.route('/', methods=['GET'])
+def index():
+    """
+        This function returns the sensors registered in the database (UI)
+    """
+    sensors = services.list_devices()
+
+    form = SensorForm()
+    custom_search_form = CustomSearchForm()
+
+    return render_template('index.html', sensors=sensors, form=form, custom_search_form=custom_search_form)
+
+
+@blueprint.route('/readings/<string:device_uuid>/', methods=['POST', 'GET'])
+def ui_request_device_readings(device_uuid):
+    """
+    This function allows clients to POST or GET data specific sensor types (UI)
+
+    POST Parameters:
+    * type -> The type of sensor (temperature or humidity)
+    * value -> The integer value of the sensor reading
+    * date_created -> The epoch date of the sensor reading (default now).
+    """
+
+    form = ReadingForm()
+
+    if request.method == 'POST':
+        is_valid, result = services.add_reading(device_uuid, request.form.get('type'), request.form.get('value'),
+                                                request.form.get('date_created', int(time.time()), type=int))
+        if is_valid:
+            # Return success
+            return redirect(url_for('.ui_request_device_readings', device_uuid=device_uuid))
+        else:
+            return redirect(url_for('.ui_request_device_readings', device_uuid=device_uuid, error=result))
+
+    else:
+        rows, _ = services.device_readings(device_uuid)
+        readings = [pagination.reading_to_dict(row) for row in rows]
+        return render_template('detail.html', sensors=readings, device_uuid=device_uuid, form=form)
+
+
+@blueprint.route('/new/<string:device_uuid>/', methods=['POST'])
+def ui_register_new_sensor(device_uuid):
+    """
+    This function allows clients to POST a new sensor data. (UI)
+
+    POST Parameters:
+    * type -> The type of sensor (temperature or humidity)
+    * value -> The integer value of the sensor reading
+    * date_created -> The epoch date of the sensor reading (default to now).
+    """
+
+    # Grab the post parameters
+    sensor_type = request.form.get('type')
+    value = request.form.get('value')
+    date_created = request.form.get('date_created', int(time.time()), type=int)
+
+    is_valid, result = services.add_reading(device_uuid, sensor_type, value, date_created)
+
+    if is_valid:
+        # Return success
+        return redirect(url_for('.index'))
+    else:
+        return redirect(url_for('.index', error=result))
+
+
+@blueprint.route('/custom/search/', methods=['POST'])
+def ui_get_readings_by_type_or_date_range():
+    """
+    This endpoint allows clients to GET sensors readings by type or date range (UI)
+
+    Optional Query Parameters
+    * type -> The type of sensor value a client is looking for
+    * start -> The epoch start time for a sensor being searched
+    * end -> The epoch end time for a sensor being searched
+    """
+
+    # Grab the post parameters
+    selected_type = request.form.get('available_types')
+
+    if int(selected_type) == 0:
+        type = request.form.get('type')
+        selected_search = 'Sensor Type: ' + type.capitalize()
+        rows, _ = services.readings_by_type(type)
+    elif int(selected_type) == 1:
+        start_date = request.form.get('start_date')
+        end_date = request.form.get('end_date')
+        selected_search = 'Date Range: Start: ' + start_date + ' End: ' + end_date
+        start_date_time_obj = int(datetime.datetime.strptime(start_date, '%d/%m/%Y').timestamp())
+        end_date_time_obj = int(datetime.datetime.strptime(end_date, '%d/%m/%Y').replace(
+            hour=23, minute=59, second=59).timestamp())
+        rows, _ = services.readings_by_date_range(start_date_time_obj, end_date_time_obj)
+    else:
+        return redirect(url_for('.index', custom_search_error=CUSTOM_SEARCH_ERRORS[0]))
+
+    sensors = [pagination.reading_to_dict(row) for row in rows]
+
+    return render_template('search_results.html', sensors=sensors, selected_search=selected_search)
+
+
+@blueprint.route('/readings/<string:device_uuid>/max', methods=['GET'])
+def ui_get_readings_max(device_uuid):
+    """
+    This function allows clients to GET MAX sensor reading
+    """
+
+    form = ReadingForm()
+
+    reading = services.device_max(device_uuid)
+    return render_template('detail.html', sensors=reading, device_uuid=device_uuid, form=form)
+
+
+@blueprint.route('/readings/<string:device_uuid>/median', methods=['GET'])
+def ui_get_readings_median(device_uuid):
+    """
+    This function allows clients to GET MEDIAN sensor reading
+    """
+
+    form = ReadingForm()
+
+    reading = services.device_median(device_uuid)
+    return render_template('detail.html', sensors=reading, device_uuid=device_uuid, form=form)
+
+
+@blueprint.route('/readings/<string:device_uuid>/mean', methods=['GET'])
+def ui_get_readings_mean(device_uuid):
+    """
+    This function allows clients to GET MEAN sensor reading
+    """
+
+    form = ReadingForm()
+
+    reading = services.device_mean(device_uuid)
+    return render_template('detail.html', sensors=reading, device_uuid=device_uuid, form=form)
+
+
+@blueprint.route('/readings/<string:device_uuid>/quartiles', methods=['GET'])
+def ui_get_readings_quartiles(device_uuid):
+    """
+    This function allows clients to GET 1st and 3rd quartiles of sensor readings
+    """
+
+    form = ReadingForm()
+
+    readings = services.device_quartiles(device_uuid)
+    return render_template('detail.html', sensors=readings, device_uuid=device_uuid, form=form)
+
+
+@blueprint.route('/readings/summary', methods=['GET'])
+def ui_get_summary():
+    """
+    This function allows clients GET summary of all sensors readings (with statictics)
+    """
+
+    form = ReadingForm()
+
+    summaries, _ = services.summary()
+    return render_template('detail.html', sensors=list(summaries), device_uuid='Summary', form=form)
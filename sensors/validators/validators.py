@@ -2,8 +2,19 @@ TEMPERATURE = 'temperature'
 HUMIDITY = 'humidity'
 
 READINGS_TYPES = [TEMPERATURE, HUMIDITY]
-READINGS_TYPES_ERRORS = ['NOT_VALID_TYPE', 'READING_OUT_OF_RANGE']
-CUSTOM_SEARCH_ERRORS = ['NOT_VALID_SEARCHING_TYPE']
+READINGS_TYPES_ERRORS = ['NOT_VALID_TYPE', 'READING_OUT_OF_RANGE', 'NOT_VALID_READING']
+CUSTOM_SEARCH_ERRORS = ['NOT_VALID_SEARCHING_TYPE', 'NOT_VALID_DATE_RANGE']
+MIN_READING_VALUE = 0
+MAX_READING_VALUE = 100
+BATCH_ERRORS = ['NOT_VALID_BATCH']
+PAGINATION_ERRORS = ['NOT_VALID_CURSOR', 'NOT_VALID_LIMIT']
+ROLLUP_ERRORS = ['NOT_VALID_BUCKET']
+INGEST_ERRORS = ['INGEST_QUEUE_FULL']
+EXPORT_ERRORS = ['NOT_VALID_FORMAT']
+STATS_ERRORS = ['NOT_VALID_DEVICES', 'NOT_VALID_STATISTIC', 'NOT_VALID_GROUPING']
+STATISTICS = ['max', 'median', 'mean', 'quartiles']
+MAX_STATS_DEVICES = 1000
+STATS_GROUPINGS = ['type']
 
 __author__ = 'vgarcia'
 
@@ -11,14 +22,85 @@ __author__ = 'vgarcia'
 def reading_is_valid(type, value):
     if type not in READINGS_TYPES:
         return False, READINGS_TYPES_ERRORS[0]
-    elif int(value) not in range(0, 101):
+    elif int(value) not in range(MIN_READING_VALUE, MAX_READING_VALUE + 1):
         return False, READINGS_TYPES_ERRORS[1]
     else:
         return True, ''
 
 
+def date_created_is_valid(date_created):
+    """
+        Validates the epoch date of a reading, an integer
+    """
+    if isinstance(date_created, bool) or not isinstance(date_created, int):
+        return False, READINGS_TYPES_ERRORS[2]
+    else:
+        return True, ''
+
+
 def is_valid_type(type):
     if type not in READINGS_TYPES:
         return False, READINGS_TYPES_ERRORS[0]
     else:
         return True, ''
+
+
+def is_valid_grouping(grouping):
+    if grouping is not None and grouping not in STATS_GROUPINGS:
+        return False, STATS_ERRORS[2]
+    else:
+        return True, ''
+
+
+def readings_are_valid(readings):
+    """
+        Validates a whole batch of readings in one pass, returning a (is_valid, result) tuple for each one.
+        The date_created of a reading may be missing, otherwise it must be an integer.
+    """
+    results = []
+    for reading in readings:
+        if not isinstance(reading, dict):
+            results.append((False, READINGS_TYPES_ERRORS[2]))
+            continue
+        try:
+            result = reading_is_valid(reading.get('type'), reading.get('value'))
+        except (TypeError, ValueError):
+            result = (False, READINGS_TYPES_ERRORS[2])
+        if result[0] and 'date_created' in reading:
+            result = date_created_is_valid(reading['date_created'])
+        results.append(result)
+    return results
+
+
+def date_range_is_valid(start_date, end_date):
+    """
+        Validates the epoch bounds of a date range, integers or integer strings (either one may be missing),
+        returning them as integers
+    """
+    dates = []
+    for date in (start_date, end_date):
+        if date is None:
+            dates.append(None)
+            continue
+        if isinstance(date, bool) or not isinstance(date, (int, str)):
+            return False, CUSTOM_SEARCH_ERRORS[1]
+        try:
+            dates.append(int(date))
+        except ValueError:
+            return False, CUSTOM_SEARCH_ERRORS[1]
+    return True, tuple(dates)
+
+
+def stats_request_is_valid(device_uuids, statistics):
+    """
+        Validates the devices (a non empty list of at most MAX_STATS_DEVICES UUIDs) and the statistics
+        of a batched statistics request
+    """
+    if not isinstance(device_uuids, list) or not device_uuids or len(device_uuids) > MAX_STATS_DEVICES or \
+            not all(isinstance(device_uuid, str) for device_uuid in device_uuids):
+        return False, STATS_ERRORS[0]
+    elif not isinstance(statistics, list) or not statistics or \
+            not all(statistic in STATISTICS for statistic in statistics):
+        return False, STATS_ERRORS[1]
+    else:
+        return True, ''
@@ -0,0 +1,12 @@
+from sensors.database.migrations import migrate
+
+
+def reset_db(conn):
+    """
+        Drops every table of the given database and rebuilds the schema from scratch
+    """
+    tables = conn.execute("select name from sqlite_master where type='table' and name not like 'sqlite_%'").fetchall()
+    for (table,) in tables:
+        conn.execute('DROP TABLE IF EXISTS "{}"'.format(table))
+    conn.execute('PRAGMA user_version = 0')
+    migrate(conn)
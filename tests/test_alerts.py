@@ -0,0 +1,120 @@
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import unittest
+
+from app import app
+from sensors.alerts import alerts
+from sensors.binary.binary import BINARY_MIMETYPE, encode_readings
+from tests import reset_db
+
+
+class AlertEngineTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.sink = alerts.QueueAlertSink()
+
+    def test_threshold_rules(self):
+        engine = alerts.AlertEngine([
+            alerts.ThresholdRule('hot', 'temperature', max_value=80),
+            alerts.ThresholdRule('dry', 'humidity', device_uuid='device_1', min_value=20),
+        ], self.sink)
+
+        readings = [('device_1', 'temperature', 81, 1), ('device_2', 'temperature', 80, 2),
+                    ('device_1', 'humidity', 19, 3), ('device_2', 'humidity', 5, 4), ('device_2', 'temperature', 95, 5)]
+        raised = engine.evaluate_many(readings)
+
+        # Then only the readings out of the bounds of the rules of their device and type should raise an alert
+        self.assertEqual([(alert['rule'], alert['device_uuid'], alert['value'], alert['limit']) for alert in raised],
+                         [('hot', 'device_1', 81, 80), ('dry', 'device_1', 19, 20), ('hot', 'device_2', 95, 80)])
+        self.assertEqual(list(self.sink.alerts), raised)
+
+    def test_zscore_rule_matches_python_statistics(self):
+        rule = alerts.ZScoreRule('spike', 'temperature', window=20, threshold=2.0, min_samples=5)
+        engine = alerts.AlertEngine([rule], self.sink)
+        generator = random.Random(7)
+        history = {'device_1': [], 'device_2': []}
+        expected = []
+
+        for number in range(2000):
+            device_uuid = generator.choice(sorted(history))
+            value = generator.randint(40, 60) if generator.random() < 0.95 else generator.choice([0, 100])
+            window = history[device_uuid][-20:]
+            if len(window) >= 5 and statistics.pstdev(window):
+                zscore = (value - statistics.mean(window)) / statistics.pstdev(window)
+                if abs(zscore) > 2.0:
+                    expected.append((device_uuid, number, round(zscore, 3)))
+            history[device_uuid].append(value)
+
+            engine.evaluate(device_uuid, 'temperature', value, number)
+
+        # Then the incremental windows should raise the same alerts as recomputing the statistics of every window
+        self.assertGreater(len(expected), 50)
+        self.assertEqual([(alert['device_uuid'], alert['date_created'], alert['zscore']) for alert in self.sink.alerts],
+                         expected)
+
+    def test_flat_window_raises_nothing(self):
+        engine = alerts.AlertEngine([alerts.ZScoreRule('spike', 'humidity', min_samples=3)], self.sink)
+        self.assertEqual(engine.evaluate_many([('device', 'humidity', 50, number) for number in range(10)]), [])
+
+    def test_rules_file_and_file_sink(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        rules_path = os.path.join(directory, 'rules.json')
+        with open(rules_path, 'w') as stream:
+            json.dump([{'kind': 'threshold', 'name': 'hot', 'type': 'temperature', 'max_value': 80},
+                       {'kind': 'zscore', 'type': 'humidity', 'device_uuid': 'device_1', 'window': 30}], stream)
+
+        rules = alerts.load_rules(rules_path)
+        self.assertEqual([(rule.kind, rule.name, rule.device_uuid) for rule in rules],
+                         [('threshold', 'hot', '*'), ('zscore', 'zscore', 'device_1')])
+        self.assertEqual(rules[1].window, 30)
+
+        sink = alerts.FileAlertSink(os.path.join(directory, 'alerts.ndjson'))
+        alerts.AlertEngine(rules, sink).evaluate('device_1', 'temperature', 90, 1)
+        with open(sink.path) as stream:
+            self.assertEqual([json.loads(line)['rule'] for line in stream], ['hot'])
+
+        # And invalid rules should be refused
+        for spec in ({'kind': 'average', 'type': 'temperature'}, {'kind': 'threshold', 'type': 'pressure'},
+                     {'kind': 'zscore', 'type': 'humidity', 'windows': 3}):
+            with self.assertRaises(ValueError):
+                alerts.rule_from_dict(spec)
+
+
+class AlertRoutesTestCases(unittest.TestCase):
+
+    def setUp(self):
+        reset_db(sqlite3.connect('test_database.db'))
+        app.config['TESTING'] = True
+        self.sink = alerts.QueueAlertSink()
+        alerts.init_app(app, rules=[alerts.ThresholdRule('hot', 'temperature', max_value=80)], sink=self.sink)
+        self.client = app.test_client
+
+    def tearDown(self):
+        alerts.init_app(app)
+
+    def test_accepted_readings_are_evaluated(self):
+        client = self.client()
+        client.post('/devices/device_1/readings/', data=json.dumps({'type': 'temperature', 'value': 90}))
+        client.post('/devices/device_1/readings/', data=json.dumps({'type': 'temperature', 'value': 120}))
+        client.post('/devices/device_2/readings/batch/', data=json.dumps([{'type': 'temperature', 'value': 85},
+                                                                         {'type': 'humidity', 'value': 85},
+                                                                         {'type': 'temperature', 'value': 20}]))
+        client.post('/devices/device_3/readings/batch/', content_type=BINARY_MIMETYPE, data=encode_readings([
+            {'type': 'temperature', 'value': 99, 'date_created': 1000}]))
+
+        # Then an alert should be raised for every accepted reading above the threshold, the rejected ones excluded
+        self.assertEqual([(alert['device_uuid'], alert['value']) for alert in self.sink.alerts],
+                         [('device_1', 90), ('device_2', 85), ('device_3', 99)])
+
+        # And they should be counted in the metrics
+        self.assertIn('alerts_raised_total{kind="threshold"}', self.client().get('/metrics').get_data(as_text=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import sqlite3
+import unittest
+
+from app import app
+import asgi
+from asgi import application
+from tests import reset_db
+
+
+def call(method, path, query_string=b'', body=b'', headers=None):
+    """
+        Sends a request to the ASGI application, returning its status, headers and body
+    """
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': query_string,
+        'headers': headers or [],
+        'http_version': '1.1',
+        'scheme': 'http',
+        'server': ('testserver', 80),
+        'client': ('127.0.0.1', 5000),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(application(scope, receive, send))
+
+    start = sent[0]
+    return start['status'], dict(start['headers']), b''.join(message.get('body', b'') for message in sent[1:])
+
+
+class AsgiTestCases(unittest.TestCase):
+
+    def setUp(self):
+        conn = sqlite3.connect('test_database.db')
+        reset_db(conn)
+        conn.executemany('insert into readings (device_uuid,type,value,date_created) VALUES (?,?,?,?)', [
+            ('test_device', 'temperature', 22, 1),
+            ('test_device', 'temperature', 50, 2),
+            ('test_device', 'humidity', 63, 3),
+        ])
+        conn.commit()
+        conn.close()
+
+        app.config['TESTING'] = True
+        app.extensions['response_cache'].clear()
+        app.extensions.pop('hot_store', None)
+
+    def test_same_responses_as_the_wsgi_app(self):
+        client = app.test_client()
+
+        for path, query_string in [('/devices/test_device/readings/mean/', b''),
+                                   ('/devices/test_device/readings/quartiles/', b''),
+                                   ('/devices/test_device/readings/', b'limit=2'),
+                                   ('/summary/', b'')]:
+            status, headers, body = call('GET', path, query_string)
+            expected = client.get(path, query_string=query_string.decode())
+            self.assertEqual(status, 200)
+            self.assertEqual(json.loads(body), expected.json)
+            self.assertEqual(headers.get(b'x-next-cursor'), expected.headers.get('X-Next-Cursor', '').encode() or None)
+
+    def test_post_reading(self):
+        status, _, body = call('POST', '/devices/test_device/readings/',
+                               body=json.dumps({'type': 'humidity', 'value': 10}).encode(),
+                               headers=[(b'content-type', b'application/json')])
+        self.assertEqual(status, 201)
+
+        status, _, body = call('GET', '/devices/test_device/readings/')
+        self.assertEqual(len(json.loads(body)), 4)
+
+    def test_large_bodies_are_refused(self):
+        max_content_length = app.config['MAX_CONTENT_LENGTH']
+        app.config['MAX_CONTENT_LENGTH'] = 10
+        try:
+            body = json.dumps({'type': 'humidity', 'value': 10}).encode()
+            status, _, _ = call('POST', '/devices/test_device/readings/', body=body,
+                                headers=[(b'content-type', b'application/json'),
+                                         (b'content-length', str(len(body)).encode())])
+        finally:
+            app.config['MAX_CONTENT_LENGTH'] = max_content_length
+
+        self.assertEqual(status, 413)
+
+    def test_streamed_response(self):
+        # Given a chunk size small enough for every reading to be sent on its own
+        chunk_bytes, asgi.CHUNK_BYTES = asgi.CHUNK_BYTES, 1
+        try:
+            status, headers, body = call('GET', '/devices/test_device/readings/', b'format=ndjson')
+        finally:
+            asgi.CHUNK_BYTES = chunk_bytes
+
+        self.assertEqual(status, 200)
+        self.assertEqual([json.loads(line)['value'] for line in body.decode().splitlines()], [22, 50, 63])
@@ -0,0 +1,20 @@
+import unittest
+
+from benchmarks.common import describe, regressions
+
+
+class RegressionsTestCases(unittest.TestCase):
+
+    def test_only_routes_slower_than_the_tolerance_regress(self):
+        baseline = {'max': {'p50_ms': 1.0}, 'mean': {'p50_ms': 2.0}, 'removed': {'p50_ms': 1.0}}
+        results = {'max': {'p50_ms': 1.2}, 'mean': {'p50_ms': 3.0}, 'added': {'p50_ms': 100.0}}
+
+        self.assertEqual(regressions(results, baseline, tolerance=0.25), [('mean', 2.0, 3.0)])
+        self.assertEqual(regressions(results, baseline, tolerance=0.1), [('max', 1.0, 1.2), ('mean', 2.0, 3.0)])
+
+    def test_describe(self):
+        stats = describe([0.001 * latency for latency in range(1, 101)])
+
+        self.assertEqual(stats['requests'], 100)
+        self.assertAlmostEqual(stats['p50_ms'], 51)
+        self.assertAlmostEqual(stats['p99_ms'], 99)
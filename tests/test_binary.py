@@ -0,0 +1,50 @@
+import random
+import unittest
+
+import numpy as np
+
+from sensors.binary import binary
+
+
+class BinaryReadingsTestCases(unittest.TestCase):
+
+    def random_readings(self, generator, count):
+        base = generator.randint(0, 2 ** 40)
+        return [{'type': generator.choice(['temperature', 'humidity']), 'value': generator.randint(0, 100),
+                 'date_created': base + generator.randint(0, 2 ** 32 - 1)} for _ in range(count)]
+
+    def test_round_trip(self):
+        generator = random.Random(3)
+        for count in [0, 1, 2, 50, 1000]:
+            readings = self.random_readings(generator, count)
+            data = binary.encode_readings(readings)
+            types, values, dates = binary.decode_readings(data)
+
+            self.assertEqual(len(data), binary.HEADER.size + 6 * count)
+            self.assertEqual([{'type': ['temperature', 'humidity'][reading_type], 'value': value, 'date_created': date}
+                              for reading_type, value, date in zip(types.tolist(), values.tolist(), dates.tolist())],
+                             readings)
+
+    def test_decoding_does_not_copy(self):
+        data = bytearray(binary.encode_readings([{'type': 'humidity', 'value': 10, 'date_created': 5}]))
+        _, values, _ = binary.decode_readings(data)
+
+        data[-1] = 20
+        self.assertEqual(values[0], 20)
+
+    def test_not_valid_batches(self):
+        data = binary.encode_readings([{'type': 'humidity', 'value': 10, 'date_created': 5}] * 3)
+
+        for not_valid in [b'', data[:10], data[:-1], data + b'\x00', b'XX' + data[2:], data[:2] + b'\x09' + data[3:]]:
+            with self.assertRaises(ValueError):
+                binary.decode_readings(not_valid)
+
+        with self.assertRaises(ValueError):
+            binary.encode_readings([{'type': 'humidity', 'value': 10, 'date_created': date} for date in [0, 2 ** 32]])
+
+    def test_validation(self):
+        types = np.array([0, 1, 2, 1, 7], dtype=np.uint8)
+        values = np.array([0, 100, 50, 101, 255], dtype=np.uint8)
+
+        self.assertEqual(binary.validate_readings(types, values).tolist(),
+                         ['', '', 'NOT_VALID_TYPE', 'READING_OUT_OF_RANGE', 'NOT_VALID_TYPE'])
@@ -0,0 +1,94 @@
+import unittest
+
+from sensors.cache.cache import ALL_DEVICES, LocalCacheBackend, ResponseCache
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class LocalCacheBackendTestCases(unittest.TestCase):
+
+    def test_least_recently_used_entries_are_evicted(self):
+        backend = LocalCacheBackend(max_entries=2, ttl=None)
+        backend.set('a', 1)
+        backend.set('b', 2)
+
+        # Given "a" read more recently than "b"
+        self.assertEqual(backend.get('a'), 1)
+        backend.set('c', 3)
+
+        # Then "b" should be the one evicted
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.get('a'), 1)
+        self.assertEqual(len(backend), 2)
+
+    def test_entries_are_bounded_by_size(self):
+        backend = LocalCacheBackend(max_entries=10, ttl=None, max_bytes=10)
+        backend.set('a', 'xxxx')
+        backend.set('b', 'xxxx')
+
+        # Given a third entry going over the size bound, then the least recently used one should be evicted
+        backend.set('c', 'xxxx')
+        self.assertIsNone(backend.get('a'))
+        self.assertEqual(backend.size, 10)
+
+        # And an entry larger than the whole bound should not be kept, nor evict the others
+        backend.set('d', 'x' * 20)
+        self.assertIsNone(backend.get('d'))
+        self.assertEqual((backend.get('b'), backend.get('c')), ('xxxx', 'xxxx'))
+
+        backend.delete('b')
+        self.assertEqual(backend.size, 5)
+
+    def test_entries_expire(self):
+        clock = FakeClock()
+        backend = LocalCacheBackend(max_entries=10, ttl=60, clock=clock)
+        backend.set('a', 1)
+
+        clock.now = 59
+        self.assertEqual(backend.get('a'), 1)
+        clock.now = 60
+        self.assertIsNone(backend.get('a'))
+
+
+class ResponseCacheTestCases(unittest.TestCase):
+
+    def test_invalidate_device(self):
+        cache = ResponseCache(LocalCacheBackend())
+        cache.set(cache.key('max', 'device'), 'device max')
+        cache.set(cache.key('max', 'other'), 'other max')
+        cache.set(cache.key('summary', ALL_DEVICES), 'summary')
+
+        cache.invalidate_device('device')
+
+        # Then the device and the all devices entries should be gone, but not the other devices ones
+        self.assertIsNone(cache.get(cache.key('max', 'device')))
+        self.assertIsNone(cache.get(cache.key('summary', ALL_DEVICES)))
+        self.assertEqual(cache.get(cache.key('max', 'other')), 'other max')
+
+    def test_workers_sharing_a_backend_see_the_same_invalidations(self):
+        # Given two workers using the same (shared) backend
+        backend = LocalCacheBackend()
+        worker_1 = ResponseCache(backend)
+        worker_2 = ResponseCache(backend)
+        worker_1.set(worker_1.key('mean', 'device'), 'mean')
+        self.assertEqual(worker_2.get(worker_2.key('mean', 'device')), 'mean')
+
+        # Then an insert seen by one of them should invalidate the other
+        worker_2.invalidate_device('device')
+        self.assertIsNone(worker_1.get(worker_1.key('mean', 'device')))
+
+    def test_evicted_generation_never_serves_stale_entries(self):
+        backend = LocalCacheBackend()
+        cache = ResponseCache(backend)
+        cache.set(cache.key('max', 'device'), 'stale')
+
+        backend.delete(('generation', 'device'))
+
+        self.assertIsNone(cache.get(cache.key('max', 'device')))
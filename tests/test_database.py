@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from sensors.database import queries
+from sensors.database import database
+from sensors.database.database import ConnectionPool, PoolTimeoutError, get_pool
+from sensors.database.migrations import SCHEMA_VERSION, migrate, schema_version
+from sensors.partitions import partitions
+
+
+class ConnectionPoolTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.pool = ConnectionPool(os.path.join(self.directory.name, 'pool.db'), size=2, timeout=0.1)
+
+    def tearDown(self):
+        self.pool.close()
+        self.directory.cleanup()
+
+    def test_connections_are_reused(self):
+        # Given a connection returned to the pool
+        conn = self.pool.checkout()
+        self.pool.checkin(conn)
+
+        # Then the next checkout should reuse it, already in WAL mode
+        self.assertIs(self.pool.checkout(), conn)
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+    def test_pool_is_bounded(self):
+        # Given every connection of the pool checked out
+        self.pool.checkout()
+        self.pool.checkout()
+
+        # Then a new checkout should time out instead of opening a third connection
+        with self.assertRaises(PoolTimeoutError):
+            self.pool.checkout()
+
+    def test_checkin_rolls_back_open_transactions(self):
+        conn = self.pool.checkout()
+        conn.execute('CREATE TABLE readings (value INTEGER)')
+        conn.commit()
+        conn.execute('INSERT INTO readings VALUES (1)')
+
+        self.pool.checkin(conn)
+
+        self.assertEqual(self.pool.checkout().execute('SELECT count(*) FROM readings').fetchone()[0], 0)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs os.fork')
+    def test_forked_children_open_their_own_connections(self):
+        # Given a pool with a connection opened before a fork (as in a preloaded gunicorn master)
+        path = os.path.join(self.directory.name, 'forked.db')
+        pool = get_pool(path)
+        pool.checkin(pool.checkout())
+
+        pid = os.fork()
+        if not pid:
+            # Then the child should get a new pool, opening its own connection
+            child_pool = get_pool(path)
+            conn = child_pool.checkout()
+            os._exit(0 if child_pool is not pool and conn.execute('SELECT 1').fetchone()[0] == 1 else 1)
+
+        _, status = os.waitpid(pid, 0)
+        self.assertTrue(os.WIFEXITED(status))
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+        # And the parent should keep its pool
+        self.assertIs(get_pool(path), pool)
+        database._pools.pop(path).close()
+
+
+class QueryPlanTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        migrate(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def assertUsesIndex(self, query, params):
+        plan = ' '.join(row[3] for row in self.conn.execute('EXPLAIN QUERY PLAN ' + query, params))
+        self.assertNotRegex(plan, r'SCAN readings(?! USING)', msg='{} -> {}'.format(query, plan))
+        self.assertRegex(plan, 'INDEX|PRIMARY KEY', msg='{} -> {}'.format(query, plan))
+
+    def test_readings_pages_are_read_in_index_order(self):
+        keyset = '(date_created, id) > (?, ?)'
+        pages = [
+            (queries.SELECT_DEVICE_READINGS, ('device',)),
+            (queries.SELECT_READINGS_BY_TYPE, ('temperature',)),
+            (queries.SELECT_READINGS_BY_DATE_RANGE, (0, 100)),
+        ]
+        for query, params in pages:
+            for condition, cursor in (('1', ()), (keyset, (10, 1))):
+                page = partitions.route(self.conn, query).format(condition) + ' limit ?'
+                self.assertUsesIndex(page, params + cursor + (10,))
+                # And the rows should come in (date_created, id) order straight from the index
+                plan = ' '.join(row[3] for row in self.conn.execute('EXPLAIN QUERY PLAN ' + page,
+                                                                       params + cursor + (10,)))
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_migrations_are_versioned(self):
+        # Given a migrated database, running the migrations again should be a no-op
+        self.assertEqual(schema_version(self.conn), SCHEMA_VERSION)
+        self.assertEqual(migrate(self.conn), SCHEMA_VERSION)
+
+    def test_endpoints_queries_use_indexes(self):
+        self.assertUsesIndex(partitions.route(self.conn, queries.SELECT_DEVICES), ())
+        self.assertUsesIndex(partitions.route(self.conn, queries.SELECT_SUMMARY_DEVICES_PAGE).format('device_uuid>?'),
+                             ('device', 10))
+        self.assertUsesIndex(partitions.route(self.conn, queries.SELECT_SUMMARY_HISTOGRAMS).format('1'), ())
+        self.assertUsesIndex(partitions.route(self.conn, queries.SELECT_SUMMARY_TYPE_HISTOGRAMS).format('1'), ())
+        self.assertUsesIndex(partitions.route(self.conn, queries.SELECT_DEVICE_READINGS_WITH_VALUE).format('+type=?'),
+                             ('device', 50, 'humidity'))
+        self.assertUsesIndex(queries.SELECT_DEVICE_STATS, ('device',))
+        self.assertUsesIndex(queries.SELECT_DEVICE_HISTOGRAM, ('device',))
+        self.assertUsesIndex(queries.SELECT_HISTOGRAMS.format('device_uuid>?'), ('device',))
+        self.assertUsesIndex(queries.SELECT_DEVICE_TYPE_STATS, ('device', 'humidity'))
+        self.assertUsesIndex(queries.SELECT_DEVICE_TYPE_HISTOGRAM, ('device', 'humidity'))
+        self.assertUsesIndex(queries.SELECT_TYPE_HISTOGRAMS.format('device_uuid>?'), ('device',))
+
+    def test_max_is_read_backwards_from_the_index(self):
+        for condition, params in (('1', ('device',)), ('+type=?', ('device', 'humidity'))):
+            query = partitions.route(self.conn, queries.SELECT_DEVICE_MAX).format(condition)
+            self.assertUsesIndex(query, params)
+            plan = ' '.join(row[3] for row in self.conn.execute('EXPLAIN QUERY PLAN ' + query, params))
+            self.assertIn('readings_device_value_idx', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
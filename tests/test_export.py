@@ -0,0 +1,70 @@
+import csv
+import io
+import json
+import random
+import sqlite3
+import unittest
+
+from sensors.database import queries
+from sensors.database.migrations import migrate
+from sensors.export import export
+
+
+class ExportTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        migrate(self.conn)
+        generator = random.Random(17)
+        self.conn.executemany(queries.INSERT_READING, [
+            ('device_{}'.format(generator.randrange(4)), generator.choice(['temperature', 'humidity']),
+             generator.randint(0, 100), generator.randrange(10 ** 6))
+            for _ in range(1000)
+        ])
+        self.rows = self.conn.execute('select device_uuid, type, value, date_created from readings '
+                                      'order by date_created, id').fetchall()
+
+    def export(self, export_format, **filters):
+        return export.ENCODERS[export_format](export.fetch_chunks(self.conn.cursor(), chunk_size=64, **filters))
+
+    def test_chunks(self):
+        report = {}
+        chunks = list(export.fetch_chunks(self.conn.cursor(), chunk_size=64, report=report))
+
+        self.assertTrue(all(len(chunk) <= 64 for chunk in chunks))
+        self.assertEqual([row for chunk in chunks for row in chunk], self.rows)
+        self.assertEqual(report['readings'], 1000)
+
+    def test_csv(self):
+        lines = list(csv.reader(io.StringIO(''.join(self.export('csv')))))
+
+        self.assertEqual(lines[0], ['device_uuid', 'type', 'value', 'date_created'])
+        self.assertEqual([(device_uuid, reading_type, int(value), int(date_created))
+                          for device_uuid, reading_type, value, date_created in lines[1:]], self.rows)
+
+    def test_ndjson_with_filters(self):
+        readings = [json.loads(line) for line in ''.join(self.export(
+            'ndjson', device_uuid='device_1', reading_type='humidity', start_date=1000, end_date=500000)).splitlines()]
+
+        self.assertEqual(readings, [dict(zip(queries.READING_COLUMNS, row)) for row in self.rows
+                                    if row[0] == 'device_1' and row[1] == 'humidity' and 1000 <= row[3] <= 500000])
+
+    def test_columnar_round_trip(self):
+        data = b''.join(self.export('columnar'))
+        groups = list(export.read_columnar(io.BytesIO(data)))
+
+        self.assertEqual(len(groups), 16)
+        self.assertEqual([row for group in groups for row in zip(
+            group['device_uuid'].tolist(), group['type'].tolist(), group['value'].tolist(),
+            group['date_created'].tolist())], self.rows)
+
+        # And an empty export should still be a valid file
+        self.assertEqual(list(export.read_columnar(io.BytesIO(b''.join(self.export('columnar', device_uuid='none'))))),
+                         [])
+
+    def test_not_valid_columnar(self):
+        data = b''.join(self.export('columnar'))
+
+        for not_valid in [b'', b'XXXXX\x01' + data[6:], data[:100], data[:-1]]:
+            with self.assertRaises(ValueError):
+                list(export.read_columnar(io.BytesIO(not_valid)))
@@ -0,0 +1,155 @@
+import random
+import sqlite3
+import unittest
+
+from sensors.database import pagination
+from sensors.database import queries
+from sensors.database.migrations import migrate
+from sensors.hotstore import hotstore
+from sensors.hotstore.hotstore import HotStore
+from sensors.partitions import partitions
+from sensors.stats import rollups
+
+NOW = 10 * 86400
+
+
+class FakeClock(object):
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class HotStoreTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.row_factory = sqlite3.Row
+        migrate(self.conn)
+        self.generator = random.Random(5)
+        self.insert(3000, span=2 * 86400)
+        self.clock = FakeClock(NOW)
+        self.store = HotStore(window=86400, sync_interval=0, clock=self.clock)
+        self.store.sync(self.conn.cursor())
+
+    def insert(self, count, span):
+        self.conn.executemany(queries.INSERT_READING, [
+            ('device_{}'.format(self.generator.randrange(5)), self.generator.choice(['temperature', 'humidity']),
+             self.generator.randint(0, 100), NOW - self.generator.randrange(span))
+            for _ in range(count)
+        ])
+        self.conn.commit()
+
+    def sql_pages(self, start_date, end_date, limit):
+        pages = []
+        after = None
+        query = partitions.route(self.conn, queries.SELECT_READINGS_BY_DATE_RANGE)
+        while True:
+            rows, after = pagination.keyset_page(self.conn.cursor(), query, (start_date, end_date), after, limit)
+            pages.append(([tuple(row) for row in rows], after))
+            if after is None:
+                return pages
+
+    def store_pages(self, start_date, end_date, limit):
+        pages = []
+        after = None
+        while True:
+            rows, after = self.store.readings_by_date_range(start_date, end_date, after, limit)
+            pages.append((rows, after))
+            if after is None:
+                return pages
+
+    def test_range_searches_match_sql(self):
+        for _ in range(20):
+            start_date = NOW - self.generator.randrange(86400)
+            end_date = start_date + self.generator.randrange(86400)
+            limit = self.generator.choice([None, 1, 7, 100])
+
+            self.assertTrue(self.store.covers(start_date))
+            self.assertEqual(self.store_pages(start_date, end_date, limit), self.sql_pages(start_date, end_date, limit))
+
+    def test_rollups_match_sql(self):
+        for _ in range(20):
+            device_uuid = 'device_{}'.format(self.generator.randrange(6))
+            width = self.generator.choice([60, 3600, 86400, 7 * 60])
+            reading_type = self.generator.choice([None, 'temperature', 'humidity'])
+            start_date = NOW - self.generator.randrange(86400)
+
+            self.assertEqual(self.store.rollup(device_uuid, width, reading_type, start_date, NOW),
+                             rollups.rollup(self.conn.cursor(), device_uuid, width, reading_type, start_date, NOW))
+
+    def test_older_readings_are_not_covered(self):
+        self.assertFalse(self.store.covers(NOW - 86400 - 1))
+        self.assertFalse(self.store.covers(None))
+
+    def test_sync_picks_up_new_readings_and_evicts_old_ones(self):
+        # Given new readings written by someone else, and the clock moved forward an hour
+        self.insert(500, span=2 * 86400)
+        self.clock.now = NOW + 3600
+        self.store.sync(self.conn.cursor())
+
+        start_date = NOW + 3600 - 86400
+        self.assertFalse(self.store.covers(start_date - 1))
+        self.assertEqual(self.store_pages(start_date, NOW, 50), self.sql_pages(start_date, NOW, 50))
+
+    def test_sync_interval(self):
+        store = HotStore(window=86400, sync_interval=60, clock=self.clock)
+        store.sync(self.conn.cursor())
+        self.insert(10, span=60)
+
+        # Then new readings should only be seen once the interval passed or the store is marked stale
+        store.sync(self.conn.cursor())
+        self.assertEqual(store.last_id, 3000)
+        store.mark_stale()
+        store.sync(self.conn.cursor())
+        self.assertEqual(store.last_id, 3010)
+
+    def test_size_eviction_narrows_the_covered_range(self):
+        store = HotStore(window=86400, max_readings=100, sync_interval=0, clock=self.clock)
+        store.sync(self.conn.cursor())
+
+        self.assertTrue(all(len(device.ids) <= 100 for device in store.devices.values()))
+        self.assertGreater(store.horizon, NOW - 86400)
+        query = partitions.route(self.conn, queries.SELECT_READINGS_BY_DATE_RANGE)
+        self.assertEqual(store.readings_by_date_range(store.horizon, NOW)[0],
+                         [tuple(row) for row in pagination.keyset_page(
+                             self.conn.cursor(), query, (store.horizon, NOW))[0]])
+
+    def test_total_eviction_keeps_the_newest_readings(self):
+        store = HotStore(window=86400, max_total_readings=500, sync_interval=0, clock=self.clock)
+        store.sync(self.conn.cursor())
+
+        self.assertLessEqual(sum(len(device.ids) for device in store.devices.values()), 500)
+        self.assertGreater(store.horizon, NOW - 86400)
+        self.assertEqual(store.readings_by_date_range(store.horizon, NOW)[0],
+                         [row for page, _ in self.sql_pages(store.horizon, NOW, None) for row in page])
+
+        # And new readings keep the store within the bound
+        self.insert(500, span=60)
+        store.sync(self.conn.cursor())
+        self.assertLessEqual(sum(len(device.ids) for device in store.devices.values()), 500)
+        self.assertEqual(store.readings_by_date_range(store.horizon, NOW)[0],
+                         [row for page, _ in self.sql_pages(store.horizon, NOW, None) for row in page])
+
+    def test_loading_in_chunks(self):
+        load_chunk = hotstore.LOAD_CHUNK
+        hotstore.LOAD_CHUNK = 7
+        try:
+            store = HotStore(window=86400, sync_interval=0, clock=self.clock)
+            store.sync(self.conn.cursor())
+            self.insert(50, span=60)
+            store.sync(self.conn.cursor())
+        finally:
+            hotstore.LOAD_CHUNK = load_chunk
+
+        self.store = store
+        self.assertEqual(self.store_pages(NOW - 86400, NOW, 100), self.sql_pages(NOW - 86400, NOW, 100))
+
+    def test_rebuilt_table_reloads_the_store(self):
+        self.conn.execute('delete from readings')
+        self.insert(10, span=60)
+
+        self.store.sync(self.conn.cursor())
+        self.assertEqual(self.store_pages(NOW - 60, NOW, None), self.sql_pages(NOW - 60, NOW, None))
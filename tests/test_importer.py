@@ -0,0 +1,109 @@
+import io
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from sensors.database.migrations import migrate
+from sensors.importer import importer
+
+STATS_TABLES = ['device_stats', 'device_stats_histogram', 'readings_rollup']
+
+
+class ImporterTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        generator = random.Random(5)
+        self.readings = [('device_{}'.format(generator.randrange(5)), generator.choice(['temperature', 'humidity']),
+                          generator.randint(0, 100), generator.randrange(10 ** 6)) for _ in range(500)]
+
+        self.csv_path = os.path.join(self.directory, 'readings.csv')
+        with open(self.csv_path, 'w') as stream:
+            stream.write('device_uuid,type,value,date_created\n')
+            for reading in self.readings[:250]:
+                stream.write('{},{},{},{}\n'.format(*reading))
+            stream.write('device_1,pressure,10,1000\n')
+            stream.write('device_1,humidity,abc,1000\n')
+
+        self.ndjson_path = os.path.join(self.directory, 'readings.ndjson')
+        with open(self.ndjson_path, 'w') as stream:
+            for reading in self.readings[250:]:
+                stream.write(json.dumps(dict(zip(['device_uuid', 'type', 'value', 'date_created'], reading))) + '\n')
+            stream.write('{"device_uuid": "device_1", "type": "humidity", "value": 101, "date_created": 1000}\n')
+            stream.write('not json\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def database(self):
+        conn = sqlite3.connect(':memory:')
+        migrate(conn)
+        return conn
+
+    def snapshot(self, conn):
+        return {table: conn.execute('select * from {} order by 1, 2, 3, 4'.format(table)).fetchall()
+                for table in STATS_TABLES}
+
+    def test_import_files(self):
+        conn = self.database()
+        schema = conn.execute('select type, name, sql from sqlite_master order by name').fetchall()
+        rejected = io.StringIO()
+
+        report = importer.import_files(conn, [self.csv_path, self.ndjson_path], transaction_size=100,
+                                       chunk_lines=64, defer=True, rejected=rejected)
+
+        self.assertEqual(report['imported'], 500)
+        self.assertEqual(report['rejected'], 4)
+        self.assertEqual(sorted(conn.execute('select device_uuid, type, value, date_created from readings')),
+                         sorted(self.readings))
+        # The deferred indexes and triggers are back
+        self.assertEqual(conn.execute('select type, name, sql from sqlite_master order by name').fetchall(), schema)
+
+        lines = rejected.getvalue().splitlines()
+        self.assertEqual([line.split('\t')[0] for line in lines], [
+            self.csv_path + ':252', self.csv_path + ':253', self.ndjson_path + ':251', self.ndjson_path + ':252'])
+        self.assertEqual(lines[0].split('\t')[2], 'device_1,pressure,10,1000')
+
+    def test_deferred_statistics_match_triggers(self):
+        deferred = self.database()
+        importer.import_files(deferred, [self.csv_path, self.ndjson_path], chunk_lines=64, defer=True)
+        live = self.database()
+        importer.import_files(live, [self.csv_path, self.ndjson_path], chunk_lines=64)
+
+        self.assertEqual(self.snapshot(deferred), self.snapshot(live))
+
+    def test_csv_line_numbers_after_multiline_fields(self):
+        path = os.path.join(self.directory, 'multiline.csv')
+        with open(path, 'w', newline='') as stream:
+            stream.write('device_uuid,type,value,date_created\n')
+            stream.write('"device\n1",temperature,10,1000\n')
+            stream.write('device_2,temperature,abc,1000\n')
+            stream.write('device_2,temperature,20,1000\n')
+        conn = self.database()
+        schema = conn.execute('select type, name, sql from sqlite_master order by name').fetchall()
+        rejected = io.StringIO()
+
+        report = importer.import_files(conn, [path], chunk_lines=2, rejected=rejected)
+
+        self.assertEqual(report['imported'], 2)
+        self.assertEqual(rejected.getvalue(), '{}:4\t{}\tdevice_2,temperature,abc,1000\n'.format(
+            path, importer.READINGS_TYPES_ERRORS[2]))
+        # Not deferred by default
+        self.assertEqual(conn.execute('select type, name, sql from sqlite_master order by name').fetchall(), schema)
+
+    def test_parsing_processes(self):
+        conn = self.database()
+
+        report = importer.import_files(conn, [self.csv_path, self.ndjson_path], processes=2, chunk_lines=64)
+
+        self.assertEqual(report['imported'], 500)
+        self.assertEqual(sorted(conn.execute('select device_uuid, type, value, date_created from readings')),
+                         sorted(self.readings))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from sensors.database.database import init_db
+from sensors.ingest.ingest import IngestWriter
+
+
+class IngestWriterTestCases(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        init_db(self.path)
+        self.conn = sqlite3.connect(self.path)
+        self.committed = []
+
+    def tearDown(self):
+        self.conn.close()
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def count_readings(self):
+        return self.conn.execute('select count(*) from readings').fetchone()[0]
+
+    def test_readings_are_committed_in_groups(self):
+        writer = IngestWriter(self.path, batch_size=100, flush_interval=0.5, on_commit=self.committed.append)
+
+        for value in range(250):
+            self.assertTrue(writer.submit(('device_{}'.format(value % 2), 'temperature', value % 101, value)))
+        writer.flush()
+
+        # Then every reading should be stored with far fewer commits than readings
+        stats = writer.stats()
+        self.assertEqual(self.count_readings(), 250)
+        self.assertEqual(stats['committed'], 250)
+        self.assertLessEqual(stats['commits'], 5)
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(set().union(*self.committed), {'device_0', 'device_1'})
+
+        # And the triggers should have maintained the device statistics
+        self.assertEqual(self.conn.execute('select sum(readings_count) from device_stats').fetchone()[0], 250)
+        writer.stop()
+
+    def test_full_queue_rejects_readings(self):
+        writer = IngestWriter(self.path, queue_size=2, batch_size=1, flush_interval=0)
+
+        # Given the writer blocked on the database lock with its second reading
+        self.assertTrue(writer.submit(('device', 'temperature', 0, 0)))
+        writer.flush()
+        self.conn.execute('BEGIN IMMEDIATE')
+        self.assertTrue(writer.submit(('device', 'temperature', 1, 1)))
+        while writer.stats()['queue_depth']:
+            time.sleep(0.01)
+
+        # Then the queue should only take as many readings as it can hold
+        self.assertTrue(writer.submit(('device', 'temperature', 2, 2)))
+        self.assertTrue(writer.submit(('device', 'temperature', 3, 3)))
+        self.assertFalse(writer.submit(('device', 'temperature', 4, 4)))
+        self.assertEqual(writer.stats()['rejected'], 1)
+
+        # And the accepted ones should be committed once the lock is released
+        self.conn.rollback()
+        writer.flush()
+        self.assertEqual(self.count_readings(), 4)
+        writer.stop()
+
+    def test_stop_commits_pending_readings(self):
+        writer = IngestWriter(self.path, batch_size=1000, flush_interval=60)
+
+        for value in range(10):
+            writer.submit(('device', 'humidity', value, value))
+        writer.stop()
+
+        self.assertEqual(self.count_readings(), 10)
+        self.assertEqual(writer.stats()['committed'], 10)
+
+    def test_failed_commits_do_not_stop_the_writer(self):
+        writer = IngestWriter(self.path, batch_size=10, flush_interval=0)
+
+        # Given a reading the database cannot store
+        writer.submit(('device', 'temperature', {'value': 1}, 1))
+        writer.flush()
+        self.assertEqual(writer.stats()['failed'], 1)
+
+        # Then the next ones should still be written
+        writer.submit(('device', 'temperature', 1, 2))
+        writer.flush()
+        self.assertEqual(self.count_readings(), 1)
+        writer.stop()
+
+    def test_failed_groups_are_written_one_by_one(self):
+        writer = IngestWriter(self.path, batch_size=3, flush_interval=5)
+
+        # Given a group holding a reading the database cannot store
+        with self.assertLogs('sensors.ingest.ingest', 'ERROR') as logs:
+            writer.submit(('device', 'temperature', 1, 1))
+            writer.submit(('device', 'temperature', {'value': 2}, 2))
+            writer.submit(('device', 'temperature', 3, 3))
+            writer.flush()
+
+        # Then only that reading should be lost, and reported
+        self.assertEqual(self.count_readings(), 2)
+        stats = writer.stats()
+        self.assertEqual((stats['committed'], stats['failed'], stats['failed_commits']), (2, 1, 1))
+        self.assertIn("Lost queued reading ('device', 'temperature', {'value': 2}, 2)", '\n'.join(logs.output))
+        writer.stop()
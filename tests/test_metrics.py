@@ -0,0 +1,136 @@
+import os
+import sqlite3
+import unittest
+
+from app import app
+from sensors.database import queries
+from sensors.database.migrations import migrate
+from sensors.metrics import metrics
+from sensors.partitions import partitions
+from tests import reset_db
+
+
+class MetricsTestCases(unittest.TestCase):
+
+    def test_histogram_render(self):
+        histogram = metrics.Histogram('latency_seconds', 'Latency', ('route',), buckets=[0.1, 1])
+        histogram.observe(0.05, '/a')
+        histogram.observe(0.5, '/a')
+        histogram.observe(5, '/a')
+
+        self.assertEqual(histogram.render(), [
+            '# HELP latency_seconds Latency',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{route="/a",le="0.1"} 1',
+            'latency_seconds_bucket{route="/a",le="1"} 2',
+            'latency_seconds_bucket{route="/a",le="+Inf"} 3',
+            'latency_seconds_sum{route="/a"} 5.55',
+            'latency_seconds_count{route="/a"} 3',
+        ])
+
+    def test_counter_render_escapes_labels(self):
+        counter = metrics.Counter('errors_total', 'Errors', ('error',))
+        counter.inc('say "hi"', amount=2)
+
+        self.assertEqual(counter.render()[2], 'errors_total{error="say \\"hi\\""} 2')
+
+
+class InstrumentedConnectionTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:', factory=metrics.connection_factory(0))
+        migrate(self.conn)
+
+    def test_queries_are_named_timed_and_counted(self):
+        rows = metrics.QUERY_ROWS.value('INSERT_READING')
+        self.conn.executemany(queries.INSERT_READING, [('device', 'temperature', value, value) for value in range(10)])
+        self.assertEqual(metrics.QUERY_ROWS.value('INSERT_READING'), rows + 10)
+
+        # Rows fetched by iterating a templated query
+        count = metrics.QUERY_SECONDS.count('SELECT_DEVICE_READINGS')
+        rows = metrics.QUERY_ROWS.value('SELECT_DEVICE_READINGS')
+        cur = self.conn.cursor()
+        query = partitions.route(cur, queries.SELECT_DEVICE_READINGS)
+        self.assertEqual(len(list(cur.execute(query.format('1'), ('device',)))), 10)
+        self.assertEqual(metrics.QUERY_SECONDS.count('SELECT_DEVICE_READINGS'), count + 1)
+        self.assertEqual(metrics.QUERY_ROWS.value('SELECT_DEVICE_READINGS'), rows + 10)
+
+        # Ad hoc queries are named by their first word
+        count = metrics.QUERY_SECONDS.count('select')
+        self.conn.execute('select count(*) from readings').fetchall()
+        self.assertEqual(metrics.QUERY_SECONDS.count('select'), count + 1)
+
+    def test_queries_of_a_request_are_recorded_when_it_ends(self):
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executemany(queries.INSERT_READING, [('device', 'temperature', value, value) for value in range(10)])
+        count = metrics.QUERY_SECONDS.count('SELECT_DEVICE_READINGS')
+        rows = metrics.QUERY_ROWS.value('SELECT_DEVICE_READINGS')
+
+        metrics._start_request()
+        try:
+            # A cursor dropped with rows left to fetch
+            query = partitions.route(self.conn.cursor(), queries.SELECT_DEVICE_READINGS)
+            self.assertEqual(self.conn.execute(query.format('1'), ('device',)).fetchone()['type'], 'temperature')
+            self.assertEqual(metrics.QUERY_SECONDS.count('SELECT_DEVICE_READINGS'), count)
+        finally:
+            metrics._request.started = None
+            metrics.record_pending()
+
+        self.assertEqual(metrics.QUERY_SECONDS.count('SELECT_DEVICE_READINGS'), count + 1)
+        self.assertEqual(metrics.QUERY_ROWS.value('SELECT_DEVICE_READINGS'), rows + 1)
+
+    def test_slow_queries_are_logged_with_their_plan(self):
+        conn = sqlite3.connect(':memory:', factory=metrics.connection_factory(-1))
+        migrate(conn)
+
+        with self.assertLogs('sensors.metrics.metrics', 'WARNING') as logs:
+            conn.execute(queries.SELECT_DEVICE_STATS, ('device',)).fetchall()
+
+        self.assertIn('SELECT_DEVICE_STATS', logs.output[0])
+        self.assertIn('device_stats', logs.output[0].split('plan:')[1])
+
+
+class MetricsEndpointTestCases(unittest.TestCase):
+
+    def setUp(self):
+        conn = sqlite3.connect('test_database.db')
+        reset_db(conn)
+        conn.close()
+        app.config['TESTING'] = True
+        app.extensions['response_cache'].clear()
+        # Another name of the test database, so the queries go through a pool of instrumented connections
+        app.config.update(METRICS_ENABLED=True, METRICS_QUERIES_ENABLED=True,
+                          TEST_DATABASE=os.path.join('.', 'test_database.db'))
+        self.client = app.test_client
+
+    def tearDown(self):
+        app.config.update(METRICS_ENABLED=False, METRICS_QUERIES_ENABLED=False, TEST_DATABASE='test_database.db')
+
+    def test_metrics(self):
+        self.client().post('/devices/test_device/readings/', data='{"type": "temperature", "value": 10}').close()
+        self.client().post('/devices/test_device/readings/', data='{"type": "temperature", "value": 101}').close()
+        self.client().get('/devices/test_device/readings/mean/').close()
+
+        request = self.client().get('/metrics')
+        text = request.get_data(as_text=True)
+
+        self.assertEqual(request.status_code, 200)
+        self.assertTrue(request.content_type.startswith('text/plain'))
+        self.assertIn('http_request_duration_seconds_count{route="/devices/<string:device_uuid>/readings/mean/",'
+                      'method="GET",status="200"}', text)
+        self.assertIn('http_request_sqlite_seconds_count{route="/devices/<string:device_uuid>/readings/mean/",'
+                      'method="GET"}', text)
+        self.assertIn('sqlite_query_duration_seconds_count{query="SELECT_DEVICE_STATS"}', text)
+        self.assertIn('readings_accepted_total{path="sync"}', text)
+        self.assertIn('readings_rejected_total{error="READING_OUT_OF_RANGE"}', text)
+
+    def test_queries_are_not_timed_by_default(self):
+        app.config.update(METRICS_QUERIES_ENABLED=False, TEST_DATABASE='test_database.db')
+        count = metrics.QUERY_SECONDS.count('SELECT_DEVICE_STATS')
+        requests = metrics.REQUEST_SECONDS.count('/devices/<string:device_uuid>/readings/mean/', 'GET', '200')
+
+        self.client().get('/devices/test_device/readings/mean/').close()
+
+        self.assertEqual(metrics.QUERY_SECONDS.count('SELECT_DEVICE_STATS'), count)
+        self.assertEqual(metrics.REQUEST_SECONDS.count('/devices/<string:device_uuid>/readings/mean/', 'GET', '200'),
+                         requests + 1)
@@ -0,0 +1,217 @@
+import calendar
+import json
+import random
+import sqlite3
+import time
+import unittest
+
+from app import app
+from sensors.database import queries
+from sensors.database.migrations import migrate
+from sensors.partitions import partitions
+from sensors.stats.rollups import rebuild_rollups
+from sensors.stats.stats import rebuild_device_stats
+from tests import reset_db
+
+# 2024-04-15, the readings go back to December 2023
+NOW = calendar.timegm((2024, 4, 15, 12, 0, 0))
+FEBRUARY = calendar.timegm((2024, 2, 1, 0, 0, 0))
+MARCH = calendar.timegm((2024, 3, 1, 0, 0, 0))
+
+STATS_TABLES = ['device_stats', 'device_stats_histogram', 'readings_rollup']
+
+
+def snapshot(conn, where='1'):
+    return {table: conn.execute('select * from {} where {} order by 1, 2, 3, 4'.format(
+        table, where if table == 'readings_rollup' else '1')).fetchall() for table in STATS_TABLES}
+
+
+def all_readings(conn):
+    return conn.execute(partitions.route(conn, 'select id, device_uuid, type, value, date_created from {readings} '
+                                               'order by id')).fetchall()
+
+
+class PartitionsTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        migrate(self.conn)
+        generator = random.Random(11)
+        self.conn.executemany(queries.INSERT_READING, [
+            ('device_{}'.format(generator.randrange(4)), generator.choice(['temperature', 'humidity']),
+             generator.randint(0, 100), NOW - generator.randrange(130 * 86400))
+            for _ in range(2000)
+        ])
+        self.conn.commit()
+        self.readings = all_readings(self.conn)
+
+    def partition(self, **options):
+        return partitions.partition_readings(self.conn, now=NOW, batch_size=100, pause=0, grace=0, **options)
+
+    def test_month_bounds(self):
+        self.assertEqual(partitions.month_start(NOW), calendar.timegm((2024, 4, 1, 0, 0, 0)))
+        self.assertEqual(partitions.month_start(NOW, -4), calendar.timegm((2023, 12, 1, 0, 0, 0)))
+        self.assertEqual(partitions.month_start(NOW, 9), calendar.timegm((2025, 1, 1, 0, 0, 0)))
+        self.assertEqual(partitions.partition_name(FEBRUARY), 'readings_202402')
+
+    def test_past_months_are_moved(self):
+        stats = snapshot(self.conn)
+
+        report = self.partition()
+
+        self.assertEqual(report['created'], ['readings_202312', 'readings_202401', 'readings_202402',
+                                             'readings_202403'])
+        self.assertEqual(report['moved'], sum(1 for row in self.readings[:-1] if row[4] < partitions.month_start(NOW)))
+        # Only the readings of the current month (and the last one written) are left in the readings table
+        self.assertEqual(self.conn.execute('select count(*) from readings where date_created<? and id<?', (
+            partitions.month_start(NOW), self.readings[-1][0])).fetchone()[0], 0)
+        self.assertEqual(all_readings(self.conn), self.readings)
+        # Moving readings does not change their statistics
+        self.assertEqual(snapshot(self.conn), stats)
+        rebuild_device_stats(self.conn)
+        rebuild_rollups(self.conn)
+        self.assertEqual(snapshot(self.conn), stats)
+
+        # Running it again has nothing to move
+        self.assertEqual(self.partition(), {'moved': 0, 'created': [], 'retired': []})
+
+    def test_queries_only_read_the_partitions_in_range(self):
+        self.partition()
+
+        # The readings table is only read when it holds readings within the range
+        self.assertEqual(partitions.readings_tables(self.conn, FEBRUARY, MARCH - 1), ['readings_202402'])
+        self.assertEqual(partitions.readings_tables(self.conn, MARCH), ['readings_202403', 'readings'])
+        self.assertEqual(len(partitions.readings_tables(self.conn)), 5)
+        self.conn.execute(queries.INSERT_READING, ('device_0', 'temperature', 100, FEBRUARY + 10))
+        self.assertEqual(partitions.readings_tables(self.conn, FEBRUARY, MARCH - 1), ['readings_202402', 'readings'])
+        self.conn.rollback()
+
+        query = partitions.route(self.conn, queries.SELECT_READINGS_BY_DATE_RANGE, FEBRUARY, MARCH - 1)
+        page = query.format('(date_created, id) > (?, ?)') + ' limit ?'
+        plan = ' '.join(row[3] for row in self.conn.execute('EXPLAIN QUERY PLAN ' + page, (FEBRUARY, MARCH - 1,
+                                                                                              FEBRUARY, 0, 50)))
+        self.assertNotIn('readings_202401', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+        rows = self.conn.execute(query.format('1'), (FEBRUARY, MARCH - 1)).fetchall()
+        self.assertEqual(rows, sorted([(device_uuid, reading_type, value, date_created, row_id)
+                                       for row_id, device_uuid, reading_type, value, date_created in self.readings
+                                       if FEBRUARY <= date_created < MARCH], key=lambda row: (row[3], row[4])))
+
+    def test_compacted_partitions_keep_their_rollups(self):
+        rollups = snapshot(self.conn)['readings_rollup']
+
+        report = self.partition(retention_months=2)
+
+        self.assertEqual(report['retired'], ['readings_202312', 'readings_202401'])
+        self.assertEqual(partitions.retired_until(self.conn), FEBRUARY)
+        self.assertEqual(partitions.readings_tables(self.conn), ['readings_202402', 'readings_202403', 'readings'])
+        self.assertEqual(all_readings(self.conn), [row for row in self.readings
+                                                   if row[4] >= FEBRUARY or row == self.readings[-1]])
+        # The device statistics only count the readings left, the rollups of the retired months stay
+        self.assertEqual(snapshot(self.conn)['readings_rollup'], rollups)
+        stats = snapshot(self.conn)
+        rebuild_device_stats(self.conn)
+        rebuild_rollups(self.conn)
+        self.assertEqual(snapshot(self.conn), stats)
+
+    def test_dropped_partitions_lose_their_rollups(self):
+        rollups = snapshot(self.conn, 'bucket>={}'.format(FEBRUARY))['readings_rollup']
+
+        self.partition(retention_months=2, retention_mode='drop')
+
+        self.assertEqual(snapshot(self.conn)['readings_rollup'], rollups)
+        stats = snapshot(self.conn)
+        rebuild_device_stats(self.conn)
+        self.assertEqual(snapshot(self.conn), stats)
+
+    def test_late_readings_of_a_retired_month(self):
+        self.partition(retention_months=2)
+        self.conn.executemany(queries.INSERT_READING, [('device_0', 'temperature', 100, FEBRUARY - 10),
+                                                       ('device_0', 'temperature', 1, NOW)])
+        self.conn.commit()
+
+        report = self.partition(retention_months=2)
+
+        # Along with the reading that was the last one written until now
+        last_month = partitions.partition_name(partitions.month_start(self.readings[-1][4]))
+        self.assertEqual(report['moved'], 2)
+        self.assertEqual(report['created'], sorted({last_month, 'readings_202401'}))
+        self.assertIn('readings_202401', report['retired'])
+        stats = snapshot(self.conn)
+        rebuild_device_stats(self.conn)
+        self.assertEqual(snapshot(self.conn), stats)
+
+    def test_deleted_readings_still_update_the_statistics(self):
+        self.partition()
+        self.conn.execute('delete from readings where id=?', (self.readings[-1][0],))
+        self.conn.commit()
+        stats = snapshot(self.conn)
+
+        rebuild_device_stats(self.conn)
+
+        self.assertEqual(snapshot(self.conn)['device_stats'], stats['device_stats'])
+
+
+class PartitionedRoutesTestCases(unittest.TestCase):
+
+    URLS = [
+        '/devices/device_1/readings/',
+        '/devices/device_1/readings/max/',
+        '/devices/device_1/readings/median/',
+        '/devices/device_1/readings/quartiles/',
+        '/devices/device_1/readings/max/?by=type',
+        '/devices/device_1/readings/median/?type=humidity',
+        '/summary/?by=type&start_date={}',
+        '/devices/device_1/readings/rollup/?bucket=3600&start_date={}&end_date={}',
+        '/devices/device_1/readings/quartiles/?start_date={}&end_date={}',
+        '/devices/device_1/readings/quartiles/?by=type&exact=true&start_date={}&end_date={}',
+        '/summary/?start_date={}&end_date={}',
+        '/export/?format=ndjson&start_date={}',
+    ]
+
+    def setUp(self):
+        self.conn = sqlite3.connect('test_database.db')
+        reset_db(self.conn)
+        generator = random.Random(3)
+        now = int(time.time())
+        self.conn.executemany(queries.INSERT_READING, [
+            ('device_{}'.format(generator.randrange(3)), generator.choice(['temperature', 'humidity']),
+             generator.randint(0, 100), now - generator.randrange(100 * 86400))
+            for _ in range(500)
+        ])
+        self.conn.commit()
+        self.start_date = partitions.month_start(now, -2) + 1800
+        self.end_date = partitions.month_start(now, -1) + 1800
+        app.config['TESTING'] = True
+        self.client = app.test_client
+
+    def tearDown(self):
+        self.conn.close()
+
+    def responses(self):
+        app.extensions['response_cache'].clear()
+        app.extensions.pop('hot_store', None)
+        client = self.client()
+        responses = [client.get(url.format(self.start_date, self.end_date)).get_data(as_text=True)
+                     for url in self.URLS]
+        for option, body in (('type', {'type': 'humidity'}),
+                             ('range', {'start_date': self.start_date, 'end_date': self.end_date})):
+            responses.append(client.post('/custom/search/{}?limit=20'.format(option),
+                                         data=json.dumps(body)).get_data(as_text=True))
+        for body in ({}, {'start_date': self.start_date, 'end_date': self.end_date}):
+            body['devices'] = ['device_0', 'device_1', 'device_2']
+            responses.append(client.post('/devices/stats/', data=json.dumps(body)).get_data(as_text=True))
+        return responses
+
+    def test_responses_do_not_change_once_partitioned(self):
+        before = self.responses()
+
+        report = partitions.partition_readings(self.conn, pause=0, grace=0)
+
+        self.assertGreaterEqual(len(report['created']), 3)
+        self.assertEqual(self.responses(), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
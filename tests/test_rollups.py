@@ -0,0 +1,70 @@
+import random
+import sqlite3
+import unittest
+
+from sensors.database import queries
+from sensors.database.migrations import migrate
+from sensors.stats import rollups
+
+
+class RollupsTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        migrate(self.conn)
+
+        # Three days of random readings, one every ten minutes
+        generator = random.Random(9)
+        self.conn.executemany(queries.INSERT_READING, [
+            ('device', generator.choice(['temperature', 'humidity']), generator.randint(0, 100), date_created)
+            for date_created in range(0, 3 * 86400, 600)
+        ])
+
+    def tearDown(self):
+        self.conn.close()
+
+    def raw_buckets(self, width, reading_type, start_date, end_date):
+        # Same buckets computed in Python straight from the readings, bypassing the rollup tables
+        buckets = {}
+        query = 'select type, value, date_created from readings order by date_created'
+        for row_type, value, date_created in self.conn.execute(query):
+            if reading_type is not None and row_type != reading_type:
+                continue
+            if start_date is not None and date_created < start_date:
+                continue
+            if end_date is not None and date_created > end_date:
+                continue
+            buckets.setdefault(date_created // width * width, []).append(value)
+        return [{'bucket': bucket, 'count': len(values), 'min': min(values), 'max': max(values),
+                 'mean': sum(values) / len(values) if sum(values) % len(values) else sum(values) // len(values)}
+                for bucket, values in sorted(buckets.items())]
+
+    def test_rollups_match_raw_buckets(self):
+        cases = [
+            (3600, None, None, None),
+            (86400, 'temperature', None, None),
+            (7200, 'humidity', 3600, 2 * 86400 - 1),
+            (900, None, 1000, 50000),
+            (86400, None, 86400, 3 * 86400 - 1),
+        ]
+        for width, reading_type, start_date, end_date in cases:
+            self.assertEqual(rollups.rollup(self.conn.cursor(), 'device', width, reading_type, start_date, end_date),
+                             self.raw_buckets(width, reading_type, start_date, end_date))
+
+    def test_rollup_width_selection(self):
+        self.assertEqual(rollups.rollup_width(86400), 86400)
+        self.assertEqual(rollups.rollup_width(7200, 3600, 7199), 3600)
+        self.assertIsNone(rollups.rollup_width(7200, 1000))
+        self.assertIsNone(rollups.rollup_width(900))
+
+    def test_bucket_width(self):
+        self.assertEqual(rollups.bucket_width('hour'), 3600)
+        self.assertEqual(rollups.bucket_width('900'), 900)
+        self.assertEqual(rollups.bucket_width(str(rollups.MAX_BUCKET_WIDTH)), rollups.MAX_BUCKET_WIDTH)
+        for bucket in ('week', None, '0', '-60', str(rollups.MAX_BUCKET_WIDTH + 1), str(10 ** 30)):
+            self.assertIsNone(rollups.bucket_width(bucket))
+
+    def test_rollups_follow_deletes(self):
+        self.conn.execute('delete from readings where date_created < 3600')
+        self.assertEqual(rollups.rollup(self.conn.cursor(), 'device', 3600, end_date=7199),
+                         self.raw_buckets(3600, None, None, 7199))
@@ -5,6 +5,9 @@ import time
 import unittest
 
 from app import app
+from sensors.binary.binary import BINARY_MIMETYPE, encode_readings
+from sensors.ingest import ingest
+from tests import reset_db
 
 
 class SensorRoutesTestCases(unittest.TestCase):
@@ -12,8 +15,7 @@ class SensorRoutesTestCases(unittest.TestCase):
     def setUp(self):
         # Setup the SQLite DB
         conn = sqlite3.connect('test_database.db')
-        conn.execute('DROP TABLE IF EXISTS readings')
-        conn.execute('CREATE TABLE IF NOT EXISTS readings (device_uuid TEXT, type TEXT, value INTEGER, date_created INTEGER)')
+        reset_db(conn)
         
         self.device_uuid = 'test_device'
 
@@ -37,6 +39,10 @@ class SensorRoutesTestCases(unittest.TestCase):
 
         app.config['TESTING'] = True
 
+        # The data was rewritten behind the app's back, drop the cached responses and the hot store
+        app.extensions['response_cache'].clear()
+        app.extensions.pop('hot_store', None)
+
         self.client = app.test_client
 
     def test_device_readings_get(self):
@@ -50,6 +56,48 @@ class SensorRoutesTestCases(unittest.TestCase):
         # And the response data should have five sensor readings
         self.assertTrue(len(json.loads(request.data)) == 5)
 
+    def test_device_readings_get_pages(self):
+        """
+        The goal is to test that we are able to page over a device's readings
+        with the cursor returned by the previous page.
+        """
+        readings = []
+        url = '/devices/{}/readings/?limit=2'.format(self.device_uuid)
+
+        while url:
+            request = self.client().get(url)
+            self.assertEqual(request.status_code, 200)
+            self.assertTrue(len(request.json) <= 2)
+            readings.extend(request.json)
+
+            next_cursor = request.headers.get('X-Next-Cursor')
+            url = '/devices/{}/readings/?limit=2&after={}'.format(self.device_uuid, next_cursor) if next_cursor else None
+
+        # Then we should have walked over the five readings, oldest first
+        self.assertEqual(len(readings), 5)
+        self.assertEqual([reading.get('date_created') for reading in readings],
+                         sorted(reading.get('date_created') for reading in readings))
+
+        # And a malformed cursor should be rejected
+        request = self.client().get('/devices/{}/readings/?after=yesterday'.format(self.device_uuid))
+        self.assertEqual(request.status_code, 400)
+
+        # And so should a limit out of bounds, however large
+        for limit in (0, 10001, 10 ** 30):
+            request = self.client().get('/devices/{}/readings/?limit={}'.format(self.device_uuid, limit))
+            self.assertEqual(request.status_code, 400)
+            self.assertEqual(request.get_data(as_text=True), 'NOT_VALID_LIMIT')
+
+    def test_device_readings_get_ndjson(self):
+        request = self.client().get('/devices/{}/readings/?format=ndjson'.format(self.device_uuid))
+
+        # Then we should receive one reading per line
+        self.assertEqual(request.status_code, 200)
+        self.assertEqual(request.mimetype, 'application/x-ndjson')
+        lines = request.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[0]).get('device_uuid'), self.device_uuid)
+
     def test_device_readings_post(self):
         # Given a device UUID
         # When we make a request with the given UUID to create a reading
@@ -128,6 +176,34 @@ class SensorRoutesTestCases(unittest.TestCase):
         # And the response data should have three sensor readings
         self.assertTrue(len(json.loads(request.data)) == 6)
 
+    def test_device_readings_range_validation(self):
+        """
+        The goal is to test that the bounds of a date range must be epoch times,
+        and that a missing bound leaves the range open whether or not the hot store answers
+        """
+        for start_date in ('yesterday', 1.5, True, [1]):
+            request = self.client().post('/custom/search/range', data=json.dumps({'start_date': start_date}))
+            self.assertEqual(request.status_code, 400, start_date)
+            self.assertEqual(request.data, b'NOT_VALID_DATE_RANGE')
+
+        # Integer strings are still accepted
+        request = self.client().post('/custom/search/range', data=json.dumps({
+            'start_date': str(int(time.time()) - 100), 'end_date': str(int(time.time()))}))
+        self.assertEqual(len(request.json), 6)
+
+        for hotstore_enabled in (True, False):
+            app.config['HOTSTORE_ENABLED'] = hotstore_enabled
+            app.extensions.pop('hot_store', None)
+            app.extensions['response_cache'].clear()
+            try:
+                since = self.client().post('/custom/search/range', data=json.dumps({
+                    'start_date': int(time.time()) - 60})).json
+                until = self.client().post('/custom/search/range', data=json.dumps({
+                    'end_date': int(time.time()) - 60})).json
+            finally:
+                app.config['HOTSTORE_ENABLED'] = True
+            self.assertEqual((len(since), len(until)), (5, 1), hotstore_enabled)
+
     def test_device_readings_max(self):
         """
         This test should be implemented. The goal is to test that
@@ -193,6 +269,271 @@ class SensorRoutesTestCases(unittest.TestCase):
         # And we are getting the correct quartiles values
         self.assertTrue(request.json.get('quartile_1') == 48.0 and request.json.get('quartile_3') == 63.0)
 
+    def test_device_statistics_per_type(self):
+        """
+        The goal is to test that we are able to get the statistics of
+        a single type of readings, or of each type of readings.
+        """
+        request = self.client().get('/devices/{}/readings/max/?type=humidity'.format(self.device_uuid))
+        self.assertEqual([reading.get('value') for reading in request.json], [63])
+
+        request = self.client().get('/devices/{}/readings/median/?type=temperature'.format(self.device_uuid))
+        self.assertEqual([reading.get('value') for reading in request.json], [50])
+
+        request = self.client().get('/devices/{}/readings/mean/?by=type'.format(self.device_uuid))
+        self.assertEqual(request.json, {'humidity': {'value': 55.5}, 'temperature': {'value': 172 / 3}})
+
+        request = self.client().get('/devices/{}/readings/quartiles/?by=type'.format(self.device_uuid))
+        self.assertEqual(request.json, {'humidity': {'quartile_1': 51.75, 'quartile_3': 59.25},
+                                        'temperature': {'quartile_1': 36.0, 'quartile_3': 75.0}})
+
+        request = self.client().get('/devices/{}/readings/max/?by=type'.format(self.device_uuid))
+        self.assertEqual({reading_type: [reading.get('value') for reading in readings]
+                          for reading_type, readings in request.json.items()}, {'humidity': [63], 'temperature': [100]})
+
+        # And the summary should have one entry per device and type
+        request = self.client().get('/summary/?by=type')
+        self.assertEqual([(summary.get('device_uuid'), summary.get('type'), summary.get('number_of_readings'))
+                          for summary in request.json], [('other_uuid', 'temperature', 1),
+                                                         (self.device_uuid, 'humidity', 2),
+                                                         (self.device_uuid, 'temperature', 3)])
+
+        # And an unknown grouping should be rejected
+        self.assertEqual(self.client().get('/summary/?by=date').status_code, 400)
+        self.assertEqual(self.client().get('/devices/{}/readings/mean/?by=date'.format(self.device_uuid)).status_code,
+                         400)
+
+    def test_device_readings_quartiles_within_dates(self):
+        """
+        The goal is to test that we are able to query for the quartiles of
+        a date window, estimated from the sketches or computed exactly.
+        """
+        url = '/devices/{}/readings/quartiles/?start_date={}'.format(self.device_uuid, int(time.time()) - 75)
+
+        # Then both should be the quartiles of the readings within the window (few readings are sketched exactly)
+        for suffix in ('', '&exact=true'):
+            request = self.client().get(url + suffix)
+            self.assertEqual(request.status_code, 200)
+            self.assertEqual(request.json, {'quartile_1': 49.5, 'quartile_3': 72.25})
+
+            request = self.client().get(url + suffix + '&by=type')
+            self.assertEqual(request.json, {'humidity': {'quartile_1': 51.75, 'quartile_3': 59.25},
+                                            'temperature': {'quartile_1': 62.5, 'quartile_3': 87.5}})
+
+        # And a window without readings should have no quartiles
+        request = self.client().get('/devices/{}/readings/quartiles/?end_date=0'.format(self.device_uuid))
+        self.assertEqual(request.json, {'quartile_1': None, 'quartile_3': None})
+
+    def test_device_readings_max_is_the_last_written(self):
+        """
+        The goal is to test that the max reading is the same whatever the
+        number of readings holding the max value.
+        """
+        now = int(time.time())
+        self.client().post('/devices/{}/readings/'.format(self.device_uuid), data=json.dumps({
+            'type': 'humidity', 'value': 100, 'date_created': now - 1000}))
+
+        request = self.client().get('/devices/{}/readings/max/'.format(self.device_uuid))
+        self.assertEqual(request.json, [{'device_uuid': self.device_uuid, 'type': 'humidity', 'value': 100,
+                                         'date_created': now - 1000}])
+
+        request = self.client().post('/devices/stats/', data=json.dumps({'devices': [self.device_uuid],
+                                                                         'stats': ['max']}))
+        self.assertEqual(request.json[self.device_uuid]['max'], [{
+            'device_uuid': self.device_uuid, 'type': 'humidity', 'value': 100, 'date_created': now - 1000}])
+
+    def test_device_readings_rollup(self):
+        """
+        The goal is to test that we are able to downsample a device's readings into time buckets.
+        """
+        request = self.client().get('/devices/{}/readings/rollup/?bucket=day&type=temperature'.format(
+            self.device_uuid))
+
+        # Then we should receive a 200
+        self.assertEqual(request.status_code, 200)
+
+        # And every temperature reading should be counted in the buckets
+        self.assertEqual(sum(bucket.get('count') for bucket in request.json), 3)
+        self.assertEqual(max(bucket.get('max') for bucket in request.json), 100)
+
+        # And an invalid bucket should be rejected
+        for bucket in ('week', 0, 366 * 86400 + 1, 10 ** 30):
+            request = self.client().get('/devices/{}/readings/rollup/?bucket={}'.format(self.device_uuid, bucket))
+            self.assertEqual(request.status_code, 400)
+            self.assertEqual(request.get_data(as_text=True), 'NOT_VALID_BUCKET')
+
+    def test_readings_with_bad_dates_are_left_out_of_the_hot_store(self):
+        """
+        The goal is to test that readings stored with a date that is not an epoch time (before the dates
+        were validated) do not break the range searches and rollups answered from the hot store.
+        """
+        conn = sqlite3.connect('test_database.db')
+        conn.execute('insert into readings (device_uuid,type,value,date_created) VALUES (?,?,?,?)',
+                     (self.device_uuid, 'humidity', 10, 'abc'))
+        conn.execute('insert into readings (device_uuid,type,value,date_created) VALUES (?,?,?,?)',
+                     (self.device_uuid, 'humidity', 10, time.time()))
+        conn.commit()
+        conn.close()
+
+        request = self.client().post('/custom/search/range', data=json.dumps({'start_date': int(time.time()) - 60}))
+        self.assertEqual(request.status_code, 200)
+        self.assertEqual(len(request.json), 5)
+
+        request = self.client().get('/devices/{}/readings/rollup/?start_date={}'.format(
+            self.device_uuid, int(time.time()) - 1000))
+        self.assertEqual(request.status_code, 200)
+        self.assertEqual(sum(bucket.get('count') for bucket in request.json), 5)
+
+    def test_ui_pages(self):
+        """
+        The goal is to test that the UI pages render the same data as the API.
+        """
+        for url in ['/', '/readings/{}/'.format(self.device_uuid), '/readings/{}/max'.format(self.device_uuid),
+                    '/readings/{}/median'.format(self.device_uuid), '/readings/{}/mean'.format(self.device_uuid),
+                    '/readings/{}/quartiles'.format(self.device_uuid), '/readings/summary']:
+            request = self.client().get(url)
+            self.assertEqual(request.status_code, 200, url)
+
+        # And when we register a reading from the UI it should be stored
+        request = self.client().post('/new/{}/'.format(self.device_uuid), data={'type': 'humidity', 'value': '30'})
+        self.assertEqual(request.status_code, 302)
+        request = self.client().get('/devices/{}/readings/'.format(self.device_uuid))
+        self.assertEqual(len(request.json), 6)
+
+    def test_large_responses_are_streamed_not_cached(self):
+        """
+        The goal is to test that a response above CACHE_MAX_ENTRY_BYTES is streamed
+        (whole) without being cached, while the smaller ones still are.
+        """
+        app.config['CACHE_MAX_ENTRY_BYTES'] = 200
+        try:
+            request = self.client().get('/summary/')
+            mean = self.client().get('/devices/{}/readings/mean/'.format(self.device_uuid))
+        finally:
+            app.config['CACHE_MAX_ENTRY_BYTES'] = 1024 * 1024
+
+        self.assertGreater(len(request.data), 200)
+        self.assertEqual(len(request.json), 2)
+        self.assertIsNone(request.headers.get('ETag'))
+        self.assertIsNotNone(mean.headers.get('ETag'))
+        # Only the mean should be cached, along with the generations of the device and of all devices
+        self.assertEqual(len(app.extensions['response_cache'].backend), 3)
+
+    def test_stats_cache_and_etag(self):
+        """
+        The goal is to test that the statistics are cached with an ETag
+        and invalidated when a new reading of the device arrives.
+        """
+        request = self.client().get('/devices/{}/readings/mean/'.format(self.device_uuid))
+        etag = request.headers.get('ETag')
+        self.assertEqual(request.json.get('value'), 56.6)
+        self.assertIsNotNone(etag)
+
+        # Then asking again with the same ETag should cost a 304
+        request = self.client().get('/devices/{}/readings/mean/'.format(self.device_uuid),
+                                    headers={'If-None-Match': etag})
+        self.assertEqual(request.status_code, 304)
+
+        # And after a new reading the mean should be recomputed
+        self.client().post('/devices/{}/readings/'.format(self.device_uuid), data=
+            json.dumps({
+                'type': 'temperature',
+                'value': 100
+            }))
+        request = self.client().get('/devices/{}/readings/mean/'.format(self.device_uuid),
+                                    headers={'If-None-Match': etag})
+        self.assertEqual(request.status_code, 200)
+        self.assertEqual(request.json.get('value'), 63.833333333333336)
+
+        # And so should the summary
+        request = self.client().get('/summary/')
+        self.assertEqual(request.json[1].get('number_of_readings'), 6)
+
+    def test_cache_follows_the_writes_of_other_workers(self):
+        """
+        The goal is to test that a reading written by another worker (whose invalidations this one
+        does not see) is in the cached statistics and rollups right away.
+        """
+        mean = self.client().get('/devices/{}/readings/mean/'.format(self.device_uuid))
+        rollup = self.client().get('/devices/{}/readings/rollup/?start_date={}'.format(
+            self.device_uuid, int(time.time()) - 1000))
+        summary = self.client().get('/summary/')
+
+        conn = sqlite3.connect('test_database.db')
+        conn.execute('insert into readings (device_uuid,type,value,date_created) VALUES (?,?,?,?)',
+                     (self.device_uuid, 'temperature', 100, int(time.time())))
+        conn.commit()
+        conn.close()
+
+        request = self.client().get('/devices/{}/readings/mean/'.format(self.device_uuid),
+                                    headers={'If-None-Match': mean.headers.get('ETag')})
+        self.assertEqual(request.status_code, 200)
+        self.assertEqual(request.json.get('value'), 63.833333333333336)
+        request = self.client().get('/devices/{}/readings/rollup/?start_date={}'.format(
+            self.device_uuid, int(time.time()) - 1000))
+        self.assertEqual(sum(bucket.get('count') for bucket in request.json),
+                         sum(bucket.get('count') for bucket in rollup.json) + 1)
+        request = self.client().get('/summary/')
+        self.assertEqual(request.json[1].get('number_of_readings'), summary.json[1].get('number_of_readings') + 1)
+
+    def test_device_readings_post_async(self):
+        """
+        The goal is to test that in async mode valid readings are queued (202)
+        and written by the ingest writer, while invalid ones are still rejected (400).
+        """
+        app.config['INGEST_MODE'] = 'async'
+        try:
+            request = self.client().post('/devices/{}/readings/'.format(self.device_uuid), data=
+                json.dumps({
+                    'type': 'temperature',
+                    'value': 100
+                }))
+            self.assertEqual(request.status_code, 202)
+
+            # Invalid readings are still rejected right away
+            request = self.client().post('/devices/{}/readings/'.format(self.device_uuid), data=
+                json.dumps({
+                    'type': 'pressure',
+                    'value': 100
+                }))
+            self.assertEqual(request.status_code, 400)
+
+            with app.app_context():
+                ingest.get_writer().flush()
+
+            # Then the reading should be stored and the cached stats refreshed
+            request = self.client().get('/devices/{}/readings/'.format(self.device_uuid))
+            self.assertEqual(len(request.json), 6)
+            request = self.client().get('/ingest/stats/')
+            self.assertEqual(request.json.get('committed'), 1)
+        finally:
+            with app.app_context():
+                ingest.get_writer().stop()
+            app.extensions.pop('ingest_writer')
+            app.config['INGEST_MODE'] = 'sync'
+
+    def test_export(self):
+        """
+        The goal is to test that we are able to download the readings as CSV or NDJSON.
+        """
+        request = self.client().get('/export/')
+        lines = request.get_data(as_text=True).splitlines()
+
+        # Then we should receive the header and the six readings, oldest first
+        self.assertEqual(request.status_code, 200)
+        self.assertEqual(request.mimetype, 'text/csv')
+        self.assertEqual(lines[0], 'device_uuid,type,value,date_created')
+        self.assertEqual(len(lines), 7)
+
+        # And the filters should apply
+        request = self.client().get('/export/?format=ndjson&device_uuid={}&type=humidity'.format(self.device_uuid))
+        self.assertEqual([json.loads(line).get('value') for line in request.get_data(as_text=True).splitlines()],
+                         [48, 63])
+
+        # And a wrong format or type should be rejected
+        self.assertEqual(self.client().get('/export/?format=xml').status_code, 400)
+        self.assertEqual(self.client().get('/export/?type=pressure').status_code, 400)
+
     def test_summary(self):
         """
         This test should be implemented. The goal is to test that
@@ -207,10 +548,191 @@ class SensorRoutesTestCases(unittest.TestCase):
         # And the response data should have two sensor summaries
         self.assertTrue(len(json.loads(request.data)) == 2 and request.data)
 
+        # And the devices should be ordered by UUID
+        self.assertEqual([summary.get('device_uuid') for summary in request.json], ['other_uuid', self.device_uuid])
+
         # And we are getting the correct summary values
-        self.assertTrue(request.json[0].get('max_reading_value') == 100 and
-                        request.json[0].get('mean_reading_value') == 56.6 and
-                        request.json[0].get('median_reading_value') == 50 and
-                        request.json[0].get('number_of_readings') == 5 and
-                        request.json[0].get('quartile_1_value') == 48.0 and
-                        request.json[0].get('quartile_3_value') == 63.0)
+        summary = request.json[1]
+        self.assertTrue(summary.get('max_reading_value') == 100 and
+                        summary.get('mean_reading_value') == 56.6 and
+                        summary.get('median_reading_value') == 50 and
+                        summary.get('number_of_readings') == 5 and
+                        summary.get('quartile_1_value') == 48.0 and
+                        summary.get('quartile_3_value') == 63.0)
+
+    def test_summary_filters_and_pagination(self):
+        """
+        The goal is to test that we are able to filter the summary by type
+        and to page over the devices.
+        """
+        request = self.client().get('/summary/?type=humidity')
+
+        # Then we should only summarize the humidity readings of the test device
+        self.assertEqual(request.status_code, 200)
+        self.assertEqual(len(request.json), 1)
+        self.assertEqual(request.json[0].get('number_of_readings'), 2)
+        self.assertEqual(request.json[0].get('max_reading_value'), 63)
+
+        # And when we page one device at a time
+        request = self.client().get('/summary/?limit=1')
+        self.assertEqual([summary.get('device_uuid') for summary in request.json], ['other_uuid'])
+        self.assertEqual(request.headers.get('X-Next-Cursor'), 'other_uuid')
+
+        request = self.client().get('/summary/?limit=1&after=other_uuid')
+        self.assertEqual([summary.get('device_uuid') for summary in request.json], [self.device_uuid])
+
+        request = self.client().get('/summary/?limit=1&after={}'.format(self.device_uuid))
+        self.assertEqual(request.json, [])
+
+        # And a limit out of bounds should be rejected
+        request = self.client().get('/summary/?limit={}'.format(10 ** 30))
+        self.assertEqual(request.status_code, 400)
+        self.assertEqual(request.get_data(as_text=True), 'NOT_VALID_LIMIT')
+
+        # And an invalid type should be rejected
+        self.assertEqual(self.client().get('/summary/?type=pressure').status_code, 400)
+
+    def test_devices_stats(self):
+        """
+        The goal is to test that we are able to get the statistics of many
+        devices at once, as answered by the single device endpoints.
+        """
+        devices = [self.device_uuid, 'other_uuid', 'unknown_uuid']
+        request = self.client().post('/devices/stats/', data=json.dumps({'devices': devices}))
+
+        # Then we should receive a 200 with the statistics of every device
+        self.assertEqual(request.status_code, 200)
+        self.assertEqual(sorted(request.json), sorted(devices))
+        for device_uuid in devices[:2]:
+            for statistic in ['max', 'median', 'mean', 'quartiles']:
+                single = self.client().get('/devices/{}/readings/{}/'.format(device_uuid, statistic))
+                self.assertEqual(request.json[device_uuid][statistic], single.json)
+
+        # And a device without readings has no statistics
+        self.assertEqual(request.json['unknown_uuid'], {'max': [], 'median': [], 'mean': {'value': None},
+                                                        'quartiles': {'quartile_1': None, 'quartile_3': None}})
+
+        # And when we filter by type and ask for some statistics only
+        request = self.client().post('/devices/stats/', data=json.dumps({
+            'devices': [self.device_uuid], 'stats': ['max', 'mean'], 'type': 'humidity'}))
+        self.assertEqual(request.json[self.device_uuid]['max'][0].get('value'), 63)
+        self.assertEqual(request.json[self.device_uuid]['mean'], {'value': 55.5})
+        self.assertNotIn('median', request.json[self.device_uuid])
+
+        # And when we filter by date range
+        now = int(time.time())
+        request = self.client().post('/devices/stats/', data=json.dumps({
+            'devices': [self.device_uuid], 'stats': ['median'], 'start_date': now - 120, 'end_date': now - 40}))
+        self.assertEqual([reading.get('value') for reading in request.json[self.device_uuid]['median']], [50])
+
+        # And when we ask for the statistics of each type
+        request = self.client().post('/devices/stats/', data=json.dumps({
+            'devices': [self.device_uuid, 'unknown_uuid'], 'stats': ['max', 'mean'], 'by': 'type'}))
+        self.assertEqual(request.json['unknown_uuid'], {})
+        self.assertEqual(request.json[self.device_uuid]['humidity']['mean'], {'value': 55.5})
+        self.assertEqual(request.json[self.device_uuid]['temperature']['max'][0].get('value'), 100)
+
+        # And invalid requests should be rejected
+        for body, error in [({'devices': ['a'], 'by': 'date'}, 'NOT_VALID_GROUPING'), ({'devices': []}, 'NOT_VALID_DEVICES'), ({'devices': ['a'] * 1001}, 'NOT_VALID_DEVICES'),
+                            ({'devices': [1]}, 'NOT_VALID_DEVICES'),
+                            ({'devices': ['a'], 'stats': ['mode']}, 'NOT_VALID_STATISTIC'),
+                            ({'devices': ['a'], 'type': 'pressure'}, 'NOT_VALID_TYPE'),
+                            ({'devices': ['a'], 'start_date': [1]}, 'NOT_VALID_DATE_RANGE'),
+                            ({'devices': ['a'], 'end_date': 'abc'}, 'NOT_VALID_DATE_RANGE')]:
+            request = self.client().post('/devices/stats/', data=json.dumps(body))
+            self.assertEqual((request.status_code, request.get_data(as_text=True)), (400, error))
+
+    def test_device_readings_batch_post(self):
+        """
+        The goal is to test that we are able to POST a batch of readings
+        at once, getting an accept/reject result for every item.
+        """
+        request = self.client().post('/devices/{}/readings/batch/'.format(self.device_uuid), data=
+            json.dumps([
+                {'type': 'temperature', 'value': 10},
+                {'type': 'humidity', 'value': 101},
+                {'type': 'pressure', 'value': 10},
+                {'type': 'humidity', 'value': 20, 'date_created': int(time.time())}
+            ]))
+
+        # Then we should receive a 201
+        self.assertEqual(request.status_code, 201)
+
+        # And the response data should accept two readings and reject the other two
+        self.assertEqual(request.json.get('accepted'), 2)
+        self.assertEqual(request.json.get('rejected'), 2)
+        self.assertEqual([result.get('error') for result in request.json.get('results')],
+                         [None, 'READING_OUT_OF_RANGE', 'NOT_VALID_TYPE', None])
+
+        # And when we check for readings in the db we should have seven
+        request = self.client().get('/devices/{}/readings/'.format(self.device_uuid))
+        self.assertTrue(len(json.loads(request.data)) == 7)
+
+    def test_device_readings_batch_post_binary(self):
+        """
+        The goal is to test that we are able to POST a batch of readings in the binary layout.
+        """
+        now = int(time.time())
+        body = encode_readings([{'type': 'temperature', 'value': 10, 'date_created': now - 10},
+                                {'type': 'humidity', 'value': 101, 'date_created': now},
+                                {'type': 'humidity', 'value': 20, 'date_created': now}])
+        request = self.client().post('/devices/{}/readings/batch/'.format(self.device_uuid), data=body,
+                                     content_type=BINARY_MIMETYPE)
+
+        # Then we should receive a 201, listing only the rejected reading
+        self.assertEqual(request.status_code, 201)
+        self.assertEqual(request.json, {'accepted': 2, 'rejected': 1, 'results': [
+            {'index': 1, 'status': 'rejected', 'error': 'READING_OUT_OF_RANGE'}]})
+
+        # And the readings should be stored with their dates
+        request = self.client().get('/devices/{}/readings/'.format(self.device_uuid))
+        self.assertEqual(len(request.json), 7)
+        self.assertIn({'device_uuid': self.device_uuid, 'type': 'temperature', 'value': 10, 'date_created': now - 10},
+                      request.json)
+
+        # And a truncated batch should be rejected
+        request = self.client().post('/devices/{}/readings/batch/'.format(self.device_uuid), data=body[:-1],
+                                     content_type=BINARY_MIMETYPE)
+        self.assertEqual(request.status_code, 400)
+
+    def test_device_readings_batch_post_ndjson(self):
+        """
+        The goal is to test that we are able to POST a batch of readings as NDJSON.
+        """
+        body = '\n'.join([json.dumps({'type': 'temperature', 'value': 10}), 'not json',
+                          json.dumps({'type': 'humidity', 'value': 20})])
+        request = self.client().post('/devices/{}/readings/batch/'.format(self.device_uuid), data=body,
+                                     content_type='application/x-ndjson')
+
+        # Then we should receive a 201, accepting two readings and rejecting the malformed line
+        self.assertEqual(request.status_code, 201)
+        self.assertEqual(request.json.get('accepted'), 2)
+        self.assertEqual(request.json.get('results')[1].get('error'), 'NOT_VALID_READING')
+
+        # And an empty batch should be rejected
+        request = self.client().post('/devices/{}/readings/batch/'.format(self.device_uuid), data='[]')
+        self.assertEqual(request.status_code, 400)
+
+    def test_device_readings_date_validation(self):
+        """
+        The goal is to test that the date of a reading must be an epoch time when given,
+        on the single reading and the batch endpoints.
+        """
+        for date_created in ('abc', '1600000000', 1.5, True, None):
+            request = self.client().post('/devices/{}/readings/'.format(self.device_uuid), data=json.dumps({
+                'type': 'humidity', 'value': 10, 'date_created': date_created}))
+            self.assertEqual((request.status_code, request.data), (400, b'NOT_VALID_READING'), date_created)
+
+        request = self.client().post('/devices/{}/readings/batch/'.format(self.device_uuid), data=json.dumps([
+            {'type': 'humidity', 'value': 10, 'date_created': None},
+            {'type': 'humidity', 'value': 10, 'date_created': 'abc'},
+            {'type': 'humidity', 'value': 10, 'date_created': False},
+            {'type': 'humidity', 'value': 10}]))
+
+        # Then only the reading without a date should be stored, dated now
+        self.assertEqual(request.status_code, 201)
+        self.assertEqual([result.get('error') for result in request.json.get('results')],
+                         ['NOT_VALID_READING'] * 3 + [None])
+        request = self.client().get('/devices/{}/readings/'.format(self.device_uuid))
+        self.assertEqual(len(request.json), 6)
+        self.assertLessEqual(int(time.time()) - request.json[-1].get('date_created'), 5)
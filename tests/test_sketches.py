@@ -0,0 +1,153 @@
+import random
+import sqlite3
+import unittest
+
+import numpy as np
+
+from sensors.database import queries
+from sensors.database.migrations import migrate
+from sensors.stats import sketches
+from sensors.stats.sketches import TDigest
+
+DAY = 86400
+
+
+def within_rank_error(values, estimate, q, error):
+    """
+        Whether the estimate lies between the exact quantiles "error" below and above q
+    """
+    return np.quantile(values, max(q - error, 0)) <= estimate <= np.quantile(values, min(q + error, 1))
+
+
+class TDigestTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.random = np.random.default_rng(11)
+
+    def hours(self, distribution, count=200):
+        generators = {
+            'integers': lambda size, hour: self.random.integers(0, 101, size),
+            'normal': lambda size, hour: self.random.normal(50, 10, size),
+            'lognormal': lambda size, hour: self.random.lognormal(0, 2, size),
+            'drift': lambda size, hour: self.random.normal(hour / 10, 3, size),
+            'bimodal': lambda size, hour: np.where(self.random.random(size) < 0.3, self.random.normal(0, 1, size),
+                                                   self.random.normal(1000, 50, size)),
+        }
+        return [generators[distribution](self.random.integers(1, 1000), hour) for hour in range(count)]
+
+    def test_merged_sketches_are_within_the_error_bound(self):
+        for error in (0.05, 0.01):
+            compression = sketches.compression(error)
+            for distribution in ('integers', 'normal', 'lognormal', 'drift', 'bimodal'):
+                hours = self.hours(distribution)
+                # Given the hourly sketches of the readings, stored and read back
+                digests = [TDigest.from_bytes(TDigest.from_values(values, compression).to_bytes()) for values in hours]
+
+                merged = TDigest.merge(digests, compression)
+                values = np.concatenate(hours)
+
+                # Then the merged sketch should be small and its quantiles within the error of numpy.quantile ones
+                self.assertLessEqual(len(merged.means), compression + 1)
+                self.assertEqual(merged.count, len(values))
+                for q in np.linspace(0, 1, 21):
+                    self.assertTrue(within_rank_error(values, merged.quantile(q), q, error),
+                                    (error, distribution, q, merged.quantile(q)))
+                self.assertEqual((merged.quantile(0), merged.quantile(1)), (values.min(), values.max()))
+
+    def test_few_readings_are_exact(self):
+        compression = sketches.compression()
+        for size in (1, 2, 3, 10, 50, 100):
+            values = self.random.integers(0, 101, size)
+            merged = TDigest.merge([TDigest.from_values(values[:size // 2], compression),
+                                    TDigest.from_values(values[size // 2:], compression), TDigest.empty()], compression)
+            for q in (0, 0.25, 0.5, 0.75, 1):
+                self.assertEqual(merged.quantile(q), np.quantile(values, q))
+
+        self.assertIsNone(TDigest.merge([TDigest.empty()], compression).quantile(0.5))
+        self.assertIsNone(TDigest.from_bytes(TDigest.empty().to_bytes()).quantile(0.5))
+
+
+class DeviceQuantilesTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        migrate(self.conn)
+        self.random = random.Random(5)
+        self.compression = sketches.compression()
+        self.readings = [('device_1', self.random.choice(['temperature', 'humidity']), self.random.randint(0, 100),
+                          10 * DAY + self.random.randrange(3 * DAY)) for _ in range(5000)]
+        self.add_readings(self.readings)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def add_readings(self, readings):
+        self.conn.executemany(queries.INSERT_READING, readings)
+        self.conn.commit()
+
+    def quartiles(self, reading_type=None, start_date=None, end_date=None):
+        values = [value for _, row_type, value, date_created in self.readings
+                  if reading_type in (None, row_type) and (start_date is None or date_created >= start_date) and
+                  (end_date is None or date_created <= end_date)]
+        estimates = sketches.device_quantiles(self.conn, 'device_1', [0.25, 0.75], self.compression, reading_type,
+                                              start_date, end_date)
+        return values, estimates
+
+    def test_windows_match_numpy(self):
+        windows = [(None, None), (10 * DAY, 11 * DAY - 1), (10 * DAY + 1234, 12 * DAY + 567),
+                   (11 * DAY + 100, 11 * DAY + 200), (None, 11 * DAY + 5000), (12 * DAY - 1, None)]
+        for reading_type in (None, 'humidity'):
+            for start_date, end_date in windows:
+                values, estimates = self.quartiles(reading_type, start_date, end_date)
+                # Then the estimates should be within the error of the exact quartiles of the window
+                for q, estimate in zip([0.25, 0.75], estimates):
+                    self.assertTrue(within_rank_error(values, estimate, q, sketches.SKETCH_ERROR),
+                                    (reading_type, start_date, end_date, q))
+
+        # And an empty window should have no quartiles
+        self.assertEqual(self.quartiles(start_date=20 * DAY)[1], [None, None])
+
+    def count_sketches(self):
+        return self.conn.execute('select count(*) from readings_sketches').fetchone()[0]
+
+    def test_reads_never_store_sketches(self):
+        self.quartiles(start_date=10 * DAY, end_date=13 * DAY - 1)
+        self.assertEqual(self.count_sketches(), 0)
+        self.assertFalse(self.conn.in_transaction)
+
+    def test_sketches_are_stored_then_invalidated_by_new_readings(self):
+        # Given the sketches of the complete hours stored, but not of the current one
+        hours = self.conn.execute('select count(*) from readings_rollup where width=3600').fetchone()[0]
+        self.add_readings([('device_1', 'humidity', 50, 13 * DAY + 10)])
+        self.readings.append(('device_1', 'humidity', 50, 13 * DAY + 10))
+        self.assertEqual(sketches.store_sketches(self.conn, self.compression, now=13 * DAY + 20, batch_size=7), hours)
+        self.assertEqual(self.count_sketches(), hours)
+        self.assertEqual(sketches.store_sketches(self.conn, self.compression, now=13 * DAY + 20), 0)
+
+        # When readings of a sketched hour arrive
+        new_readings = [('device_1', 'temperature', 100, 11 * DAY + 10)] * 2000
+        self.add_readings(new_readings)
+        self.readings += new_readings
+
+        # Then only the sketch of that hour should be dropped, and sketched in memory with them
+        self.assertEqual(self.count_sketches(), hours - 1)
+        values, (quartile_1, quartile_3) = self.quartiles(start_date=10 * DAY, end_date=14 * DAY - 1)
+        self.assertEqual(quartile_3, 100)
+        self.assertTrue(within_rank_error(values, quartile_1, 0.25, sketches.SKETCH_ERROR))
+        self.assertEqual(self.count_sketches(), hours - 1)
+
+        # And stored again by the next run
+        self.assertEqual(sketches.store_sketches(self.conn, self.compression, now=13 * DAY + 20), 1)
+
+    def test_quantiles_by_type(self):
+        estimates = sketches.device_quantiles(self.conn, 'device_1', [0.5], self.compression,
+                                              start_date=10 * DAY + 1800, by_type=True)
+        self.assertEqual(sorted(estimates), ['humidity', 'temperature'])
+        for reading_type, (median,) in estimates.items():
+            values = [value for _, row_type, value, date_created in self.readings
+                      if row_type == reading_type and date_created >= 10 * DAY + 1800]
+            self.assertTrue(within_rank_error(values, median, 0.5, sketches.SKETCH_ERROR))
+
+
+if __name__ == '__main__':
+    unittest.main()
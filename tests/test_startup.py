@@ -0,0 +1,45 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imports the app in a fresh interpreter, printing the heavy modules it pulled in
+CHILD = '''
+import json, sys
+from wsgi import app
+print(json.dumps([name for name in ['numpy', 'wtforms', 'flask_wtf', 'flask_bootstrap'] if name in sys.modules]))
+'''
+
+
+class StartupTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.directory.name, 'startup.db')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def import_app(self, ui_enabled):
+        environ = dict(os.environ, DATABASE=self.database, UI_ENABLED='true' if ui_enabled else 'false')
+        output = subprocess.run([sys.executable, '-c', CHILD], env=environ, cwd=ROOT, check=True,
+                                stdout=subprocess.PIPE)
+        return json.loads(output.stdout)
+
+    def test_heavy_modules_are_imported_on_demand(self):
+        # Given an API only worker, then importing the app should neither import numpy nor the UI modules
+        self.assertEqual(self.import_app(ui_enabled=False), [])
+
+        # And the UI should only bring its forms and Bootstrap
+        self.assertEqual(self.import_app(ui_enabled=True), ['wtforms', 'flask_wtf', 'flask_bootstrap'])
+
+        # And the database should be left to flask init-db
+        self.assertFalse(os.path.exists(self.database))
+
+
+if __name__ == '__main__':
+    unittest.main()
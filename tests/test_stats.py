@@ -0,0 +1,135 @@
+import random
+import sqlite3
+import statistics
+import unittest
+from collections import Counter
+
+import numpy as np
+
+from sensors.database import queries
+from sensors.database.migrations import migrate
+from sensors.stats import stats
+
+
+def histogram_from_values(values):
+    return sorted(Counter(values).items())
+
+
+def device_summary(cur, device_uuid, reading_type=None):
+    return stats.summarize_histogram(stats.device_histogram(cur, device_uuid, reading_type))
+
+
+class StatsTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        migrate(self.conn)
+        self.random = random.Random(13)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_sql_statistics_match_python_statistics(self):
+        # Given devices with random readings of random sizes
+        for number in range(50):
+            device_uuid = 'device_{}'.format(number)
+            values = [self.random.randint(0, 100) for _ in range(self.random.randint(1, 60))]
+            self.conn.executemany(queries.INSERT_READING, [(device_uuid, 'temperature', value, 0) for value in values])
+
+            # Then the statistics computed in SQL should be the same as statistics/numpy ones
+            summary = device_summary(self.conn.cursor(), device_uuid)
+            self.assertEqual(summary['number_of_readings'], len(values))
+            self.assertEqual(summary['max_reading_value'], max(values))
+            self.assertEqual(summary['median_reading_value'], statistics.median_high(values))
+            self.assertEqual(summary['mean_reading_value'], statistics.mean(values))
+            self.assertEqual(summary['quartile_1_value'], np.quantile(values, 0.25))
+            self.assertEqual(summary['quartile_3_value'], np.quantile(values, 0.75))
+
+        # And the single pass summary should agree with the per device statistics
+        for summary in stats.grouped_summaries(self.conn.cursor()):
+            device_uuid = summary.pop('device_uuid')
+            self.assertEqual(summary, device_summary(self.conn.cursor(), device_uuid))
+
+    def test_histogram_statistics_match_python_statistics(self):
+        # Given random lists of readings over the whole values domain, including the edge cases
+        samples = [[0], [100], [7] * 9, [0, 100], list(range(101))]
+        samples += [[self.random.randint(0, 100) for _ in range(self.random.randint(1, 300))] for _ in range(500)]
+
+        for values in samples:
+            # Then the histogram statistics should be identical to statistics/numpy ones
+            summary = stats.summarize_histogram(histogram_from_values(values))
+            self.assertEqual(summary['number_of_readings'], len(values))
+            self.assertEqual(summary['max_reading_value'], max(values))
+            self.assertEqual(summary['median_reading_value'], statistics.median_high(values))
+            self.assertEqual(summary['mean_reading_value'], statistics.mean(values))
+            self.assertEqual(summary['quartile_1_value'], np.quantile(values, 0.25))
+            self.assertEqual(summary['quartile_3_value'], np.quantile(values, 0.75))
+
+    def test_filtered_summary_uses_the_same_histograms(self):
+        # Given readings of two types
+        self.conn.executemany(queries.INSERT_READING, [('device', self.random.choice(['temperature', 'humidity']),
+                                                        self.random.randint(0, 100), number) for number in range(200)])
+        values = [row[0] for row in self.conn.execute("select value from readings where type='humidity'")]
+
+        # Then the SQL grouped histogram should summarize the same as the one of the raw values
+        summary, = stats.grouped_summaries(self.conn.cursor(), reading_type='humidity')
+        summary.pop('device_uuid')
+        self.assertEqual(summary, stats.summarize_histogram(histogram_from_values(values)))
+
+    def test_per_type_statistics(self):
+        # Given devices with readings of both types
+        self.conn.executemany(queries.INSERT_READING, [
+            ('device_{}'.format(self.random.randrange(5)), self.random.choice(['temperature', 'humidity']),
+             self.random.randint(0, 100), number) for number in range(500)])
+
+        # Then the single pass per type summaries should agree with the per device/type statistics
+        materialized = list(stats.grouped_summaries(self.conn.cursor(), by_type=True))
+        self.assertEqual(len(materialized), 10)
+        for summary in materialized:
+            device_uuid, reading_type = summary.pop('device_uuid'), summary.pop('type')
+            values = [row[0] for row in self.conn.execute('select value from readings where device_uuid=? and type=?',
+                                                          (device_uuid, reading_type))]
+            self.assertEqual(summary, stats.summarize_histogram(histogram_from_values(values)))
+            self.assertEqual(summary, device_summary(self.conn.cursor(), device_uuid, reading_type))
+            self.assertEqual(stats.device_stats(self.conn.cursor(), device_uuid, reading_type),
+                             (len(values), sum(values), min(values), max(values)))
+
+        # And grouping the raw readings should give the same summaries
+        raw = list(stats.grouped_summaries(self.conn.cursor(), start_date=0, by_type=True))
+        self.assertEqual([summary.pop('device_uuid') for summary in raw][::2], ['device_{}'.format(number)
+                                                                               for number in range(5)])
+        self.assertEqual([summary.pop('type') for summary in raw], ['humidity', 'temperature'] * 5)
+        self.assertEqual(raw, materialized)
+
+    def test_device_stats_follow_inserts_and_deletes(self):
+        # Given readings inserted one by one and as a batch
+        self.conn.execute(queries.INSERT_READING, ('device', 'temperature', 40, 0))
+        self.conn.executemany(queries.INSERT_READING, [('device', 'temperature', 10, 0), ('device', 'humidity', 90, 0),
+                                                       ('device', 'temperature', 10, 0)])
+
+        # Then the materialized statistics should include all of them
+        self.assertEqual(stats.device_stats(self.conn.cursor(), 'device'), (4, 150, 10, 90))
+        self.assertEqual(stats.device_histogram(self.conn.cursor(), 'device'), [(10, 2), (40, 1), (90, 1)])
+
+        # And when the max reading is deleted the statistics should follow
+        self.conn.execute('delete from readings where value=90')
+        self.assertEqual(stats.device_stats(self.conn.cursor(), 'device'), (3, 60, 10, 40))
+        self.assertEqual(self.conn.execute('select count(*) from device_stats').fetchone()[0], 1)
+
+    def test_rebuild_device_stats(self):
+        # Given statistics that drifted from the raw readings
+        self.conn.executemany(queries.INSERT_READING, [('device', 'temperature', value, 0) for value in (5, 7, 9)])
+        self.conn.execute('update device_stats set readings_count=0, readings_sum=0')
+        self.conn.execute('delete from device_stats_histogram')
+
+        # Then a rebuild should recompute them
+        stats.rebuild_device_stats(self.conn)
+        self.assertEqual(stats.device_stats(self.conn.cursor(), 'device'), (3, 21, 5, 9))
+        self.assertEqual(device_summary(self.conn.cursor(), 'device')['median_reading_value'], 7)
+
+    def test_empty_device(self):
+        summary = device_summary(self.conn.cursor(), 'missing')
+        self.assertEqual(summary['number_of_readings'], 0)
+        self.assertIsNone(summary['median_reading_value'])
+        self.assertIsNone(summary['mean_reading_value'])
+        self.assertIsNone(summary['quartile_1_value'])
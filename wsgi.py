@@ -1,4 +1,6 @@
 from app import app
+from sensors.database.database import database_path, init_db
 
 if __name__ == "__main__":
+    init_db(database_path(app))
     app.run()